@@ -1,7 +1,62 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, Contact, ConfirmEmailToken
+from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, Contact, ConfirmEmailToken, \
+    PriceHistory, AuthToken, AdminJob, PARTNER_ORDER_STATES, STATE_CHOICES
+from backend.admin_jobs import create_admin_job
+from backend.admin_performance import LargeTableAdminMixin
+from backend.onboarding import onboard_buyers, read_onboarding_csv
+from backend.tasks import load_shop_catalog, run_admin_job
+
+
+def changelist_selection(modeladmin, request, queryset):
+    """
+    Выборка действия для AdminJob.selection. Если отмечены все строки списка и он отобран
+    только фильтрами полей, сохраняются параметры фильтров - строки таблицы не читаются.
+    Для отмеченных строк, поиска и собственных фильтров ModelAdmin сохраняются id строк.
+    """
+    if request.POST.get('select_across') == '1':
+        changelist = modeladmin.get_changelist_instance(request)
+        filter_specs, _, filters, _, _ = changelist.get_filters(request)
+        if not changelist.query and all(isinstance(spec, admin.FieldListFilter) or not spec.used_parameters
+                                        for spec in filter_specs):
+            for spec in filter_specs:
+                filters.update(spec.used_parameters)
+            return {'filters': filters}
+    return {'pks': list(queryset.values_list('pk', flat=True))}
+
+
+def queue_admin_job(modeladmin, request, queryset, action, description, **params):
+    """Передаёт массовое действие задаче Celery вместо выполнения в запросе админки"""
+    job = create_admin_job(request.user, action, description, changelist_selection(modeladmin, request, queryset),
+                           **params)
+    transaction.on_commit(lambda: run_admin_job.delay(job.id))
+    modeladmin.message_user(request, format_html('Задача «{}» поставлена в очередь: <a href="{}">ход выполнения</a>',
+                                                 description, reverse('admin:backend_adminjob_change', args=(job.id,))))
+
+
+def order_state_action(state):
+    label = dict(STATE_CHOICES)[state]
+
+    @admin.action(description=f'Перевести в статус «{label}» в фоне', permissions=('change',))
+    def action(modeladmin, request, queryset):
+        queue_admin_job(modeladmin, request, queryset, 'transition_orders', f'Перевод заказов в статус «{label}»',
+                        state=state)
+
+    action.__name__ = f'set_state_{state}'
+    return action
+
+
+class OnboardingForm(forms.Form):
+    file = forms.FileField(label='CSV с покупателями',
+                           help_text='Колонки: first_name, last_name, email, company, position, password (необязательно)')
 
 
 @admin.register(User)
@@ -17,19 +72,101 @@ class CustomUserAdmin(UserAdmin):
     )
     list_display = ('email', 'first_name', 'last_name', 'is_staff')
     list_filter = ('is_staff', 'is_superuser')
+    change_list_template = 'admin/backend/user/change_list.html'
+    actions = ('activate_users', 'deactivate_users')
+
+    @admin.action(description='Активировать в фоне', permissions=('change',))
+    def activate_users(self, request, queryset):
+        queue_admin_job(self, request, queryset, 'set_users_active', 'Активация пользователей', is_active=True)
+
+    @admin.action(description='Деактивировать в фоне', permissions=('change',))
+    def deactivate_users(self, request, queryset):
+        queue_admin_job(self, request, queryset, 'set_users_active', 'Деактивация пользователей', is_active=False)
+
+    def get_urls(self):
+        return [
+            path('onboard/', self.admin_site.admin_view(self.onboard_view), name='backend_user_onboard'),
+        ] + super().get_urls()
+
+    def onboard_view(self, request):
+        """Массовая регистрация покупателей из CSV одной транзакцией"""
+        if not self.has_add_permission(request):
+            return redirect('admin:backend_user_changelist')
+
+        form = OnboardingForm(request.POST or None, request.FILES or None)
+        errors = {}
+        if request.method == 'POST' and form.is_valid():
+            try:
+                users, errors = onboard_buyers(read_onboarding_csv(form.cleaned_data['file']))
+            except IntegrityError:
+                self.message_user(request, 'Пользователь с таким email уже существует', messages.ERROR)
+            else:
+                if not errors:
+                    self.message_user(request, f'Зарегистрировано покупателей: {len(users)}')
+                    return redirect('admin:backend_user_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Массовая регистрация покупателей',
+            'form': form,
+            # Номера строк CSV считаем с 2: первая строка - заголовок
+            'row_errors': [(index + 2, row_errors) for index, row_errors in sorted(errors.items())],
+        }
+        return TemplateResponse(request, 'admin/backend/user/onboard.html', context)
+
+
+class ShopCategoryFilter(admin.SimpleListFilter):
+    """
+    Магазины с товарами в ветке категорий. Варианты - только корневые категории,
+    отбор через EXISTS, без соединения с M2M и DISTINCT по всему списку.
+    """
+    title = 'Категория'
+    parameter_name = 'category'
+
+    def lookups(self, request, model_admin):
+        return Category.objects.filter(parent__isnull=True).order_by('name').values_list('id', 'name')
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        path = Category.objects.filter(id=self.value()).values_list('path', flat=True).first() or ''
+        return queryset.filter(Exists(Category.shops.through.objects.filter(
+            shop_id=OuterRef('pk'), category__path__startswith=path)))
 
 
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
     list_display = ('name', 'url', 'user', 'state')
-    list_filter = ('state', 'categories')
+    list_filter = ('state', ShopCategoryFilter)
     search_fields = ('name', 'url', 'user__email')
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+    actions = ('load_catalog',)
+
+    @admin.action(description='Первичная загрузка каталога по ссылке')
+    def load_catalog(self, request, queryset):
+        shop_ids = list(queryset.filter(user__isnull=False, url__isnull=False).exclude(url='').values_list('id', flat=True))
+        for shop_id in shop_ids:
+            load_shop_catalog.delay(shop_id)
+        self.message_user(request, f'Загрузка каталога запущена для магазинов: {len(shop_ids)}')
+
+    def save_model(self, request, obj, form, change):
+        # Статус меняется через set_state, чтобы вместе с ним скрыть или показать предложения магазина
+        if change and 'state' in form.changed_data:
+            state, obj.state = obj.state, form.initial['state']
+            super().save_model(request, obj, form, change)
+            Shop.objects.filter(id=obj.id).set_state(state)
+            obj.state = state
+        else:
+            super().save_model(request, obj, form, change)
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     """Настройка для модели Category"""
-    list_display = ('name',)
+    list_display = ('name', 'parent', 'offers_count', 'shops_count')
+    raw_id_fields = ('parent',)
 
 
 @admin.register(Product)  # Регистрация модели Product
@@ -38,56 +175,130 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 @admin.register(ProductInfo)
-class ProductInfoAdmin(admin.ModelAdmin):
+class ProductInfoAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """
     Настройка представления и функционала для модели ProductInfo в админке.
     """
     list_display = ('product', 'shop', 'external_id', 'model', 'price', 'quantity', 'price_rrc')
-    search_fields = ('product__name', 'shop__name', 'external_id', 'model')
-    list_filter = ('shop', 'product__category')
-    ordering = ('product',)
+    # Поиск по названиям идёт по триграммным индексам, внешний ID - точным совпадением
+    search_fields = ('product__name', 'shop__name', 'model')
+    # Фильтр по дате вместо date_hierarchy: та выбирает все различные даты таблицы
+    list_filter = ('shop', 'product__category', 'updated_at')
     readonly_fields = ('price_rrc',)
     autocomplete_fields = ('product', 'shop')
     save_on_top = True
-    date_hierarchy = 'updated_at'  # Предполагая, что поле создано
     list_per_page = 20
     list_select_related = ('product', 'shop')
-    show_full_result_count = False
+    actions = ('delete_in_background',)
+
+    def get_actions(self, request):
+        # Стандартное удаление собирает предложения и весь каскад в памяти запроса
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Удалить в фоне', permissions=('delete',))
+    def delete_in_background(self, request, queryset):
+        queue_admin_job(self, request, queryset, 'delete_offers', 'Удаление предложений')
+
+    def get_search_results(self, request, queryset, search_term):
+        found, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term.isdigit():
+            # queryset уже отобран фильтрами списка - совпадение по внешнему ID их не обходит
+            found |= queryset.filter(external_id=search_term)
+        return found, may_have_duplicates
+
+
+@admin.register(PriceHistory)
+class PriceHistoryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    """Настройка для модели PriceHistory"""
+    list_display = ('product_info', 'shop', 'external_id', 'dt', 'period', 'price', 'price_min', 'price_max',
+                    'quantity')
+    list_filter = ('period',)
+    raw_id_fields = ('product_info', 'shop')
+    list_select_related = ('product_info__product', 'shop')
 
 
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
     """Настройка для модели Parameter"""
     list_display = ('name',)
+    search_fields = ('name',)  # Необходимо для поддержки autocomplete_fields
 
 
 @admin.register(ProductParameter)
-class ProductParameterAdmin(admin.ModelAdmin):
+class ProductParameterAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Настройка для модели ProductParameter"""
     list_display = ('product_info', 'parameter', 'value')
+    raw_id_fields = ('product_info',)
+    autocomplete_fields = ('parameter',)
+    list_select_related = ('product_info', 'parameter')
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Настройка для модели Order"""
     list_display = ('user', 'dt', 'state', 'contact')
     list_filter = ('state', 'dt')
-    ordering = ('-dt',)
+    raw_id_fields = ('user', 'contact')
+    list_select_related = ('user', 'contact')
+    actions = [order_state_action(state) for state in PARTNER_ORDER_STATES]
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Настройка для модели OrderItem"""
-    list_display = ('order', 'product_info', 'quantity')
+    list_display = ('order', 'product_info', 'quantity', 'state', 'stock_deducted')
+    list_filter = ('state',)
+    raw_id_fields = ('order', 'product_info')
+    list_select_related = ('order', 'product_info')
 
 
 @admin.register(Contact)
 class ContactAdmin(admin.ModelAdmin):
     """Настройка для модели Contact"""
     list_display = ('user', 'city', 'phone')
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
 
 
 @admin.register(ConfirmEmailToken)
 class ConfirmEmailTokenAdmin(admin.ModelAdmin):
     """Настройка для модели ConfirmEmailToken"""
-    list_display = ('user', 'key', 'created_at',)
\ No newline at end of file
+    list_display = ('user', 'key', 'created_at',)
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+
+
+@admin.register(AuthToken)
+class AuthTokenAdmin(admin.ModelAdmin):
+    """Настройка для модели AuthToken"""
+    list_display = ('user', 'device', 'created_at', 'expires_at')
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+    exclude = ('digest',)
+
+    def has_add_permission(self, request):
+        # Токены выдаются только при входе: ключ известен лишь клиенту
+        return False
+
+
+@admin.register(AdminJob)
+class AdminJobAdmin(admin.ModelAdmin):
+    """Настройка для модели AdminJob: только просмотр хода выполнения"""
+    list_display = ('description', 'user', 'state', 'progress', 'created_at', 'finished_at')
+    list_filter = ('state',)
+    list_select_related = ('user',)
+    exclude = ('selection',)
+
+    @admin.display(description='Прогресс')
+    def progress(self, obj):
+        if not obj.total:
+            return '-'
+        return f'{obj.processed} из {obj.total} ({obj.processed * 100 // obj.total}%)'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
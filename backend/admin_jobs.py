@@ -0,0 +1,107 @@
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from backend.authentication import token_cache
+from backend.basket import forget_offer_basket_summaries
+from backend.importer import price_imported
+from backend.models import AdminJob, AuthToken, Order, ProductInfo, Shop, User
+
+
+def delete_offers(pks, params):
+    """Удаляет предложения вместе с параметрами и позициями заказов; история цен остаётся за магазином."""
+    shop_ids = set(ProductInfo.objects.filter(id__in=pks).values_list('shop_id', flat=True).distinct())
+    forget_offer_basket_summaries(pks)
+    ProductInfo.objects.filter(id__in=pks).delete()
+    # Прайс магазина больше не совпадает с базой: следующая загрузка того же файла должна пройти целиком
+    Shop.objects.filter(id__in=shop_ids).update(price_digest='')
+    ProductInfo.objects.filter(shop_id__in=shop_ids).update(digest='')
+    return shop_ids
+
+
+def transition_orders(pks, params):
+    """Переводит заказы в статус params['state'], недопустимые переходы пропускаются."""
+    order_ids = Order.objects.filter(id__in=pks).transition(params['state'])
+    if order_ids:
+        # Импорт внутри функции: tasks импортирует этот модуль
+        from backend.tasks import notify_order_state
+        transaction.on_commit(lambda: notify_order_state.delay(order_ids))
+    return set()
+
+
+def set_users_active(pks, params):
+    """Включает или отключает пользователей и сбрасывает кэш их токенов."""
+    User.objects.filter(id__in=pks).update(is_active=params['is_active'])
+    token_cache.invalidate(*AuthToken.objects.filter(user_id__in=pks).values_list('digest', flat=True))
+    return set()
+
+
+# Действие: (модель выборки, обработчик одной пачки id). Обработчик возвращает id магазинов,
+# каталог которых изменился, - их кэши сбрасываются после завершения задачи
+ADMIN_JOB_ACTIONS = {
+    'delete_offers': (ProductInfo, delete_offers),
+    'transition_orders': (Order, transition_orders),
+    'set_users_active': (User, set_users_active),
+}
+
+
+def create_admin_job(user, action, description, selection, **params):
+    """Сохраняет задачу по выборке админки: {'pks': [...]} или {'filters': {...}}."""
+    selection_filter(selection)
+    return AdminJob.objects.create(user=user, action=action, description=description,
+                                   selection=selection, params=params)
+
+
+def selection_filter(selection):
+    """
+    Условие выборки задачи: id отмеченных строк (pks) или параметры фильтров
+    списка (filters: {поиск ORM: [значения]}), значения одного параметра - через ИЛИ.
+    """
+    if 'pks' in selection:
+        return Q(pk__in=selection['pks'])
+    if 'filters' in selection:
+        return reduce(and_, (reduce(or_, (Q((lookup, value)) for value in values))
+                             for lookup, values in selection['filters'].items()), Q())
+    raise ValueError('У задачи не сохранена выборка')
+
+
+def job_queryset(job):
+    model, _ = ADMIN_JOB_ACTIONS[job.action]
+    return model._default_manager.filter(selection_filter(job.selection))
+
+
+def execute_admin_job(job):
+    """
+    Выполняет задачу пачками по ADMIN_JOB_CHUNK_SIZE объектов, каждая - в своей
+    транзакции. Очередная пачка выбирается по ключу (id больше последнего
+    обработанного), прогресс записывается после каждой пачки.
+    """
+    _, process = ADMIN_JOB_ACTIONS[job.action]
+    shop_ids = set()
+    last_pk = None
+    try:
+        queryset = job_queryset(job)
+        AdminJob.objects.filter(id=job.id).update(state='running', total=queryset.count())
+        while True:
+            chunk = queryset.order_by('pk')
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            pks = list(chunk.values_list('pk', flat=True)[:settings.ADMIN_JOB_CHUNK_SIZE])
+            if not pks:
+                break
+            with transaction.atomic():
+                shop_ids |= process(pks, job.params)
+                AdminJob.objects.filter(id=job.id).update(processed=F('processed') + len(pks))
+            last_pk = pks[-1]
+    except Exception as err:
+        AdminJob.objects.filter(id=job.id).update(state='failed', error=str(err), finished_at=timezone.now())
+        raise
+    finally:
+        for shop_id in shop_ids:
+            price_imported.send(sender=Shop, shop_id=shop_id)
+
+    AdminJob.objects.filter(id=job.id).update(state='done', finished_at=timezone.now())
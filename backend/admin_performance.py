@@ -0,0 +1,128 @@
+import json
+
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Параметр постраничного вывода по ключу: ?after=<id последней строки предыдущей страницы>
+AFTER_VAR = 'after'
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк по статистике PostgreSQL: reltuples таблицы для списка
+    без фильтров, иначе оценка планировщика. None, если оценка недоступна.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            rows = cursor.fetchone()[0]
+        else:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            rows = plan[0]['Plan']['Plan Rows']
+    # Таблица ещё ни разу не анализировалась
+    return rows if rows >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без COUNT(*) по большим таблицам: если оценка не меньше
+    ADMIN_EXACT_COUNT_LIMIT, выводится она, иначе строки считаются точно.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= settings.ADMIN_EXACT_COUNT_LIMIT:
+            self.estimated = True
+            return estimate
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Список объектов с переходом на следующую страницу по ключу (WHERE id < after)
+    вместо OFFSET, который на дальних страницах перебирает все предыдущие строки.
+
+    Работает при сортировке только по первичному ключу; при сортировке по другой
+    колонке список листается как обычно.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = request.GET.get(AFTER_VAR)
+        self.keyset = None
+        self.next_page_url = None
+        self.first_page_url = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Смена фильтра, сортировки или поиска начинает список с первой страницы
+        return super().get_query_string(new_params, [*(remove or ()), AFTER_VAR])
+
+    def keyset_direction(self):
+        # ChangeList может дописать тот же ключ несколько раз
+        ordering = list(dict.fromkeys(self.queryset.query.order_by))
+        if len(ordering) != 1 or not isinstance(ordering[0], str):
+            return None
+        field = ordering[0].removeprefix('-')
+        if field not in ('pk', self.lookup_opts.pk.name):
+            return None
+        return 'lt' if ordering[0].startswith('-') else 'gt'
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.keyset = self.keyset_direction()
+        if self.keyset is None or (self.show_all and self.can_show_all):
+            return
+
+        queryset = self.queryset
+        if self.after is not None:
+            try:
+                after = self.lookup_opts.pk.to_python(self.after)
+            except ValidationError as err:
+                raise IncorrectLookupParameters(err)
+            queryset = queryset.filter(**{f'pk__{self.keyset}': after})
+            self.first_page_url = self.get_query_string()
+
+        # Лишний ключ показывает, есть ли следующая страница
+        pks = list(queryset.values_list('pk', flat=True)[:self.list_per_page + 1])
+        if len(pks) > self.list_per_page:
+            self.next_page_url = self.get_query_string({AFTER_VAR: pks[self.list_per_page - 1]})
+        self.result_list = queryset[:self.list_per_page]
+        self.multi_page = bool(self.next_page_url or self.first_page_url)
+
+
+class LargeTableAdminMixin:
+    """
+    Настройки ModelAdmin для таблиц на миллионы строк: оценка числа строк
+    вместо COUNT(*), постраничный вывод по ключу и сортировка по id по умолчанию.
+
+    Внешние ключи нужно выводить через raw_id_fields или autocomplete_fields,
+    связанные колонки списка - через list_select_related.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+    change_list_template = 'admin/backend/change_list_keyset.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,128 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from backend.models import Category, Product, ProductInfo, Shop
+
+TABLES = {
+    'product': Product._meta.db_table,
+    'product_info': ProductInfo._meta.db_table,
+    'shop': Shop._meta.db_table,
+}
+
+# Предложения активных магазинов, которые есть в наличии, с номером по цене внутри товара.
+# Медиана считается по средним позициям, поэтому запрос одинаково работает в PostgreSQL и SQLite.
+RANKED_OFFERS_SQL = """
+    SELECT pi.product_id, pi.shop_id, pi.price, pi.price_rrc,
+           ROW_NUMBER() OVER (PARTITION BY pi.product_id ORDER BY pi.price, pi.id) AS position,
+           COUNT(*) OVER (PARTITION BY pi.product_id) AS offers
+    FROM {product_info} pi
+    JOIN {product} p ON p.id = pi.product_id
+    WHERE pi.is_visible AND pi.quantity > 0 {condition}
+"""
+
+PRODUCT_PRICES_SQL = """
+    WITH ranked AS ({ranked}),
+    stats AS (
+        SELECT product_id,
+               MAX(offers) AS offers,
+               MIN(price) AS price_min,
+               AVG(CASE WHEN position IN ((offers + 1) / 2, (offers + 2) / 2) THEN price END) AS price_median,
+               MAX(price) AS price_max,
+               AVG((price_rrc - price) * 100.0 / NULLIF(price_rrc, 0)) AS margin_avg,
+               MAX(CASE WHEN position = 1 THEN shop_id END) AS cheapest_shop_id,
+               MAX(CASE WHEN position = 1 THEN price_rrc - price END) AS cheapest_margin
+        FROM ranked
+        GROUP BY product_id
+    )
+    SELECT st.product_id, p.name, st.offers, st.price_min, st.price_median, st.price_max,
+           st.margin_avg, st.cheapest_shop_id, s.name, st.cheapest_margin
+    FROM stats st
+    JOIN {product} p ON p.id = st.product_id
+    JOIN {shop} s ON s.id = st.cheapest_shop_id
+    ORDER BY p.name, st.product_id
+"""
+
+SHOP_PRICES_SQL = """
+    WITH ranked AS ({ranked})
+    SELECT r.shop_id, s.name,
+           COUNT(*) AS offers,
+           AVG((r.price_rrc - r.price) * 100.0 / NULLIF(r.price_rrc, 0)) AS margin_avg,
+           SUM(CASE WHEN r.position = 1 THEN 1 ELSE 0 END) AS cheapest_offers
+    FROM ranked r
+    JOIN {shop} s ON s.id = r.shop_id
+    GROUP BY r.shop_id, s.name
+    ORDER BY s.name, r.shop_id
+"""
+
+
+def percent(value):
+    return None if value is None else round(float(value), 2)
+
+
+def product_price_stats(category_id):
+    """
+    Цены товара категории по магазинам: мин./медиана/макс., средняя наценка
+    до рекомендуемой цены (%) и самое дешёвое предложение - одним запросом в базе.
+    """
+    ranked = RANKED_OFFERS_SQL.format(condition='AND p.category_id = %s', **TABLES)
+    with connection.cursor() as cursor:
+        cursor.execute(PRODUCT_PRICES_SQL.format(ranked=ranked, **TABLES), [category_id])
+        rows = cursor.fetchall()
+    return [{
+        'product_id': product_id,
+        'name': name,
+        'offers': offers,
+        'price_min': price_min,
+        'price_median': percent(price_median),
+        'price_max': price_max,
+        'margin_avg': percent(margin_avg),
+        'cheapest_shop': {'id': shop_id, 'name': shop_name, 'margin': cheapest_margin},
+    } for (product_id, name, offers, price_min, price_median, price_max, margin_avg,
+           shop_id, shop_name, cheapest_margin) in rows]
+
+
+def shop_price_stats():
+    """Сводка по магазинам: число предложений, средняя наценка (%) и сколько из них самые дешёвые."""
+    with connection.cursor() as cursor:
+        cursor.execute(SHOP_PRICES_SQL.format(ranked=RANKED_OFFERS_SQL.format(condition='', **TABLES), **TABLES))
+        rows = cursor.fetchall()
+    return [{'shop_id': shop_id, 'name': name, 'offers': offers, 'margin_avg': percent(margin_avg),
+             'cheapest_offers': cheapest_offers}
+            for shop_id, name, offers, margin_avg, cheapest_offers in rows]
+
+
+def analytics_cache_key(report, *args):
+    # Версия меняется после каждой загрузки прайса, старые отчёты просто истекают
+    version = cache.get_or_set('analytics-version', time.time_ns, None)
+    return ':'.join(['analytics', str(version), report, *map(str, args)])
+
+
+def cached_report(report, build, *args):
+    key = analytics_cache_key(report, *args)
+    result = cache.get(key)
+    if result is None:
+        result = build(*args)
+        cache.set(key, result, settings.ANALYTICS_CACHE_TIMEOUT)
+    return result
+
+
+def get_product_price_stats(category_id):
+    return cached_report('products', product_price_stats, category_id)
+
+
+def get_shop_price_stats():
+    return cached_report('shops', shop_price_stats)
+
+
+def rebuild_price_analytics(shop_id):
+    """
+    Сбрасывает отчёты после загрузки прайса магазина и заново строит
+    отчёты по его категориям, чтобы первый запрос не ждал расчёта.
+    """
+    cache.set('analytics-version', time.time_ns(), None)
+    get_shop_price_stats()
+    for category_id in Category.objects.filter(shops=shop_id).values_list('id', flat=True):
+        get_product_price_stats(category_id)
@@ -8,3 +8,4 @@ class BackendConfig(AppConfig):
         """
         импортируем сигналы
         """
+        import backend.signals  # noqa: F401
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from backend.models import AuthToken, Shop, User
+
+# Поля пользователя, которые хранятся в снимке; остальные догружаются при обращении
+SNAPSHOT_FIELDS = ('id', 'email', 'type', 'is_active', 'is_staff', 'is_superuser')
+
+
+class TokenCache:
+    """
+    Кэш снимков пользователей по хэшу токена: LRU в памяти процесса и общий кэш (Redis).
+
+    Локальная копия живёт TOKEN_CACHE_LOCAL_TTL секунд, поэтому другие
+    процессы узнают об инвалидации не позже, чем через это время.
+    """
+    cache_prefix = 'auth-token:'
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def cache_key(cls, digest):
+        return cls.cache_prefix + digest
+
+    def get(self, digest):
+        with self._lock:
+            item = self._local.get(digest)
+            if item is not None:
+                if item[0] > monotonic():
+                    self._local.move_to_end(digest)
+                    return item[1]
+                del self._local[digest]
+
+        snapshot = cache.get(self.cache_key(digest))
+        if snapshot is not None:
+            self._remember(digest, snapshot)
+        return snapshot
+
+    def set(self, digest, snapshot):
+        cache.set(self.cache_key(digest), snapshot, settings.TOKEN_CACHE_TTL)
+        self._remember(digest, snapshot)
+
+    def _remember(self, digest, snapshot):
+        with self._lock:
+            self._local[digest] = (monotonic() + settings.TOKEN_CACHE_LOCAL_TTL, snapshot)
+            self._local.move_to_end(digest)
+            while len(self._local) > settings.TOKEN_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def invalidate(self, *digests):
+        with self._lock:
+            for digest in digests:
+                self._local.pop(digest, None)
+        cache.delete_many([self.cache_key(digest) for digest in digests])
+
+    def invalidate_user(self, user_id):
+        self.invalidate(*AuthToken.objects.filter(user_id=user_id).values_list('digest', flat=True))
+
+
+token_cache = TokenCache()
+
+
+def snapshot_user(snapshot):
+    """
+    Собирает пользователя из снимка без запроса к базе.
+
+    Поля вне снимка отложены и догружаются из базы при обращении, save()
+    такого объекта записывает только загруженные поля. Магазин пользователя
+    (user.shop) кладётся в кэш связи, у него загружен только id.
+    """
+    # from_db ожидает значения в порядке полей модели
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in SNAPSHOT_FIELDS]
+    user = User.from_db(DEFAULT_DB_ALIAS, fields, [snapshot[field] for field in fields])
+    shop = None
+    if snapshot['shop_id'] is not None:
+        shop = Shop.from_db(DEFAULT_DB_ALIAS, ['id', 'user_id'], [snapshot['shop_id'], user.id])
+        Shop._meta.get_field('user').set_cached_value(shop, user)
+    User._meta.get_field('shop').set_cached_value(user, shop)
+    return user
+
+
+def revoke_tokens(user_id, digests=None):
+    """Отзывает токены пользователя: все или только перечисленные."""
+    tokens = AuthToken.objects.filter(user_id=user_id)
+    if digests is not None:
+        tokens = tokens.filter(digest__in=digests)
+    token_cache.invalidate(*tokens.values_list('digest', flat=True))
+    return tokens.delete()[0]
+
+
+def load_full_user(user):
+    """Догружает одним запросом все поля пользователя, собранного из снимка."""
+    deferred_fields = user.get_deferred_fields()
+    if deferred_fields:
+        user.refresh_from_db(fields=deferred_fields)
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токенам AuthToken без запросов к базе в типичном случае:
+    пользователь (id, тип, активность, id магазина) и срок действия токена
+    берутся из кэша снимков. Срок продлевается не чаще AUTH_TOKEN_RENEW_INTERVAL.
+    """
+
+    def authenticate_credentials(self, key):
+        digest = AuthToken.hash_key(key)
+        snapshot = token_cache.get(digest)
+        if snapshot is None:
+            row = AuthToken.objects.filter(digest=digest).values(
+                'expires_at', *(f'user__{field}' for field in SNAPSHOT_FIELDS), 'user__shop__id'
+            ).first()
+            if row is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            snapshot = {field: row[f'user__{field}'] for field in SNAPSHOT_FIELDS}
+            snapshot.update(shop_id=row['user__shop__id'], expires_at=row['expires_at'])
+            token_cache.set(digest, snapshot)
+
+        now = timezone.now()
+        if snapshot['expires_at'] <= now:
+            raise AuthenticationFailed('Срок действия токена истёк.')
+        if not snapshot['is_active']:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+
+        # Скользящий срок: пишем в базу, только если с прошлого продления прошло достаточно времени
+        expires_at = now + settings.AUTH_TOKEN_TTL
+        if expires_at - snapshot['expires_at'] >= settings.AUTH_TOKEN_RENEW_INTERVAL:
+            AuthToken.objects.filter(digest=digest).update(expires_at=expires_at)
+            snapshot = {**snapshot, 'expires_at': expires_at}
+            token_cache.set(digest, snapshot)
+
+        return snapshot_user(snapshot), digest
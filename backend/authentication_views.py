@@ -1,10 +1,10 @@
 from django.contrib.auth import authenticate
-from django.http import JsonResponse
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.authtoken.models import Token
 from backend.serializers import UserSerializer, ConfirmEmailTokenSerializer
 from backend.models import ConfirmEmailToken
+from backend.renderers import JsonResponse
 from backend.tasks import send_email
 
 class RegisterAccount(APIView):
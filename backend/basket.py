@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.models import Order, OrderItem
+
+
+def summary_cache_key(user_id):
+    return f'basket-summary:{user_id}'
+
+
+def build_basket_summary(user_id):
+    """
+    Считает сводку корзины: число позиций, сумму, итоги по магазинам и
+    предупреждения об остатках - одним запросом по позициям корзины.
+    """
+    items = OrderItem.objects.filter(order__user_id=user_id, order__state='basket').order_by('id').values_list(
+        'id', 'product_info_id', 'quantity', 'product_info__price', 'product_info__quantity',
+        'product_info__shop_id', 'product_info__shop__name', 'product_info__shop__state')
+
+    summary = {'lines': 0, 'quantity': 0, 'total': 0, 'shops': [], 'warnings': []}
+    shops = {}
+    for item_id, offer_id, quantity, price, stock, shop_id, shop_name, shop_state in items:
+        summary['lines'] += 1
+        summary['quantity'] += quantity
+        summary['total'] += quantity * price
+        if shop_id not in shops:
+            shops[shop_id] = {'id': shop_id, 'name': shop_name, 'lines': 0, 'total': 0}
+            summary['shops'].append(shops[shop_id])
+        shops[shop_id]['lines'] += 1
+        shops[shop_id]['total'] += quantity * price
+
+        if not shop_state:
+            summary['warnings'].append({'item': item_id, 'product_info': offer_id, 'reason': 'shop_closed'})
+        elif quantity > stock:
+            summary['warnings'].append({'item': item_id, 'product_info': offer_id, 'reason': 'stock',
+                                        'requested': quantity, 'available': stock})
+    return summary
+
+
+def get_basket_summary(user_id):
+    summary = cache.get(summary_cache_key(user_id))
+    if summary is None:
+        summary = refresh_basket_summary(user_id)
+    return summary
+
+
+def refresh_basket_summary(user_id):
+    """Пересчитывает сводку после изменения корзины, чтобы следующее чтение не шло в базу."""
+    summary = build_basket_summary(user_id)
+    cache.set(summary_cache_key(user_id), summary, settings.BASKET_SUMMARY_TIMEOUT)
+    return summary
+
+
+def forget_basket_summary(user_id):
+    cache.delete(summary_cache_key(user_id))
+
+
+def forget_shop_basket_summaries(shop_id):
+    """Сбрасывает сводки корзин, в которых есть предложения магазина (цены или остатки изменились)."""
+    user_ids = Order.objects.filter(state='basket', ordered_items__product_info__shop_id=shop_id).values_list(
+        'user_id', flat=True).distinct()
+    cache.delete_many([summary_cache_key(user_id) for user_id in user_ids])
+
+
+def forget_offer_basket_summaries(offer_ids):
+    """
+    Сбрасывает после фиксации сводки корзин с удаляемыми предложениями. Позиции корзин
+    удаляются вместе с предложениями, поэтому владельцы корзин ищутся до удаления.
+    """
+    user_ids = list(Order.objects.filter(state='basket', ordered_items__product_info_id__in=offer_ids).values_list(
+        'user_id', flat=True).distinct())
+    if user_ids:
+        transaction.on_commit(lambda: cache.delete_many([summary_cache_key(user_id) for user_id in user_ids]))
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from backend.models import Category, ProductInfo
+
+CATEGORY_TREE_KEY = 'category-tree'
+
+
+def active_offers():
+    """Предложения, которые видит покупатель: в наличии у магазина, принимающего заказы."""
+    return ProductInfo.objects.filter(is_visible=True, quantity__gt=0)
+
+
+def update_category_counts(category_ids):
+    """
+    Пересчитывает счётчики предложений и магазинов для категорий и всех их предков.
+
+    Пары (категория, магазин) поддеревьев читаются одним агрегирующим запросом,
+    сумма по поддереву собирается по материализованному пути.
+    """
+    paths = Category.objects.filter(id__in=category_ids).values_list('path', flat=True)
+    affected_ids = {int(category_id) for path in paths for category_id in path.strip('/').split('/') if category_id}
+    affected = list(Category.objects.filter(id__in=affected_ids))
+    if not affected:
+        return
+
+    subtree = Q()
+    for category in affected:
+        subtree |= Q(path__startswith=category.path)
+    category_paths = dict(Category.objects.filter(subtree).values_list('id', 'path'))
+    pairs = active_offers().filter(product__category_id__in=category_paths).values(
+        'product__category_id', 'shop_id').annotate(offers=Count('id'))
+
+    counts = {category.id: [0, set()] for category in affected}
+    for pair in pairs:
+        for ancestor_id in category_paths[pair['product__category_id']].strip('/').split('/'):
+            if int(ancestor_id) in counts:
+                counts[int(ancestor_id)][0] += pair['offers']
+                counts[int(ancestor_id)][1].add(pair['shop_id'])
+
+    changed = []
+    for category in affected:
+        offers_count, shops = counts[category.id]
+        if (category.offers_count, category.shops_count) != (offers_count, len(shops)):
+            category.offers_count, category.shops_count = offers_count, len(shops)
+            changed.append(category)
+    if changed:
+        Category.objects.bulk_update(changed, ['offers_count', 'shops_count'])
+        forget_category_tree()
+
+
+def update_shop_category_counts(shop_id):
+    update_category_counts(Category.objects.filter(shops=shop_id).values_list('id', flat=True))
+
+
+def build_category_tree():
+    """Дерево категорий со счётчиками - одним запросом, упорядоченным по пути."""
+    nodes = {}
+    tree = []
+    for category_id, name, parent_id, offers_count, shops_count in Category.objects.order_by('path').values_list(
+            'id', 'name', 'parent_id', 'offers_count', 'shops_count'):
+        node = nodes[category_id] = {'id': category_id, 'name': name, 'offers': offers_count,
+                                     'shops': shops_count, 'children': []}
+        # При сортировке по пути предок всегда идёт раньше потомков
+        if parent_id in nodes:
+            nodes[parent_id]['children'].append(node)
+        else:
+            tree.append(node)
+
+    for children in [tree] + [node['children'] for node in nodes.values()]:
+        children.sort(key=lambda node: node['name'])
+    return tree
+
+
+def get_category_tree():
+    return cache.get_or_set(CATEGORY_TREE_KEY, build_category_tree, settings.CATEGORY_TREE_TIMEOUT)
+
+
+def forget_category_tree():
+    cache.delete(CATEGORY_TREE_KEY)
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+
+from backend.models import Category, ProductInfo
+
+# Сколько предложений читается из серверного курсора за один раз
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_goods(shop_id, category_id=None):
+    """
+    Отдаёт предложения магазина в схеме прайса (как в PartnerUpdate), не загружая их в память разом.
+    """
+    compact = settings.PRODUCT_PARAMETERS_STORAGE == 'compact'
+    offers = ProductInfo.objects.filter(shop_id=shop_id).select_related('product').order_by('id')
+    if category_id:
+        offers = offers.filter(product__category_id=category_id)
+    if not compact:
+        offers = offers.prefetch_related('product_parameters__parameter')
+
+    for offer in offers.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        if compact:
+            parameters = offer.parameters
+        else:
+            parameters = {product_parameter.parameter.name: product_parameter.value
+                          for product_parameter in offer.product_parameters.all()}
+        yield {
+            'id': offer.external_id,
+            'category': offer.product.category_id,
+            'model': offer.model,
+            'name': offer.product.name,
+            'price': offer.price,
+            'price_rrc': offer.price_rrc,
+            'quantity': offer.quantity,
+            'parameters': parameters,
+        }
+
+
+def export_yaml(shop, category_id=None):
+    import yaml
+
+    categories = Category.objects.filter(shops=shop).order_by('id')
+    if category_id:
+        categories = categories.filter(id=category_id)
+
+    yield yaml.safe_dump({'shop': shop.name}, allow_unicode=True)
+    yield yaml.safe_dump({'categories': list(categories.values('id', 'name'))}, allow_unicode=True, sort_keys=False)
+    yield 'goods:\n'
+    for good in iter_goods(shop.id, category_id):
+        yield yaml.safe_dump([good], allow_unicode=True, sort_keys=False)
+
+
+def export_csv(shop, category_id=None):
+    columns = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity', 'parameters')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for good in iter_goods(shop.id, category_id):
+        good['parameters'] = json.dumps(good['parameters'], ensure_ascii=False)
+        writer.writerow(good[column] for column in columns)
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_jsonl(shop, category_id=None):
+    for good in iter_goods(shop.id, category_id):
+        yield json.dumps(good, ensure_ascii=False) + '\n'
+
+
+# Формат выгрузки: (генератор, content type, расширение файла)
+EXPORT_FORMATS = {
+    'yaml': (export_yaml, 'application/x-yaml', 'yaml'),
+    'csv': (export_csv, 'text/csv', 'csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson', 'jsonl'),
+}
+
+
+def export_catalog(shop, file_format, category_id=None, compress=True):
+    """
+    Генератор байтовых кусков выгрузки каталога магазина.
+
+    При compress=True поток сжимается gzip по мере генерации.
+    """
+    chunks = (chunk.encode() for chunk in EXPORT_FORMATS[file_format][0](shop, category_id))
+    if not compress:
+        yield from chunks
+        return
+
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_filename(shop, file_format, category_id=None, compress=True):
+    name = f'shop-{shop.id}'
+    if category_id:
+        name += f'-category-{category_id}'
+    name += '.' + EXPORT_FORMATS[file_format][2]
+    return name + '.gz' if compress else name
@@ -0,0 +1,77 @@
+import json
+import time
+from functools import wraps
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from backend.renderers import JsonResponse
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    """Хэш тела запроса: повтор с тем же ключом должен нести те же данные."""
+    return sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def idempotent(view_method):
+    """
+    Декоратор метода APIView: повтор запроса с тем же заголовком Idempotency-Key
+    получает сохранённый ответ первого запроса вместо повторного выполнения.
+
+    Ответ хранится в кэше IDEMPOTENCY_KEY_TTL секунд по пользователю, представлению
+    и ключу. Пока первый запрос выполняется, дубликаты ждут его ответ не дольше
+    IDEMPOTENCY_WAIT секунд, затем получают 409. Ответы с ошибкой сервера не
+    сохраняются, чтобы запрос можно было повторить.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        cache_key = 'idempotency:{}:{}:{}'.format(
+            request.user.pk, type(self).__name__, sha256(key.encode()).hexdigest())
+        fingerprint = request_fingerprint(request)
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while not cache.add(cache_key + ':lock', 1, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+            if time.monotonic() > deadline:
+                return JsonResponse({'Status': False, 'Errors': 'Запрос с этим ключом ещё выполняется'}, status=409)
+            time.sleep(0.05)
+
+        try:
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+
+            response = view_method(self, request, *args, **kwargs)
+            # Сохраняем только готовые ответы (JsonResponse), без ответов DRF, которые ещё не отрисованы
+            if response.status_code < 500 and getattr(response, 'is_rendered', True) and not response.streaming:
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'content_type': response['Content-Type'],
+                    'content': response.content,
+                }, settings.IDEMPOTENCY_KEY_TTL)
+            return response
+        finally:
+            cache.delete(cache_key + ':lock')
+
+    return wrapper
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return JsonResponse({'Status': False, 'Errors': 'Ключ идемпотентности использован с другими данными'},
+                            status=422)
+    response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,485 @@
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1, sha256
+from itertools import chain, repeat
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.dispatch import Signal
+from django.utils import timezone
+
+from backend.basket import forget_offer_basket_summaries
+from backend.models import Shop, Category, Product, Parameter, ProductParameter, ProductInfo, PriceHistory
+
+# Сколько товаров передаётся в одном COPY при первичной загрузке каталога
+COPY_CHUNK_SIZE = 100000
+
+# Отправляется после фиксации загрузки, изменившей предложения магазина (аргумент shop_id):
+# по нему сбрасываются кэши, построенные на ценах и остатках
+price_imported = Signal()
+
+
+class ParameterRegistry:
+    """
+    Таблица интернирования имён параметров (имя -> id).
+
+    Живёт в пределах одного импорта и опирается на общий кэш, поэтому
+    вместо get_or_create на каждый параметр каждого товара делается
+    не больше пары запросов на весь прайс.
+    """
+    cache_prefix = 'parameter-id:'
+
+    def __init__(self):
+        self._ids = {}
+
+    @classmethod
+    def cache_key(cls, name):
+        # Имена параметров бывают с пробелами и кириллицей, поэтому хэшируем
+        return cls.cache_prefix + sha1(name.encode()).hexdigest()
+
+    def resolve(self, names):
+        """Возвращает словарь {имя: id}, создавая недостающие параметры."""
+        names = set(names)
+        missing = names - self._ids.keys()
+
+        if missing:
+            keys = {self.cache_key(name): name for name in missing}
+            for key, parameter_id in cache.get_many(keys).items():
+                self._ids[keys[key]] = parameter_id
+            missing -= self._ids.keys()
+
+        if missing:
+            found = dict(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+            new_names = missing - found.keys()
+            if new_names:
+                Parameter.objects.bulk_create([Parameter(name=name) for name in new_names], ignore_conflicts=True)
+                found.update(Parameter.objects.filter(name__in=new_names).values_list('name', 'id'))
+            self._ids.update(found)
+            cache.set_many({self.cache_key(name): parameter_id for name, parameter_id in found.items()},
+                           settings.PARAMETER_CACHE_TIMEOUT)
+
+        return {name: self._ids[name] for name in names}
+
+
+def content_digest(content):
+    """
+    Хэш содержимого прайса для сравнения с последней загрузкой.
+
+    В хэш входит режим PRODUCT_PARAMETERS_STORAGE: после его смены тот же
+    файл загружается заново и параметры записываются в новом виде.
+    """
+    digest = sha256(f'{settings.PRODUCT_PARAMETERS_STORAGE}\n'.encode())
+    digest.update(content)
+    return digest.hexdigest()
+
+
+def fetch_price(url, etag='', last_modified=''):
+    """
+    Скачивает прайс условным GET-запросом.
+
+    Возвращает ответ или None, если сервер поставщика ответил 304 Not Modified.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    # Импорт внутри функции: requests нужен только при скачивании прайса, а не при старте процесса
+    import requests
+
+    response = requests.get(url, headers=headers, timeout=settings.SHOP_FEED_TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    return response
+
+
+def read_price_source(source):
+    """Читает прайс из файла или скачивает его, если передана ссылка."""
+    if source.startswith(('http://', 'https://')):
+        return fetch_price(source).content
+    with open(source, 'rb') as price_file:
+        return price_file.read()
+
+
+def parse_price(content):
+    """Разбирает исходный YAML прайса."""
+    import yaml
+
+    # libyaml заметно быстрее разбирает большие прайсы
+    return yaml.load(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def good_digest(good, compact):
+    """Хэш товара из прайса: совпадает, только если в товаре и режиме хранения параметров ничего не изменилось."""
+    return sha1(json.dumps([compact, good], sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def load_price(content, user_id):
+    """
+    Загружает прайс-лист поставщика из исходного YAML и возвращает статистику.
+
+    Если файл совпадает с последним успешно загруженным, он даже не разбирается.
+    Товары нормализуются до начала транзакции, чтобы пул процессов не
+    форкался с открытой транзакцией.
+    """
+    digest = content_digest(content)
+    shop = Shop.objects.filter(user_id=user_id).only('id', 'price_digest').first()
+    if shop and shop.price_digest == digest:
+        skipped = ProductInfo.objects.filter(shop_id=shop.id).count()
+        return {'created': 0, 'updated': 0, 'deleted': 0, 'skipped': skipped, 'unchanged': True}
+
+    data = parse_price(content)
+    goods = normalize_price(data['goods'], settings.PRODUCT_PARAMETERS_STORAGE == 'compact')
+    with transaction.atomic():
+        stats = import_price(data, user_id, goods)
+        Shop.objects.filter(user_id=user_id).update(price_digest=digest)
+    return stats
+
+
+def normalize_goods(goods, compact):
+    """
+    Приводит товары прайса к виду для записи в базу, не обращаясь к базе.
+
+    Вынесено отдельно, чтобы большие прайсы можно было нормализовать
+    частями в пуле процессов (см. IMPORT_WORKERS).
+    """
+    normalized = []
+    for good in goods:
+        parameters = {name: str(value) for name, value in good['parameters'].items()}
+        normalized.append({
+            'key': (good['name'], good['category'], good['id']),
+            'parameters': parameters,
+            'fields': {
+                'model': good['model'],
+                'price': good['price'],
+                'price_rrc': good['price_rrc'],
+                'quantity': good['quantity'],
+                'parameters': parameters if compact else {},
+                'digest': good_digest(good, compact),
+            },
+        })
+    return normalized
+
+
+def normalize_price(goods, compact):
+    """
+    Нормализует товары прайса, разбивая большой прайс на части по IMPORT_PARTITION_SIZE
+    и обрабатывая их параллельно в IMPORT_WORKERS процессах.
+
+    Внутри транзакции товары нормализуются в текущем процессе: дочерние
+    процессы унаследовали бы соединение с базой посреди транзакции.
+    """
+    size = settings.IMPORT_PARTITION_SIZE
+    if settings.IMPORT_WORKERS < 2 or len(goods) <= size or connection.in_atomic_block:
+        return normalize_goods(goods, compact)
+
+    partitions = [goods[start:start + size] for start in range(0, len(goods), size)]
+    with ProcessPoolExecutor(max_workers=settings.IMPORT_WORKERS, mp_context=get_context('fork')) as pool:
+        # map сохраняет порядок частей, поэтому результат не зависит от числа процессов
+        return list(chain.from_iterable(pool.map(normalize_goods, partitions, repeat(compact))))
+
+
+def resolve_products(keys):
+    """
+    Возвращает словарь {(имя, категория): id} для товаров, создавая недостающие.
+
+    Все id назначает один процесс, который пишет в базу, поэтому они
+    не зависят от того, как прайс был поделён между воркерами.
+    """
+    product_ids = {}
+    names = sorted({name for name, _ in keys})
+    for start in range(0, len(names), 1000):
+        for product_id, name, category_id in Product.objects.filter(
+                name__in=names[start:start + 1000]).order_by('id').values_list('id', 'name', 'category_id'):
+            if (name, category_id) in keys:
+                product_ids.setdefault((name, category_id), product_id)
+
+    new_products = [Product(name=name, category_id=category_id)
+                    for name, category_id in sorted(keys - product_ids.keys())]
+    Product.objects.bulk_create(new_products, batch_size=1000)
+    product_ids.update(((product.name, product.category_id), product.id) for product in new_products)
+    return product_ids
+
+
+def save_categories(shop, categories):
+    """
+    Создаёт категории прайса и привязывает к ним магазин. Необязательное поле parent
+    задаёт родительскую категорию; родители проставляются после создания всех категорий.
+    """
+    saved = {}
+    for category_data in categories:
+        category, _ = Category.objects.get_or_create(id=category_data['id'], name=category_data['name'])
+        category.shops.add(shop.id)
+        saved[category.id] = category
+
+    for category_data in categories:
+        category = saved[category_data['id']]
+        if category_data.get('parent') and category.parent_id != category_data['parent']:
+            category.parent_id = category_data['parent']
+            category.save()
+
+
+def relink_price_history(shop_id):
+    """Привязывает историю удалённых ранее предложений к вернувшимся в прайс (по внешнему ID)."""
+    offer = ProductInfo.objects.filter(shop_id=shop_id, external_id=OuterRef('external_id')).order_by('id')
+    PriceHistory.objects.filter(
+        shop_id=shop_id, product_info__isnull=True,
+        external_id__in=ProductInfo.objects.filter(shop_id=shop_id).values('external_id'),
+    ).update(product_info_id=Subquery(offer.values('id')[:1]))
+
+
+def import_price(data, user_id, goods=None):
+    """
+    Загружает разобранный прайс-лист поставщика и возвращает статистику изменений.
+    goods - уже нормализованные товары прайса (см. normalize_price).
+
+    Предложения магазина не пересоздаются: новые добавляются, изменившиеся
+    обновляются, пропавшие из прайса удаляются. Товар, хэш которого совпал
+    с сохранённым при прошлой загрузке, пропускается целиком. Изменения цены
+    и остатка попадают в историю цен.
+    """
+    compact = settings.PRODUCT_PARAMETERS_STORAGE == 'compact'
+    registry = ParameterRegistry()
+    now = timezone.now()
+    if goods is None:
+        goods = normalize_price(data['goods'], compact)
+
+    with transaction.atomic():
+        shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+        save_categories(shop, data['categories'])
+
+        existing = {(offer.product.name, offer.product.category_id, offer.external_id): offer
+                    for offer in ProductInfo.objects.filter(shop_id=shop.id).select_related('product')}
+
+        new_goods, changed_offers, history = [], [], []
+        # (предложение, параметры) для предложений, чьи строки ProductParameter нужно записать заново
+        offer_parameters = []
+        skipped = 0
+        for good in goods:
+            fields = good['fields']
+            offer = existing.pop(good['key'], None)
+            if offer is None:
+                new_goods.append(good)
+                continue
+            if offer.digest == fields['digest']:
+                skipped += 1
+                continue
+
+            if offer.price != fields['price'] or offer.quantity != fields['quantity']:
+                history.append(PriceHistory(product_info=offer, shop_id=shop.id, external_id=offer.external_id,
+                                            dt=now, price=fields['price'],
+                                            price_min=fields['price'], price_max=fields['price'],
+                                            quantity=fields['quantity']))
+            for name, value in fields.items():
+                setattr(offer, name, value)
+            offer.updated_at = now
+            changed_offers.append(offer)
+            offer_parameters.append((offer, good['parameters']))
+
+        product_ids = resolve_products({(name, category_id) for name, category_id, _ in
+                                        (good['key'] for good in new_goods)})
+        new_offers = []
+        for good in new_goods:
+            name, category_id, external_id = good['key']
+            offer = ProductInfo(product_id=product_ids[name, category_id], external_id=external_id,
+                                shop_id=shop.id, is_visible=shop.state, **good['fields'])
+            new_offers.append(offer)
+            offer_parameters.append((offer, good['parameters']))
+
+        # Пишем в порядке уникального ключа, чтобы параллельные импорты брали блокировки в одном порядке
+        new_offers.sort(key=lambda offer: (offer.product_id, offer.external_id))
+        changed_offers.sort(key=lambda offer: offer.id)
+
+        if existing:
+            deleted_ids = sorted(offer.id for offer in existing.values())
+            forget_offer_basket_summaries(deleted_ids)
+            ProductInfo.objects.filter(id__in=deleted_ids).delete()
+        ProductInfo.objects.bulk_create(new_offers, batch_size=1000)
+        ProductInfo.objects.bulk_update(changed_offers, ['model', 'price', 'price_rrc', 'quantity', 'parameters',
+                                                         'digest', 'updated_at'], batch_size=1000)
+        if new_offers:
+            relink_price_history(shop.id)
+        history.extend(PriceHistory(product_info=offer, shop_id=shop.id, external_id=offer.external_id, dt=now,
+                                    price=offer.price, price_min=offer.price, price_max=offer.price,
+                                    quantity=offer.quantity) for offer in new_offers)
+        PriceHistory.objects.bulk_create(history, batch_size=1000)
+
+        # Строки удаляются и в компактном режиме: после его включения у предложений могли остаться старые
+        if changed_offers:
+            ProductParameter.objects.filter(product_info__in=[offer.id for offer in changed_offers]).delete()
+        if not compact and offer_parameters:
+            parameter_ids = registry.resolve(name for _, parameters in offer_parameters for name in parameters)
+            ProductParameter.objects.bulk_create([
+                ProductParameter(product_info_id=offer.id, parameter_id=parameter_ids[name], value=value)
+                for offer, parameters in offer_parameters
+                for name, value in parameters.items()
+            ], batch_size=1000)
+
+        if new_offers or changed_offers or existing:
+            transaction.on_commit(lambda: price_imported.send(sender=Shop, shop_id=shop.id))
+
+    return {'created': len(new_offers), 'updated': len(changed_offers), 'deleted': len(existing),
+            'skipped': skipped, 'unchanged': False}
+
+
+def copy_price(data, user_id, goods=None):
+    """
+    Первичная загрузка большого каталога через COPY во временные таблицы
+    и set-based слияние с ProductInfo/ProductParameter.
+
+    На базах, отличных от PostgreSQL, выполняется обычный пакетный импорт.
+    История цен пишется так же, как при обычном импорте: точка для нового
+    предложения и для предложения, у которого изменились цена или остаток.
+    """
+    if connection.vendor != 'postgresql':
+        return import_price(data, user_id, goods)
+
+    compact = settings.PRODUCT_PARAMETERS_STORAGE == 'compact'
+    if goods is None:
+        goods = normalize_price(data['goods'], compact)
+    tables = {
+        'product': Product._meta.db_table,
+        'product_info': ProductInfo._meta.db_table,
+        'parameter': Parameter._meta.db_table,
+        'product_parameter': ProductParameter._meta.db_table,
+        'price_history': PriceHistory._meta.db_table,
+    }
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+        save_categories(shop, data['categories'])
+
+        cursor.execute("""
+            CREATE TEMP TABLE catalog_goods (
+                name varchar(80), category_id integer, external_id integer, model varchar(80),
+                price integer, price_rrc integer, quantity integer, parameters jsonb, digest varchar(40)
+            ) ON COMMIT DROP;
+            CREATE TEMP TABLE catalog_parameters (
+                name varchar(80), category_id integer, external_id integer, parameter varchar(40), value varchar(100)
+            ) ON COMMIT DROP;
+        """)
+
+        for start in range(0, len(goods), COPY_CHUNK_SIZE):
+            goods_csv, parameters_csv = io.StringIO(), io.StringIO()
+            goods_writer, parameters_writer = csv.writer(goods_csv), csv.writer(parameters_csv)
+            for good in goods[start:start + COPY_CHUNK_SIZE]:
+                fields = good['fields']
+                goods_writer.writerow((*good['key'], fields['model'], fields['price'], fields['price_rrc'],
+                                       fields['quantity'], json.dumps(fields['parameters'], ensure_ascii=False),
+                                       fields['digest']))
+                if not compact:
+                    parameters_writer.writerows((*good['key'], name, value)
+                                                for name, value in good['parameters'].items())
+            # csv.writer пишет пустую строку без кавычек, а COPY читает такое поле как NULL:
+            # пустая модель или значение параметра сохраняются пустой строкой, как при обычном импорте
+            goods_csv.seek(0)
+            cursor.copy_expert("COPY catalog_goods FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (name, model, digest))",
+                               goods_csv)
+            if not compact:
+                parameters_csv.seek(0)
+                cursor.copy_expert("COPY catalog_parameters FROM STDIN "
+                                   "WITH (FORMAT csv, FORCE_NOT_NULL (name, parameter, value))", parameters_csv)
+
+        cursor.execute("""
+            INSERT INTO {product} (name, category_id)
+            SELECT DISTINCT g.name, g.category_id FROM catalog_goods g
+            WHERE NOT EXISTS (SELECT 1 FROM {product} p WHERE p.name = g.name AND p.category_id = g.category_id)
+        """.format(**tables))
+        cursor.execute("""
+            CREATE TEMP TABLE catalog_offers ON COMMIT DROP AS
+            SELECT DISTINCT ON (g.name, g.category_id, g.external_id)
+                   p.id AS product_id, g.*
+            FROM catalog_goods g
+            JOIN {product} p ON p.name = g.name AND p.category_id = g.category_id
+            ORDER BY g.name, g.category_id, g.external_id, p.id
+        """.format(**tables))
+
+        cursor.execute("""
+            SELECT pi.id FROM {product_info} pi WHERE pi.shop_id = %(shop)s AND NOT EXISTS (
+                SELECT 1 FROM catalog_offers o WHERE o.product_id = pi.product_id AND o.external_id = pi.external_id)
+        """.format(**tables), {'shop': shop.id})
+        # Удаляем через ORM: на связанные строки в базе нет ON DELETE CASCADE
+        missing = [row[0] for row in cursor.fetchall()]
+        forget_offer_basket_summaries(missing)
+        ProductInfo.objects.filter(id__in=missing).delete()
+        deleted = len(missing)
+        # Точки истории для изменившихся предложений - до слияния, пока в таблице старые цены
+        cursor.execute("""
+            INSERT INTO {price_history} (product_info_id, shop_id, external_id, dt, period, price, price_min,
+                                         price_max, quantity)
+            SELECT pi.id, pi.shop_id, pi.external_id, now(), 'point', o.price, o.price, o.price, o.quantity
+            FROM catalog_offers o
+            JOIN {product_info} pi
+              ON pi.shop_id = %(shop)s AND pi.product_id = o.product_id AND pi.external_id = o.external_id
+            WHERE pi.digest IS DISTINCT FROM o.digest AND (pi.price <> o.price OR pi.quantity <> o.quantity)
+        """.format(**tables), {'shop': shop.id})
+        cursor.execute("""
+            WITH upserted AS (
+                INSERT INTO {product_info} (product_id, shop_id, external_id, model, price, price_rrc, quantity,
+                                            parameters, digest, is_visible, updated_at)
+                SELECT o.product_id, %(shop)s, o.external_id, o.model, o.price, o.price_rrc, o.quantity,
+                       o.parameters, o.digest, %(visible)s, now()
+                FROM catalog_offers o
+                ORDER BY o.product_id, o.external_id
+                ON CONFLICT (product_id, shop_id, external_id) DO UPDATE SET
+                    model = EXCLUDED.model, price = EXCLUDED.price, price_rrc = EXCLUDED.price_rrc,
+                    quantity = EXCLUDED.quantity, parameters = EXCLUDED.parameters, digest = EXCLUDED.digest,
+                    updated_at = EXCLUDED.updated_at
+                WHERE {product_info}.digest IS DISTINCT FROM EXCLUDED.digest
+                RETURNING id, external_id, price, quantity, xmax = 0 AS inserted
+            ), history AS (
+                INSERT INTO {price_history} (product_info_id, shop_id, external_id, dt, period, price, price_min,
+                                             price_max, quantity)
+                SELECT id, %(shop)s, external_id, now(), 'point', price, price, price, quantity
+                FROM upserted WHERE inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+        """.format(**tables), {'shop': shop.id, 'visible': shop.state})
+        created, updated = cursor.fetchone()
+        if created:
+            relink_price_history(shop.id)
+
+        cursor.execute("""
+            DELETE FROM {product_parameter} pp USING {product_info} pi
+            WHERE pp.product_info_id = pi.id AND pi.shop_id = %(shop)s
+        """.format(**tables), {'shop': shop.id})
+        if not compact:
+            cursor.execute("""
+                INSERT INTO {parameter} (name)
+                SELECT DISTINCT parameter FROM catalog_parameters
+                ON CONFLICT (name) DO NOTHING
+            """.format(**tables))
+            cursor.execute("""
+                INSERT INTO {product_parameter} (product_info_id, parameter_id, value)
+                SELECT pi.id, par.id, cp.value
+                FROM catalog_parameters cp
+                JOIN catalog_offers o
+                  ON o.name = cp.name AND o.category_id = cp.category_id AND o.external_id = cp.external_id
+                JOIN {product_info} pi
+                  ON pi.shop_id = %(shop)s AND pi.product_id = o.product_id AND pi.external_id = o.external_id
+                JOIN {parameter} par ON par.name = cp.parameter
+                ON CONFLICT (product_info_id, parameter_id) DO UPDATE SET value = EXCLUDED.value
+            """.format(**tables), {'shop': shop.id})
+
+        transaction.on_commit(lambda: price_imported.send(sender=Shop, shop_id=shop.id))
+
+    return {'created': created, 'updated': updated, 'deleted': deleted,
+            'skipped': len(goods) - created - updated, 'unchanged': False}
+
+
+def load_catalog(content, user_id):
+    """Первичная загрузка каталога поставщика из исходного YAML через copy_price."""
+    data = parse_price(content)
+    goods = normalize_price(data['goods'], settings.PRODUCT_PARAMETERS_STORAGE == 'compact')
+    with transaction.atomic():
+        stats = copy_price(data, user_id, goods)
+        Shop.objects.filter(user_id=user_id).update(price_digest=content_digest(content))
+    return stats
+
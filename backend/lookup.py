@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.models import ProductInfo
+from backend.serializers import ProductInfoSerializer
+
+
+def offer_cache_keys(offer_ids):
+    # Версия меняется при загрузке прайса или смене статуса магазина - кэш предложений строится заново
+    version = cache.get_or_set('offer-lookup-version', time.time_ns, None)
+    return {f'offer:{version}:{offer_id}': offer_id for offer_id in offer_ids}
+
+
+def resolve_offer_keys(pairs):
+    """{(id магазина, внешний ID): id предложения} для видимых предложений - одним запросом."""
+    if not pairs:
+        return {}
+    offers = ProductInfo.objects.filter(
+        is_visible=True, shop_id__in={shop_id for shop_id, _ in pairs},
+        external_id__in={external_id for _, external_id in pairs}).order_by('id').values_list(
+        'shop_id', 'external_id', 'id')
+    resolved = {}
+    for shop_id, external_id, offer_id in offers:
+        if (shop_id, external_id) in pairs:
+            resolved.setdefault((shop_id, external_id), offer_id)
+    return resolved
+
+
+def lookup_offers(offer_ids, pairs=()):
+    """
+    Предложения по списку id и пар (магазин, внешний ID) в порядке запроса.
+
+    Сериализованные предложения берутся из кэша по id, недостающие читаются
+    одним запросом (и одним запросом параметров), поэтому число запросов не
+    зависит от длины списка. Не найденные и скрытые предложения перечисляются в missing.
+    """
+    resolved = resolve_offer_keys(set(pairs))
+    wanted = list(dict.fromkeys([*offer_ids, *resolved.values()]))
+    keys = offer_cache_keys(wanted)
+    found = {keys[key]: offer for key, offer in cache.get_many(keys).items()}
+
+    missing = [offer_id for offer_id in wanted if offer_id not in found]
+    if missing:
+        offers = ProductInfo.objects.filter(id__in=missing, is_visible=True).select_related(
+            'product__category')
+        if settings.PRODUCT_PARAMETERS_STORAGE != 'compact':
+            offers = offers.prefetch_related('product_parameters__parameter')
+        built = {offer['id']: offer for offer in ProductInfoSerializer(offers, many=True).data}
+        cache.set_many({key: built[offer_id] for key, offer_id in keys.items() if offer_id in built},
+                       settings.OFFER_LOOKUP_TIMEOUT)
+        found.update(built)
+
+    return {
+        'offers': [found[offer_id] for offer_id in wanted if offer_id in found],
+        'missing': {
+            'ids': [offer_id for offer_id in dict.fromkeys(offer_ids) if offer_id not in found],
+            'offers': [{'shop': shop_id, 'external_id': external_id} for shop_id, external_id in dict.fromkeys(pairs)
+                       if resolved.get((shop_id, external_id)) not in found],
+        },
+    }
+
+
+def forget_offer_lookup():
+    cache.set('offer-lookup-version', time.time_ns(), None)
@@ -0,0 +1,40 @@
+from difflib import unified_diff
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.schema import generate_schema, write_schema
+
+
+class Command(BaseCommand):
+    help = 'Генерирует схему OpenAPI в API_SCHEMA_FILE или (--check) проверяет, что файл не устарел'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Не записывать файл, а завершиться с ошибкой, если схема в нём отличается')
+        parser.add_argument('--diff-lines', type=int, default=50, help='Сколько строк расхождения вывести')
+
+    def handle(self, *args, **options):
+        content = generate_schema()
+
+        if not options['check']:
+            write_schema(content)
+            self.stdout.write(f'Схема записана в {settings.API_SCHEMA_FILE}')
+            return
+
+        try:
+            with open(settings.API_SCHEMA_FILE, 'rb') as schema_file:
+                saved = schema_file.read()
+        except FileNotFoundError:
+            raise CommandError(f'Файл схемы {settings.API_SCHEMA_FILE} не найден, выполните manage.py api_schema')
+
+        # Переводы строк не сравниваются: при checkout на Windows файл может оказаться с CRLF
+        saved, content = saved.decode().splitlines(), content.decode().splitlines()
+        if saved == content:
+            self.stdout.write('Схема актуальна')
+            return
+
+        diff = list(unified_diff(saved, content,
+                                 'schema.yml (файл)', 'schema.yml (представления)', lineterm=''))
+        self.stdout.write('\n'.join(diff[:options['diff_lines']]))
+        raise CommandError(f'Схема в {settings.API_SCHEMA_FILE} устарела, выполните manage.py api_schema')
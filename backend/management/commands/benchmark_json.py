@@ -0,0 +1,86 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from backend.renderers import FastJSONRenderer, JSON_BACKENDS, load_json_backend
+
+
+def catalog_payload(offers):
+    """Страница каталога в формате ProductInfoSerializer."""
+    return {'count': offers, 'next': None, 'previous': None, 'results': [{
+        'id': offer_id,
+        'model': f'apple/iphone/xs-max-{offer_id}',
+        'product': {'name': f'Смартфон Apple iPhone XS Max {offer_id} (золотистый)', 'category': 'Смартфоны'},
+        'shop': offer_id % 50 + 1,
+        'quantity': random.randint(0, 100),
+        'price': random.randint(1000, 200000),
+        'price_rrc': random.randint(1000, 200000),
+        'product_parameters': [
+            {'parameter': 'Диагональ (дюйм)', 'value': '6.5'},
+            {'parameter': 'Разрешение (пикс)', 'value': '2688x1242'},
+            {'parameter': 'Встроенная память (Гб)', 'value': '512'},
+            {'parameter': 'Цвет', 'value': 'золотистый'},
+        ],
+    } for offer_id in range(1, offers + 1)]}
+
+
+def orders_payload(orders, items):
+    """Список заказов в формате OrderSerializer: позиции, даты, контакт."""
+    now = timezone.now()
+    return [{
+        'id': order_id,
+        'ordered_items': [{
+            'id': order_id * items + item_id,
+            'product_info': catalog_payload(1)['results'][0],
+            'quantity': random.randint(1, 5),
+        } for item_id in range(items)],
+        'state': 'new',
+        'dt': now - timedelta(minutes=order_id),
+        'total_sum': random.randint(1000, 1000000),
+        'contact': {'id': 1, 'city': 'Москва', 'street': 'Тверская', 'house': '1', 'structure': '', 'building': '',
+                    'apartment': '12', 'phone': '+79990000000'},
+    } for order_id in range(1, orders + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость сериализации ответов API стандартным JSONRenderer и библиотеками JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=5000, help='Предложений на странице каталога')
+        parser.add_argument('--orders', type=int, default=500, help='Заказов в списке')
+        parser.add_argument('--items', type=int, default=10, help='Позиций в заказе')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого замера')
+
+    def measure(self, render, data, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            render(data)
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        payloads = {
+            'каталог': catalog_payload(options['offers']),
+            'заказы': orders_payload(options['orders'], options['items']),
+        }
+        renderers = {'JSONRenderer (DRF)': JSONRenderer().render}
+        for name in JSON_BACKENDS:
+            try:
+                dumps, _ = load_json_backend(name)
+            except ImproperlyConfigured:
+                continue
+            renderers[name] = dumps
+        renderers['FastJSONRenderer'] = FastJSONRenderer().render
+
+        for payload_name, data in payloads.items():
+            size = len(JSONRenderer().render(data))
+            self.stdout.write(f'\n{payload_name}: {size / 1024:.0f} КБ')
+            baseline = None
+            for name, render in renderers.items():
+                elapsed = self.measure(render, data, options['repeat'])
+                baseline = baseline or elapsed
+                self.stdout.write(f'  {name:<20} {elapsed:8.2f} мс  x{baseline / elapsed:.1f}')
@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Что процесс роли делает до того, как готов принимать запросы или задачи
+WEB_STARTUP = ('from django.core.wsgi import get_wsgi_application; get_wsgi_application(); '
+               'from django.urls import get_resolver; get_resolver().url_patterns')
+ROLE_STARTUP = {
+    'api': WEB_STARTUP,
+    'admin': WEB_STARTUP,
+    'worker': 'from shop.celery import app; import django; django.setup(); app.loader.import_default_modules()',
+    'all': WEB_STARTUP,
+}
+
+
+def parse_importtime(output):
+    """
+    Разбирает вывод python -X importtime: (общее время импортов в мс, число модулей,
+    [(накопленное время в мс, модуль)] для импортов верхнего уровня).
+    """
+    total = 0
+    modules = 0
+    top_level = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        total += int(own)
+        modules += 1
+        # Вложенные импорты выводятся с отступом в два пробела на уровень
+        if not name[1:].startswith(' '):
+            top_level.append((int(cumulative) / 1000, name.strip()))
+    return total / 1000, modules, sorted(top_level, reverse=True)
+
+
+class Command(BaseCommand):
+    help = 'Измеряет время запуска процесса каждой роли (DJANGO_ROLE) и самые дорогие импорты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roles', nargs='*', default=['api', 'admin', 'worker', 'all'],
+                            help='Роли для замера')
+        parser.add_argument('--repeat', type=int, default=3, help='Запусков каждой роли, берётся лучший')
+        parser.add_argument('--top', type=int, default=10, help='Сколько импортов верхнего уровня вывести')
+
+    def run_role(self, role):
+        env = {**os.environ, 'DJANGO_ROLE': role, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']}
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', ROLE_STARTUP[role]],
+                                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - started) * 1000
+        if result.returncode:
+            raise CommandError(f'Процесс роли {role} не запустился:\n{result.stderr[-2000:]}')
+        return elapsed, parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        for role in options['roles']:
+            if role not in ROLE_STARTUP:
+                raise CommandError(f'Неизвестная роль {role!r}, допустимы: {", ".join(ROLE_STARTUP)}')
+
+        for role in options['roles']:
+            runs = [self.run_role(role) for _ in range(options['repeat'])]
+            elapsed, (imports, modules, top_level) = min(runs, key=lambda run: run[0])
+            self.stdout.write(f'\n{role}: запуск {elapsed:.0f} мс, импорты {imports:.0f} мс, модулей {modules}')
+            for cumulative, name in top_level[:options['top']]:
+                self.stdout.write(f'  {cumulative:8.1f} мс  {name}')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.importer import load_catalog, read_price_source
+from backend.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Первичная загрузка каталога поставщика через COPY (на SQLite - пакетными INSERT)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int, help='ID магазина')
+        parser.add_argument('source', nargs='?', help='Путь к YAML-файлу или ссылка, по умолчанию Shop.url')
+
+    def handle(self, *args, **options):
+        shop = Shop.objects.filter(id=options['shop_id']).first()
+        if shop is None:
+            raise CommandError('Магазин не найден')
+        if shop.user_id is None:
+            raise CommandError('У магазина нет пользователя-поставщика')
+
+        source = options['source'] or shop.url
+        if not source:
+            raise CommandError('Не указан файл или ссылка на прайс')
+
+        stats = load_catalog(read_price_source(source), shop.user_id)
+        self.stdout.write(self.style.SUCCESS(f'Каталог загружен: {stats}'))
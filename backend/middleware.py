@@ -0,0 +1,210 @@
+import re
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Добавляет к ответу заголовки X-RateLimit-Limit, X-RateLimit-Remaining и
+    X-RateLimit-Reset по самому строгому из сработавших ограничений (см. backend.throttling).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limits = getattr(request, 'rate_limits', None)
+        if rate_limits:
+            limit, remaining, reset = min(rate_limits, key=lambda rate_limit: rate_limit[1])
+            response['X-RateLimit-Limit'] = limit
+            response['X-RateLimit-Remaining'] = remaining
+            response['X-RateLimit-Reset'] = reset
+        return response
+
+
+class GzipStream:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+# Доступные кодировки: br и zstd - только если установлены brotli и zstandard
+COMPRESSORS = {'gzip': GzipStream}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliStream
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdStream
+
+
+def choose_encoding(accept_encoding, encodings):
+    """
+    Кодировка из encodings (в порядке предпочтения сервера) с наибольшим
+    весом q в заголовке Accept-Encoding; None, если ни одна не принимается.
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        match = re.search(r'q=([0-9.]+)', params)
+        try:
+            accepted[coding.strip().lower()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            continue
+
+    chosen, chosen_q = None, 0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if encoding in COMPRESSORS and q > chosen_q:
+            chosen, chosen_q = encoding, q
+    return chosen
+
+
+class StreamFlusher:
+    """
+    Сжимает части потокового ответа и сбрасывает сжатые данные клиенту, когда накопилось
+    COMPRESSION_FLUSH_SIZE несжатых байт или с прошлого сброса прошло COMPRESSION_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self, compressor):
+        self.compressor = compressor
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def compress(self, chunk):
+        data = self.compressor.compress(chunk)
+        self.pending += len(chunk)
+        now = time.monotonic()
+        if (self.pending >= settings.COMPRESSION_FLUSH_SIZE
+                or now - self.flushed_at >= settings.COMPRESSION_FLUSH_INTERVAL):
+            data += self.compressor.flush()
+            self.pending = 0
+            self.flushed_at = now
+        return data
+
+
+def compress_stream(chunks, compressor):
+    flusher = StreamFlusher(compressor)
+    for chunk in chunks:
+        data = flusher.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_async_stream(chunks, compressor):
+    flusher = StreamFlusher(compressor)
+    async for chunk in chunks:
+        data = flusher.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы кодировкой, согласованной по Accept-Encoding (zstd, br, gzip),
+    если ответ не меньше COMPRESSION_MIN_SIZE и его тип есть в COMPRESSION_CONTENT_TYPES.
+    Потоковые ответы сжимаются по частям, без накопления в памяти.
+
+    Представление может задать атрибут compression: False отключает сжатие
+    (ответы с секретами, защита от BREACH), словарь с ключами min_size, encodings,
+    levels и content_types переопределяет настройки COMPRESSION_*.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.compress(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Для APIView и ViewSet настройка берётся из класса представления
+        request.compression = getattr(getattr(view_func, 'cls', view_func), 'compression', None)
+
+    def compress(self, request, response):
+        options = getattr(request, 'compression', None)
+        if options is False or response.has_header('Content-Encoding'):
+            return response
+        options = options or {}
+        content_types = tuple(options.get('content_types', settings.COMPRESSION_CONTENT_TYPES))
+        if not response.get('Content-Type', '').startswith(content_types):
+            return response
+        if not response.streaming and len(response.content) < options.get('min_size', settings.COMPRESSION_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''),
+                                   options.get('encodings', settings.COMPRESSION_ENCODINGS))
+        if encoding is None:
+            return response
+        compressor = COMPRESSORS[encoding]({**settings.COMPRESSION_LEVELS, **options.get('levels', {})}[encoding])
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_stream(response.streaming_content, compressor)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, compressor)
+            del response['Content-Length']
+        else:
+            content = compressor.compress(response.content) + compressor.finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # Сжатое тело отличается побайтно: сильный ETag становится слабым, как в GZipMiddleware
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
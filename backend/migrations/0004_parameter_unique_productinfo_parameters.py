@@ -0,0 +1,51 @@
+# Generated by Django 5.1 on 2026-10-19 08:55
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_parameters(apps, schema_editor):
+    """Сливает параметры с одинаковым именем в параметр с наименьшим id перед добавлением unique."""
+    Parameter = apps.get_model('backend', 'Parameter')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+
+    duplicates = Parameter.objects.values('name').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        for parameter_id in Parameter.objects.filter(name=duplicate['name']).exclude(id=keep).values_list('id', flat=True):
+            # Если у предложения уже есть значение основного параметра, значение дубля отбрасывается
+            ProductParameter.objects.filter(
+                parameter_id=parameter_id,
+                product_info_id__in=ProductParameter.objects.filter(parameter_id=keep).values('product_info_id'),
+            ).delete()
+            ProductParameter.objects.filter(parameter_id=parameter_id).update(parameter_id=keep)
+            Parameter.objects.filter(id=parameter_id).delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # Отложенные проверки внешних ключей должны выполниться до ALTER TABLE в этой же транзакции
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_productinfo_updated_at_alter_confirmemailtoken_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Параметры'),
+        ),
+        migrations.RunPython(merge_duplicate_parameters, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='parameter',
+            name='name',
+            field=models.CharField(max_length=40, unique=True, verbose_name='Название'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['parameters'], name='product_info_parameters_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
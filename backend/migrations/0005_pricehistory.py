@@ -0,0 +1,32 @@
+# Generated by Django 5.1 on 2026-10-19 08:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_parameter_unique_productinfo_parameters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt', models.DateTimeField(verbose_name='Время')),
+                ('period', models.CharField(choices=[('point', 'Изменение'), ('day', 'Сутки')], default='point', max_length=5, verbose_name='Период')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_min', models.PositiveIntegerField(verbose_name='Минимальная цена')),
+                ('price_max', models.PositiveIntegerField(verbose_name='Максимальная цена')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='backend.productinfo', verbose_name='Информация о продукте')),
+            ],
+            options={
+                'verbose_name': 'Точка истории цен',
+                'verbose_name_plural': 'История цен',
+                'indexes': [models.Index(fields=['product_info', 'dt'], name='price_history_offer_dt'), models.Index(fields=['period', 'dt'], name='price_history_period_dt')],
+            },
+        ),
+    ]
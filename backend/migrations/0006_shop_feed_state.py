@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-19 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_pricehistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='feed_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время проверки прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=255, verbose_name='ETag прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Last-Modified прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='price_digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш загруженного прайса'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-19 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_shop_feed_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='digest',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Хэш товара в прайсе'),
+        ),
+    ]
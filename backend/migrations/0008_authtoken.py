@@ -0,0 +1,45 @@
+# Generated by Django 5.1 on 2026-10-19 09:03
+
+from hashlib import sha256
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_drf_tokens(apps, schema_editor):
+    # Уже выданные токены rest_framework.authtoken продолжают работать до истечения срока
+    Token = apps.get_model('authtoken', 'Token')
+    AuthToken = apps.get_model('backend', 'AuthToken')
+    expires_at = timezone.now() + settings.AUTH_TOKEN_TTL
+    AuthToken.objects.bulk_create([
+        AuthToken(digest=sha256(key.encode()).hexdigest(), user_id=user_id, expires_at=expires_at)
+        for key, user_id in Token.objects.values_list('key', 'user_id').iterator()
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        ('backend', '0007_productinfo_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Хэш ключа')),
+                ('device', models.CharField(blank=True, max_length=100, verbose_name='Устройство')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Действует до')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auth_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Токен авторизации',
+                'verbose_name_plural': 'Токены авторизации',
+            },
+        ),
+        migrations.RunPython(copy_drf_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1 on 2026-10-19 09:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Value
+from django.db.models.functions import Cast, Concat
+
+
+def fill_paths_and_counts(apps, schema_editor):
+    # Существующие категории плоские: путь состоит из одного id, счётчики поддерева - собственные
+    Category = apps.get_model('backend', 'Category')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    Category.objects.update(path=Concat(Value('/'), Cast('id', models.CharField()), Value('/')))
+    counts = ProductInfo.objects.filter(shop__state=True, quantity__gt=0).values('product__category_id').annotate(
+        offers=Count('id'), shops=Count('shop_id', distinct=True))
+    for row in counts:
+        Category.objects.filter(id=row['product__category_id']).update(
+            offers_count=row['offers'], shops_count=row['shops'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_authtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='offers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Предложений'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='backend.category', verbose_name='Родительская категория'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='shops_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Магазинов'),
+        ),
+        migrations.RunPython(fill_paths_and_counts, migrations.RunPython.noop),
+    ]
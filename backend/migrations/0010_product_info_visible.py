@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+def hide_closed_shop_offers(apps, schema_editor):
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductInfo.objects.filter(shop__state=False).update(is_visible=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_category_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='is_visible',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Показывается в каталоге'),
+        ),
+        migrations.RunPython(hide_closed_shop_offers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('is_visible', True)), fields=['id'], name='product_info_visible'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-19 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_offer_key(apps, schema_editor):
+    PriceHistory = apps.get_model('backend', 'PriceHistory')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    offer = ProductInfo.objects.filter(id=OuterRef('product_info_id'))
+    PriceHistory.objects.update(shop_id=Subquery(offer.values('shop_id')[:1]),
+                                external_id=Subquery(offer.values('external_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_admin_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricehistory',
+            name='shop',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddField(
+            model_name='pricehistory',
+            name='external_id',
+            field=models.PositiveIntegerField(null=True, verbose_name='Внешний ID'),
+        ),
+        migrations.AlterField(
+            model_name='pricehistory',
+            name='product_info',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='price_history', to='backend.productinfo', verbose_name='Информация о продукте'),
+        ),
+        # Заполнение - последней операцией: в PostgreSQL ALTER TABLE после UPDATE этой же
+        # таблицы в одной транзакции упирается в отложенные проверки внешних ключей
+        migrations.RunPython(fill_offer_key, migrations.RunPython.noop),
+    ]
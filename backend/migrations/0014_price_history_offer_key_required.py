@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-19 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_price_history_offer_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pricehistory',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.AlterField(
+            model_name='pricehistory',
+            name='external_id',
+            field=models.PositiveIntegerField(verbose_name='Внешний ID'),
+        ),
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['shop', 'external_id', 'dt'], name='price_history_shop_offer_dt'),
+        ),
+    ]
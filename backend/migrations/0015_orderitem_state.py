@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-19 09:58
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_order_state(apps, schema_editor):
+    # Позиции получают статус заказа. Списание со склада у уже оформленных заказов
+    # не отмечается: они оформлены до списания при оформлении, и отмена не должна
+    # возвращать на склад то, что с него не списывалось
+    Order = apps.get_model('backend', 'Order')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    OrderItem.objects.update(state=Subquery(Order.objects.filter(id=OuterRef('order_id')).values('state')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_price_history_offer_key_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='state',
+            field=models.CharField(choices=[('basket', 'Корзина'), ('new', 'Новый'), ('confirmed', 'Подтверждён'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменён')], default='basket', max_length=15, verbose_name='Статус'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='stock_deducted',
+            field=models.BooleanField(default=False, verbose_name='Товар списан со склада'),
+        ),
+        migrations.RunPython(copy_order_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-19 10:18
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_orderitem_state'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='adminjob',
+            name='query',
+        ),
+        migrations.AddField(
+            model_name='adminjob',
+            name='selection',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Выборка'),
+        ),
+    ]
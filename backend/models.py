@@ -1,8 +1,19 @@
+import secrets
+from collections import defaultdict
+from hashlib import sha256
+
+from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db import models
-from django.db.models import Sum
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Concat, Substr, Upper
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -17,6 +28,19 @@ STATE_CHOICES = (
     ('canceled', 'Отменён'),
 )
 
+# Допустимые переходы статусов заказа
+ORDER_TRANSITIONS = {
+    'basket': ('new',),
+    'new': ('confirmed', 'canceled'),
+    'confirmed': ('assembled', 'canceled'),
+    'assembled': ('sent', 'canceled'),
+    'sent': ('delivered',),
+    'delivered': (),
+    'canceled': (),
+}
+# Статусы, в которые заказ переводит поставщик (оформляет заказ покупатель)
+PARTNER_ORDER_STATES = ('confirmed', 'assembled', 'sent', 'delivered', 'canceled')
+
 # Типы пользователей
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
@@ -86,16 +110,50 @@ class User(AbstractUser):
         ordering = ('email',)
 
 
+# Отправляется после фиксации транзакции, в которой магазин открыл или закрыл приём заказов
+shop_state_changed = Signal()
+
+
+class ShopQuerySet(models.QuerySet):
+
+    def set_state(self, state):
+        """
+        Включает или выключает приём заказов магазинами и одним UPDATE показывает
+        или скрывает их предложения (ProductInfo.is_visible). Меняются только магазины
+        с другим статусом; возвращает их id.
+        """
+        with transaction.atomic(using=self.db):
+            shop_ids = list(self.exclude(state=state).select_for_update().values_list('id', flat=True))
+            if not shop_ids:
+                return []
+
+            Shop.objects.filter(id__in=shop_ids).update(state=state)
+            ProductInfo.objects.filter(shop_id__in=shop_ids).update(is_visible=state)
+            for shop_id in shop_ids:
+                transaction.on_commit(lambda shop_id=shop_id: shop_state_changed.send(sender=Shop, shop_id=shop_id),
+                                      using=self.db)
+        return shop_ids
+
+
 class Shop(models.Model):
+    objects = ShopQuerySet.as_manager()
     name = models.CharField(max_length=50, verbose_name='Название')
     url = models.URLField(verbose_name='Ссылка', null=True, blank=True)
     user = models.OneToOneField(User, verbose_name='Пользователь', related_name='shop', blank=True, null=True, on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='Статус получения заказов', default=True)
+    # Состояние опроса прайса по url: заголовки последнего ответа и хэш загруженного содержимого
+    feed_etag = models.CharField(verbose_name='ETag прайса', max_length=255, blank=True)
+    feed_last_modified = models.CharField(verbose_name='Last-Modified прайса', max_length=64, blank=True)
+    feed_checked_at = models.DateTimeField(verbose_name='Время проверки прайса', null=True, blank=True)
+    price_digest = models.CharField(verbose_name='Хэш загруженного прайса', max_length=64, blank=True)
 
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = "Список магазинов"
         ordering = ('-name',)
+        indexes = [
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='shop_name_trgm'),
+        ]
 
     def __str__(self):
         return self.name
@@ -104,6 +162,13 @@ class Shop(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=40, verbose_name='Название')
     shops = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories', blank=True)
+    parent = models.ForeignKey('self', verbose_name='Родительская категория', related_name='children',
+                               blank=True, null=True, on_delete=models.CASCADE)
+    # Материализованный путь из id предков и самой категории: '/1/5/'. Поддерево - path__startswith
+    path = models.CharField(verbose_name='Путь', max_length=255, blank=True, editable=False)
+    # Счётчики по поддереву: предложения в наличии у активных магазинов и число таких магазинов
+    offers_count = models.PositiveIntegerField(verbose_name='Предложений', default=0, editable=False)
+    shops_count = models.PositiveIntegerField(verbose_name='Магазинов', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Категория'
@@ -113,6 +178,38 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def parent_path(self):
+        if self.parent_id is None:
+            return '/'
+        return Category.objects.filter(id=self.parent_id).values_list('path', flat=True).first() or '/'
+
+    def clean(self):
+        if self.id and f'/{self.id}/' in self.parent_path():
+            raise ValidationError({'parent': 'Категория не может быть вложена в саму себя'})
+
+    def save(self, *args, **kwargs):
+        parent_path = self.parent_path()
+        # Прежний путь при переносе в другую ветку: по нему пересчитываются счётчики старых предков (см. signals)
+        self.moved_from = ''
+        if self.id is None:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                self.path = f'{parent_path}{self.id}/'
+                Category.objects.filter(id=self.id).update(path=self.path)
+            return
+
+        if f'/{self.id}/' in parent_path:
+            raise ValueError('Категория не может быть вложена в саму себя')
+        path = f'{parent_path}{self.id}/'
+        with transaction.atomic():
+            if self.path and self.path != path:
+                # Переносим поддерево одним UPDATE, заменяя начало пути
+                Category.objects.filter(path__startswith=self.path).exclude(id=self.id).update(
+                    path=Concat(Value(path), Substr('path', len(self.path) + 1)))
+                self.moved_from = self.path
+            self.path = path
+            super().save(*args, **kwargs)
+
 
 class Product(models.Model):
     name = models.CharField(max_length=80, verbose_name='Название')
@@ -122,6 +219,10 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = "Список продуктов"
         ordering = ('-name',)
+        indexes = [
+            # Поиск в админке (icontains - UPPER(name) LIKE) по триграммам вместо перебора таблицы
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='product_name_trgm'),
+        ]
 
     def __str__(self):
         return self.name
@@ -136,6 +237,12 @@ class ProductInfo(models.Model):
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
     updated_at = models.DateTimeField(auto_now=True)
+    # Компактное хранение параметров (PRODUCT_PARAMETERS_STORAGE = 'compact'): {имя: значение}
+    parameters = models.JSONField(verbose_name='Параметры', default=dict, blank=True)
+    # Хэш товара из последнего загруженного прайса, неизменившиеся товары при импорте пропускаются
+    digest = models.CharField(verbose_name='Хэш товара в прайсе', max_length=40, blank=True)
+    # Копия Shop.state: каталог фильтрует предложения по своей колонке, без соединения с магазином
+    is_visible = models.BooleanField(verbose_name='Показывается в каталоге', default=True, editable=False)
 
     class Meta:
         verbose_name = 'Информация о продукте'
@@ -143,10 +250,56 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            GinIndex(fields=['parameters'], name='product_info_parameters_gin', opclasses=['jsonb_path_ops']),
+            GinIndex(OpClass(Upper('model'), name='gin_trgm_ops'), name='product_info_model_trgm'),
+            # Список каталога: видимые предложения в порядке id
+            models.Index(fields=['id'], condition=models.Q(is_visible=True), name='product_info_visible'),
+        ]
+
+
+# Период точки истории цен
+PRICE_PERIOD_CHOICES = (
+    ('point', 'Изменение'),
+    ('day', 'Сутки'),
+)
+
+
+class PriceHistory(models.Model):
+    """
+    История цен и остатков предложения.
+
+    Точка пишется только при изменении цены или количества при импорте.
+    Старые точки сворачиваются задачей compact_price_history в суточные
+    (минимум, максимум и последнее значение за день).
+
+    Точка привязана к предложению по магазину и внешнему ID: при удалении
+    предложения история остаётся, а когда товар снова появляется в прайсе,
+    импорт привязывает её к новому предложению.
+    """
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='price_history',
+                                     blank=True, null=True, on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='price_history', on_delete=models.CASCADE)
+    external_id = models.PositiveIntegerField(verbose_name='Внешний ID')
+    dt = models.DateTimeField(verbose_name='Время')
+    period = models.CharField(verbose_name='Период', choices=PRICE_PERIOD_CHOICES, max_length=5, default='point')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_min = models.PositiveIntegerField(verbose_name='Минимальная цена')
+    price_max = models.PositiveIntegerField(verbose_name='Максимальная цена')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Точка истории цен'
+        verbose_name_plural = "История цен"
+        indexes = [
+            models.Index(fields=['product_info', 'dt'], name='price_history_offer_dt'),
+            models.Index(fields=['period', 'dt'], name='price_history_period_dt'),
+            models.Index(fields=['shop', 'external_id', 'dt'], name='price_history_shop_offer_dt'),
+        ]
 
 
 class Parameter(models.Model):
-    name = models.CharField(max_length=40, verbose_name='Название')
+    name = models.CharField(max_length=40, verbose_name='Название', unique=True)
 
     class Meta:
         verbose_name = 'Имя параметра'
@@ -188,7 +341,67 @@ class Contact(models.Model):
         return f'{self.city}, ул.{self.street}, дом {self.house}'
 
 
+# Отправляется после фиксации транзакции, в которой оформление или отмена заказа изменили остатки магазина
+stock_changed = Signal()
+
+
+class OrderQuerySet(models.QuerySet):
+
+    def transition(self, state, **fields):
+        """
+        Переводит заказы в статус state целиком: все позиции, для которых переход
+        допустим (см. OrderItemQuerySet.transition). fields записываются в
+        переведённые заказы. Возвращает id заказов, позиции которых переведены.
+        """
+        with transaction.atomic(using=self.db):
+            order_ids, _ = OrderItem.objects.filter(order__in=self).transition(state)
+            if order_ids and fields:
+                Order.objects.filter(id__in=order_ids).update(**fields)
+        return order_ids
+
+
+def change_stock(item_ids, sign):
+    """
+    Меняет остатки предложений из позиций заказов одним UPDATE: sign=-1 списывает, 1 возвращает.
+    """
+    if not item_ids:
+        return
+    items = OrderItem.objects.filter(id__in=item_ids)
+    ordered = items.filter(product_info=OuterRef('pk')).values('product_info').annotate(
+        total=Sum('quantity')).values('total')
+    offers = ProductInfo.objects.filter(id__in=items.values('product_info_id'))
+    if sign < 0 and offers.annotate(ordered=Subquery(ordered)).filter(quantity__lt=F('ordered')).exists():
+        raise ValueError('Недостаточно товара на складе')
+    offers.update(quantity=F('quantity') + sign * Subquery(ordered))
+    for shop_id in set(offers.values_list('shop_id', flat=True)):
+        transaction.on_commit(lambda shop_id=shop_id: stock_changed.send(sender=ProductInfo, shop_id=shop_id))
+
+
+def sync_order_states(order_ids):
+    """
+    Пересчитывает статусы заказов по их позициям: заказ находится в наименее
+    продвинутом статусе из статусов неотменённых позиций и отменён, только если
+    отменены все позиции. Возвращает id заказов, статус которых изменился.
+    """
+    ranks = {state: rank for rank, (state, _) in enumerate(STATE_CHOICES)}
+    states = dict.fromkeys(order_ids, 'canceled')
+    item_states = OrderItem.objects.filter(order_id__in=order_ids).exclude(state='canceled').values_list(
+        'order_id', 'state').distinct()
+    for order_id, state in item_states:
+        if states[order_id] == 'canceled' or ranks[state] < ranks[states[order_id]]:
+            states[order_id] = state
+
+    changed = defaultdict(list)
+    for order_id, state in Order.objects.filter(id__in=order_ids).values_list('id', 'state'):
+        if state != states[order_id]:
+            changed[states[order_id]].append(order_id)
+    for state, ids in changed.items():
+        Order.objects.filter(id__in=ids).update(state=state)
+    return sorted(order_id for ids in changed.values() for order_id in ids)
+
+
 class Order(models.Model):
+    objects = OrderQuerySet.as_manager()
     user = models.ForeignKey(User, verbose_name='Пользователь', related_name='orders', blank=True, on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True)
     state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
@@ -202,15 +415,62 @@ class Order(models.Model):
     def __str__(self):
         return str(self.dt)
 
+    def can_transition(self, state):
+        return state in ORDER_TRANSITIONS.get(self.state, ())
+
     @property
     def sum(self):
         return self.ordered_items.aggregate(total=Sum(F('quantity')))["total"] or 0
 
 
+class OrderItemQuerySet(models.QuerySet):
+
+    def transition(self, state):
+        """
+        Переводит позиции заказов в статус state: меняются только те, из текущего
+        статуса которых переход допустим (ORDER_TRANSITIONS). Так каждый поставщик
+        ведёт свою часть заказа из нескольких магазинов.
+
+        Оформление (переход в 'new') списывает товар со склада и отмечает это в
+        позиции, отмена возвращает на склад только списанное - в той же транзакции.
+        Статусы заказов пересчитываются по позициям (sync_order_states).
+        Возвращает (id заказов с переведёнными позициями, id заказов, статус
+        которых изменился).
+        """
+        sources = [source for source, targets in ORDER_TRANSITIONS.items() if state in targets]
+        with transaction.atomic(using=self.db):
+            items = self.filter(state__in=sources)
+            # Сначала блокируем заказы: переходы разных частей одного заказа пересчитывают его статус по очереди
+            orders = Order.objects.filter(id__in=items.values('order_id')).order_by('id').select_for_update()
+            order_ids = list(orders.values_list('id', flat=True))
+            if not order_ids:
+                return [], []
+
+            rows = list(items.filter(order_id__in=order_ids).select_for_update(of=('self',)).values_list(
+                'id', 'order_id'))
+            item_ids = [item_id for item_id, _ in rows]
+            moved = OrderItem.objects.filter(id__in=item_ids)
+            if state == 'new':
+                change_stock(item_ids, -1)
+                moved.update(state=state, stock_deducted=True)
+            elif state == 'canceled':
+                change_stock(list(moved.filter(stock_deducted=True).values_list('id', flat=True)), 1)
+                moved.update(state=state, stock_deducted=False)
+            else:
+                moved.update(state=state)
+
+            order_ids = sorted({order_id for _, order_id in rows})
+            return order_ids, sync_order_states(order_ids)
+
+
 class OrderItem(models.Model):
+    objects = OrderItemQuerySet.as_manager()
     order = models.ForeignKey(Order, verbose_name='Заказ', related_name='ordered_items', blank=True, on_delete=models.CASCADE)
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='ordered_items', blank=True, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # Статус своей части заказа ведёт каждый поставщик, статус заказа считается по позициям
+    state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15, default='basket')
+    stock_deducted = models.BooleanField(verbose_name='Товар списан со склада', default=False)
 
     class Meta:
         verbose_name = 'Позиция заказа'
@@ -244,3 +504,73 @@ class ConfirmEmailToken(models.Model):
         unique=True,
         default=get_token_generator().generate_token
     )
+
+
+class AuthToken(models.Model):
+    """
+    Токен авторизации с ограниченным сроком жизни, по одному на устройство.
+
+    В базе хранится только sha256 ключа (первичный ключ - поиск по индексу
+    PK, утечка таблицы не раскрывает токены). Срок продлевается при
+    использовании, см. CachedTokenAuthentication.
+    """
+    digest = models.CharField(_("Хэш ключа"), max_length=64, primary_key=True)
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='auth_tokens', on_delete=models.CASCADE)
+    device = models.CharField(verbose_name='Устройство', max_length=100, blank=True)
+    created_at = models.DateTimeField(verbose_name='Время создания', auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name='Действует до', db_index=True)
+
+    class Meta:
+        verbose_name = 'Токен авторизации'
+        verbose_name_plural = 'Токены авторизации'
+
+    @staticmethod
+    def hash_key(key):
+        return sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, device=''):
+        """Создаёт токен и возвращает пару (токен, ключ); ключ больше нигде не сохраняется."""
+        key = secrets.token_hex(20)
+        token = cls.objects.create(digest=cls.hash_key(key), user=user, device=device[:100],
+                                   expires_at=timezone.now() + settings.AUTH_TOKEN_TTL)
+        return token, key
+
+
+# Состояния фоновой задачи админки
+ADMIN_JOB_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершена'),
+    ('failed', 'Ошибка'),
+)
+
+
+class AdminJob(models.Model):
+    """
+    Массовое действие админки, выполняемое задачей Celery частями.
+
+    Выборка хранится как id отмеченных строк или параметры фильтров списка
+    (см. backend.admin_jobs.selection_filter), а воркер строит по ней запрос
+    заново: выборка «все строки списка» ставится в очередь без чтения таблицы.
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='admin_jobs', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    action = models.CharField(verbose_name='Действие', max_length=40)
+    description = models.CharField(verbose_name='Описание', max_length=255)
+    selection = models.JSONField(verbose_name='Выборка', default=dict, blank=True, encoder=DjangoJSONEncoder)
+    params = models.JSONField(verbose_name='Параметры', default=dict, blank=True)
+    state = models.CharField(verbose_name='Статус', choices=ADMIN_JOB_STATE_CHOICES, max_length=10, default='queued')
+    total = models.PositiveIntegerField(verbose_name='Всего объектов', default=0)
+    processed = models.PositiveIntegerField(verbose_name='Обработано', default=0)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(verbose_name='Создана', auto_now_add=True)
+    finished_at = models.DateTimeField(verbose_name='Завершена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача админки'
+        verbose_name_plural = 'Фоновые задачи админки'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return self.description
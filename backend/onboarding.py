@@ -0,0 +1,95 @@
+import csv
+import io
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from backend.models import ConfirmEmailToken, User
+from backend.serializers import OnboardingUserSerializer
+from backend.tasks import send_confirmation_emails
+
+
+def hash_passwords(passwords):
+    """
+    Хэширует пароли, распределяя их по ONBOARDING_HASH_WORKERS процессам.
+
+    Для пустого пароля make_password возвращает неиспользуемый пароль без
+    вычисления хэша - такой покупатель задаёт пароль через сброс пароля.
+    """
+    passwords = [password or None for password in passwords]
+    workers = settings.ONBOARDING_HASH_WORKERS
+    if workers < 2 or sum(password is not None for password in passwords) < 2:
+        return [make_password(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as pool:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+def read_onboarding_csv(file):
+    """Читает строки покупателей из CSV с заголовком (first_name, last_name, email, company, position, password)."""
+    return list(csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig')))
+
+
+def validate_buyers(rows):
+    """
+    Проверяет строки покупателей. Возвращает (данные, ошибки по номерам строк).
+    """
+    errors = {}
+    buyers = []
+    emails = {}
+    for index, row in enumerate(rows):
+        serializer = OnboardingUserSerializer(data=row)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+
+        data = dict(serializer.validated_data)
+        data['email'] = User.objects.normalize_email(data['email'])
+        if data['email'] in emails:
+            errors[index] = {'email': ['Email повторяется в списке']}
+            continue
+
+        if data.get('password'):
+            try:
+                validate_password(data['password'], User(**data))
+            except ValidationError as err:
+                errors[index] = {'password': list(err.messages)}
+                continue
+
+        emails[data['email']] = index
+        buyers.append(data)
+
+    for email in User.objects.filter(email__in=list(emails)).values_list('email', flat=True):
+        errors[emails[email]] = {'email': ['Пользователь с таким email уже существует']}
+    return buyers, errors
+
+
+def onboard_buyers(rows):
+    """
+    Регистрирует покупателей пачкой в одной транзакции.
+
+    Пароли хэшируются до транзакции в пуле процессов, пользователи и токены
+    подтверждения создаются через bulk_create, письма уходят одной задачей
+    после фиксации транзакции. Если хотя бы одна строка с ошибкой, ничего
+    не создаётся. Возвращает (созданные пользователи, ошибки по номерам строк).
+    """
+    buyers, errors = validate_buyers(rows)
+    if errors:
+        return [], errors
+
+    hashes = hash_passwords([buyer.pop('password', None) for buyer in buyers])
+    with transaction.atomic():
+        users = User.objects.bulk_create(
+            [User(password=password, type='buyer', is_active=False, **buyer) for buyer, password in zip(buyers, hashes)],
+            batch_size=1000)
+        tokens = ConfirmEmailToken.objects.bulk_create([ConfirmEmailToken(user=user) for user in users],
+                                                       batch_size=1000)
+        token_ids = [token.id for token in tokens]
+        transaction.on_commit(lambda: send_confirmation_emails.delay(token_ids))
+    return users, {}
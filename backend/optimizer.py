@@ -0,0 +1,98 @@
+import time
+from itertools import combinations
+from math import comb
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.models import ProductInfo
+
+# Сколько наборов магазинов перебирается точно; при большем числе магазины выбираются жадно
+MAX_SHOP_COMBINATIONS = 1000
+
+
+def offer_index_keys(product_ids):
+    # Версия меняется при загрузке прайса или смене статуса магазина - индекс строится заново
+    version = cache.get_or_set('offer-index-version', time.time_ns, None)
+    return {f'offer-index:{version}:{product_id}': product_id for product_id in product_ids}
+
+
+def get_offer_index(product_ids):
+    """
+    Индекс предложений {товар: [(цена, id предложения, id магазина, остаток), ...]},
+    отсортированных по цене. Берётся из кэша, недостающие товары читаются одним запросом.
+    """
+    keys = offer_index_keys(product_ids)
+    index = {keys[key]: offers for key, offers in cache.get_many(keys).items()}
+    missing = [product_id for product_id in product_ids if product_id not in index]
+    if missing:
+        built = {product_id: [] for product_id in missing}
+        for row in ProductInfo.objects.filter(product_id__in=missing, is_visible=True, quantity__gt=0).order_by(
+                'price', 'id').values_list('product_id', 'price', 'id', 'shop_id', 'quantity'):
+            built[row[0]].append(row[1:])
+        cache.set_many({key: built[product_id] for key, product_id in keys.items() if product_id in built},
+                       settings.OFFER_INDEX_TIMEOUT)
+        index.update(built)
+    return index
+
+
+def forget_offer_index():
+    cache.set('offer-index-version', time.time_ns(), None)
+
+
+def fill_basket(lines, index, shops=None):
+    """
+    Набирает каждую позицию из самых дешёвых предложений (только магазины shops, если заданы).
+    Возвращает (не хватило штук, сумма, выбранные предложения).
+    """
+    shortage, total, chosen = 0, 0, []
+    for product_id, quantity in lines:
+        offers = []
+        for price, offer_id, shop_id, stock in index[product_id]:
+            if quantity == 0:
+                break
+            if shops is not None and shop_id not in shops:
+                continue
+            taken = min(quantity, stock)
+            offers.append({'product_info': offer_id, 'shop_id': shop_id, 'price': price, 'quantity': taken})
+            quantity -= taken
+            total += taken * price
+        shortage += quantity
+        chosen.append((product_id, offers, quantity))
+    return shortage, total, chosen
+
+
+def choose_shops(lines, index, max_shops):
+    """
+    Выбирает не больше max_shops магазинов: сначала с наименьшей нехваткой товара, затем с наименьшей
+    суммой. Небольшое число наборов перебирается полностью, иначе магазины добавляются жадно.
+    """
+    candidates = sorted({offer[2] for product_id, _ in lines for offer in index[product_id]})
+    if len(candidates) <= max_shops:
+        return None
+
+    if comb(len(candidates), max_shops) <= MAX_SHOP_COMBINATIONS:
+        return min((set(shops) for shops in combinations(candidates, max_shops)),
+                   key=lambda shops: fill_basket(lines, index, shops)[:2])
+
+    shops = set()
+    for _ in range(max_shops):
+        shops.add(min((shop_id for shop_id in candidates if shop_id not in shops),
+                      key=lambda shop_id: fill_basket(lines, index, shops | {shop_id})[:2]))
+    return shops
+
+
+def optimize_basket(lines, max_shops=None):
+    """
+    Подбирает предложения активных магазинов под список [(id товара, количество)] с минимальной
+    суммой с учётом остатков. Остатки берутся из индекса предложений, обновляемого при загрузке прайсов.
+    """
+    index = get_offer_index([product_id for product_id, _ in lines])
+    shops = choose_shops(lines, index, max_shops) if max_shops else None
+    _, total, chosen = fill_basket(lines, index, shops)
+    return {
+        'total': total,
+        'shops': sorted({offer['shop_id'] for _, offers, _ in chosen for offer in offers}),
+        'items': [{'product_id': product_id, 'offers': offers} for product_id, offers, _ in chosen],
+        'missing': [{'product_id': product_id, 'quantity': quantity} for product_id, _, quantity in chosen if quantity],
+    }
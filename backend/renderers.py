@@ -0,0 +1,94 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Типы, которых нет в JSON (даты, Decimal, UUID, ленивые строки), приводятся так же, как в DRF
+encode_default = JSONEncoder().default
+
+
+def ujson_backend():
+    import ujson
+
+    def dumps(data):
+        return ujson.dumps(data, default=encode_default, ensure_ascii=False, escape_forward_slashes=False).encode()
+
+    return dumps, ujson.loads
+
+
+def orjson_backend():
+    import orjson
+
+    def dumps(data):
+        # Даты orjson по умолчанию пишет сам (+00:00 вместо Z) - отдаём их кодировщику DRF
+        return orjson.dumps(data, default=encode_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    return dumps, orjson.loads
+
+
+def stdlib_backend():
+    def dumps(data):
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+    return dumps, json.loads
+
+
+JSON_BACKENDS = {
+    'ujson': ujson_backend,
+    'orjson': orjson_backend,
+    'json': stdlib_backend,
+}
+
+
+def load_json_backend(name):
+    """Пара функций (dumps -> bytes, loads) выбранной библиотеки JSON."""
+    try:
+        return JSON_BACKENDS[name]()
+    except (KeyError, ImportError) as err:
+        raise ImproperlyConfigured(f'Библиотека JSON {name!r} недоступна: {err}')
+
+
+json_dumps, json_loads = load_json_backend(settings.API_JSON_LIBRARY)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на библиотеке API_JSON_LIBRARY. Ответ с отступами (?indent в Accept)
+    отрисовывается стандартным рендерером.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return json_dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser на библиотеке API_JSON_LIBRARY."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return json_loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class JsonResponse(HttpResponse):
+    """
+    Замена django.http.JsonResponse: тело сериализуется той же библиотекой,
+    что и ответы DRF.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=json_dumps(data), **kwargs)
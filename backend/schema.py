@@ -0,0 +1,97 @@
+import os
+from hashlib import sha256
+from importlib.util import find_spec
+from logging import getLogger
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+from django.conf import settings
+
+logger = getLogger(__name__)
+
+# Схема (YAML из файла) и её отрисовка по форматам для текущей версии файла и модулей-источников
+documents = {}
+documents_lock = Lock()
+
+
+def source_paths():
+    """Файлы модулей API_SCHEMA_SOURCES - при их изменении схема устаревает."""
+    return [find_spec(module).origin for module in settings.API_SCHEMA_SOURCES]
+
+
+def sources_mtime():
+    return max(os.stat(path).st_mtime_ns for path in source_paths())
+
+
+def schema_mtime():
+    try:
+        return os.stat(settings.API_SCHEMA_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def generate_schema():
+    """Генерирует схему OpenAPI по представлениям (как manage.py spectacular) и возвращает YAML."""
+    from drf_spectacular.renderers import OpenApiYamlRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return OpenApiYamlRenderer().render(generator.get_schema(request=None, public=True), renderer_context={})
+
+
+def write_schema(content):
+    """Записывает схему в API_SCHEMA_FILE через временный файл - читатели не увидят её наполовину."""
+    directory = os.path.dirname(settings.API_SCHEMA_FILE)
+    with NamedTemporaryFile('wb', dir=directory, prefix='.schema-', delete=False) as schema_file:
+        schema_file.write(content)
+    os.replace(schema_file.name, settings.API_SCHEMA_FILE)
+
+
+def load_schema():
+    """
+    YAML схемы из API_SCHEMA_FILE. Если файла нет или модули API_SCHEMA_SOURCES
+    изменены позже него, схема генерируется заново и файл перезаписывается.
+    """
+    mtime = schema_mtime()
+    if mtime is not None and mtime >= sources_mtime():
+        with open(settings.API_SCHEMA_FILE, 'rb') as schema_file:
+            return schema_file.read()
+
+    content = generate_schema()
+    try:
+        write_schema(content)
+    except OSError as err:
+        # Файловая система только для чтения: схема остаётся в памяти процесса до его перезапуска
+        logger.warning(f'Не удалось записать схему API в {settings.API_SCHEMA_FILE}: {err}')
+    return content
+
+
+def render_schema(content, schema_format):
+    if schema_format != 'json':
+        return content
+
+    import yaml
+    from drf_spectacular.renderers import OpenApiJsonRenderer
+
+    schema = yaml.load(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    return OpenApiJsonRenderer().render(schema, renderer_context={})
+
+
+def schema_document(schema_format):
+    """
+    Схема в формате yaml или json и её ETag.
+
+    Схема генерируется только при изменении модулей-источников, в остальное время
+    запрос стоит нескольких stat() и чтения из памяти.
+    """
+    version = (schema_mtime(), sources_mtime())
+    with documents_lock:
+        if documents.get('version') != version:
+            content = load_schema()
+            documents.clear()
+            # После перезаписи у файла новое время изменения
+            documents.update(version=(schema_mtime(), sources_mtime()), source=content)
+        if schema_format not in documents:
+            content = render_schema(documents['source'], schema_format)
+            documents[schema_format] = content, f'"{sha256(content).hexdigest()}"'
+        return documents[schema_format]
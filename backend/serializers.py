@@ -1,3 +1,5 @@
+from django.conf import settings
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
 from backend.models import ConfirmEmailToken
@@ -25,14 +27,27 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'first_name', 'last_name', 'email', 'company', 'position', 'contacts', 'type')
         read_only_fields = ('id',)
 
+class OnboardingUserSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор строки массовой регистрации покупателей.
+
+    Уникальность email проверяется одним запросом на всю пачку, а не в каждой строке.
+    """
+    email = serializers.EmailField(max_length=254)
+    password = serializers.CharField(required=False, allow_blank=True, write_only=True)
+
+    class Meta:
+        model = User
+        fields = ('first_name', 'last_name', 'email', 'company', 'position', 'password')
+
 class CategorySerializer(serializers.ModelSerializer):
     """
     Сериализатор для модели Category.
     """
     class Meta:
         model = Category
-        fields = ('id', 'name',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'parent', 'offers_count', 'shops_count')
+        read_only_fields = ('id', 'offers_count', 'shops_count')
 
 class ShopSerializer(serializers.ModelSerializer):
     """
@@ -68,21 +83,29 @@ class ProductInfoSerializer(serializers.ModelSerializer):
     Сериализатор для модели ProductInfo.
     """
     product = ProductSerializer(read_only=True)  # Вложенный сериализатор для товара
-    product_parameters = ProductParameterSerializer(many=True, read_only=True)  # Параметры товара
+    product_parameters = serializers.SerializerMethodField()  # Параметры товара
 
     class Meta:
         model = ProductInfo
         fields = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters',)
         read_only_fields = ('id',)
 
+    @extend_schema_field(ProductParameterSerializer(many=True))
+    def get_product_parameters(self, obj):
+        # В компактном режиме параметры лежат прямо в предложении, иначе - в предзагруженных
+        # product_parameters (запрос предложений должен делать prefetch_related)
+        if settings.PRODUCT_PARAMETERS_STORAGE == 'compact':
+            return [{'parameter': name, 'value': value} for name, value in obj.parameters.items()]
+        return ProductParameterSerializer(obj.product_parameters.all(), many=True).data
+
 class OrderItemSerializer(serializers.ModelSerializer):
     """
     Сериализатор для модели OrderItem.
     """
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'order',)
-        read_only_fields = ('id',)
+        fields = ('id', 'product_info', 'quantity', 'order', 'state',)
+        read_only_fields = ('id', 'state',)
         extra_kwargs = {
             'order': {'write_only': True},  # Скрываем поле заказа при выдаче данных
         }
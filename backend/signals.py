@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.authentication import token_cache
+from backend.basket import forget_shop_basket_summaries
+from backend.categories import forget_category_tree, update_category_counts, update_shop_category_counts
+from backend.importer import ParameterRegistry, price_imported
+from backend.lookup import forget_offer_lookup
+from backend.models import Category, Parameter, User, shop_state_changed, stock_changed
+from backend.optimizer import forget_offer_index
+from backend.tasks import refresh_price_analytics
+
+
+@receiver(post_delete, sender=Parameter)
+def forget_parameter(sender, instance, **kwargs):
+    """
+    Убираем удалённый параметр из таблицы интернирования
+    """
+    cache.delete(ParameterRegistry.cache_key(instance.name))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    """
+    Сбрасываем кэш токенов пользователя при любом изменении (пароль, деактивация, тип)
+    """
+    # У нового пользователя токенов ещё нет - не тратим запрос при регистрации
+    if created:
+        return
+    token_cache.invalidate_user(instance.id)
+
+
+
+@receiver(price_imported)
+@receiver(shop_state_changed)
+def forget_price_caches(sender, shop_id, **kwargs):
+    """
+    Сбрасываем кэши, построенные на ценах, остатках и видимости предложений магазина
+    """
+    forget_shop_basket_summaries(shop_id)
+    forget_offer_index()
+    forget_offer_lookup()
+    update_shop_category_counts(shop_id)
+    refresh_price_analytics.delay(shop_id)
+
+
+@receiver(stock_changed)
+def forget_stock_caches(sender, shop_id, **kwargs):
+    """
+    Сбрасываем кэши, построенные на остатках предложений магазина, после оформления или отмены заказа
+    """
+    forget_shop_basket_summaries(shop_id)
+    forget_offer_index()
+    forget_offer_lookup()
+    update_shop_category_counts(shop_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def forget_categories(sender, instance, **kwargs):
+    """
+    Сбрасываем закэшированное дерево категорий при изменении категории,
+    а при переносе в другую ветку пересчитываем счётчики старых и новых предков
+    """
+    forget_category_tree()
+    if getattr(instance, 'moved_from', ''):
+        update_category_counts([instance.id, *(int(category_id) for category_id in
+                                                instance.moved_from.strip('/').split('/'))])
@@ -1,11 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from logging import getLogger
+from pathlib import Path
 import time
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from celery import shared_task
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery
 from django.utils import timezone
-from datetime import timedelta
-from backend.models import ConfirmEmailToken
+from datetime import datetime, timedelta
+from backend.admin_jobs import execute_admin_job
+from backend.analytics import rebuild_price_analytics
+from backend.exporter import export_catalog, export_filename
+from backend.importer import fetch_price, load_catalog, load_price, read_price_source
+from backend.throttling import concurrency_slot
+from backend.models import STATE_CHOICES, AdminJob, AuthToken, ConfirmEmailToken, Order, PriceHistory, Shop
 
 logger = getLogger(__name__)
 
@@ -40,6 +51,38 @@ def mass_send_emails(title, message, recipients):
     for recipient in recipients:
         send_email.delay(title, message, recipient)
 
+# Отправка пачки писем через одно соединение
+def send_messages(title, messages):
+    """Отправляет письма [(текст, адресат)] с темой title через одно SMTP-соединение."""
+    messages = [
+        EmailMultiAlternatives(subject=title, body=message, from_email=settings.EMAIL_HOST_USER, to=[recipient])
+        for message, recipient in messages
+    ]
+    sent = 0
+    try:
+        with get_connection() as connection:
+            sent = connection.send_messages(messages) or 0
+    except Exception as excp:
+        logger.error(f"Ошибка массовой отправки писем \"{title}\": {excp}")
+    logger.info(f"Отправлено писем \"{title}\": {sent} из {len(messages)}.")
+    return sent
+
+# Письма с токенами подтверждения для пачки регистраций
+@shared_task()
+def send_confirmation_emails(token_ids):
+    """Отправляет письма с токенами подтверждения одной пачкой."""
+    tokens = ConfirmEmailToken.objects.filter(id__in=token_ids).values_list('key', 'user__email')
+    return send_messages("Регистрация успешна", [(f"Токен подтверждения: {key}", email) for key, email in tokens])
+
+# Уведомления о смене статуса заказов
+@shared_task()
+def notify_order_state(order_ids):
+    """Отправляет покупателям письма о новом статусе заказов одной пачкой."""
+    orders = Order.objects.filter(id__in=order_ids).values_list('id', 'state', 'user__email')
+    states = dict(STATE_CHOICES)
+    return send_messages("Обновление статуса заказа",
+                         [(f"Заказ №{order_id}: {states[state]}", email) for order_id, state, email in orders])
+
 # Удаление просроченных токенов
 @shared_task()
 def clean_expired_tokens():
@@ -47,6 +90,168 @@ def clean_expired_tokens():
     expired_date = timezone.now() - timedelta(days=expiration_days)
     ConfirmEmailToken.objects.filter(created_at__lt=expired_date).delete()
 
+# Сворачивание истории цен
+@shared_task()
+def compact_price_history():
+    """Сворачивает старые изменения цен в суточные точки и удаляет историю старше срока хранения."""
+    now = timezone.now()
+    # Граница по началу суток, чтобы день не оказался свёрнут наполовину
+    raw_border = timezone.localtime(now - timedelta(days=settings.PRICE_HISTORY_RAW_DAYS)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    PriceHistory.objects.filter(dt__lt=now - timedelta(days=settings.PRICE_HISTORY_RETENTION_DAYS)).delete()
+
+    points = PriceHistory.objects.filter(period='point', dt__lt=raw_border)
+    # Обрабатываем по одному дню, чтобы не держать в памяти всю историю
+    for day in points.dates('dt', 'day'):
+        day_start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        day_range = (day_start, day_start + timedelta(days=1))
+        day_points = points.filter(dt__gte=day_range[0], dt__lt=day_range[1])
+        # Точки предложения определяются магазином и внешним ID: у истории удалённого предложения product_info пуст
+        last_point = PriceHistory.objects.filter(
+            period='point', shop_id=OuterRef('shop_id'), external_id=OuterRef('external_id'),
+            dt__gte=day_range[0], dt__lt=day_range[1]
+        ).order_by('-dt', '-id')
+        rollups = day_points.values('shop_id', 'external_id').annotate(
+            offer_id=Max('product_info_id'),
+            last_dt=Max('dt'),
+            low=Min('price_min'),
+            high=Max('price_max'),
+            last_price=Subquery(last_point.values('price')[:1]),
+            last_quantity=Subquery(last_point.values('quantity')[:1]),
+        ).order_by()
+        with transaction.atomic():
+            PriceHistory.objects.bulk_create((
+                PriceHistory(product_info_id=row['offer_id'], shop_id=row['shop_id'], external_id=row['external_id'],
+                             dt=row['last_dt'], period='day',
+                             price=row['last_price'], price_min=row['low'], price_max=row['high'],
+                             quantity=row['last_quantity'])
+                for row in rollups.iterator()
+            ), batch_size=1000)
+            day_points.delete()
+
+# Удаление истёкших токенов авторизации
+@shared_task()
+def purge_expired_auth_tokens(batch_size=1000):
+    """Удаляет истёкшие токены авторизации пачками, не блокируя таблицу надолго."""
+    expired = AuthToken.objects.filter(expires_at__lt=timezone.now())
+    deleted = 0
+    while True:
+        digests = list(expired.values_list('digest', flat=True)[:batch_size])
+        if not digests:
+            return deleted
+        deleted += AuthToken.objects.filter(digest__in=digests).delete()[0]
+
+# Опрос прайсов поставщиков
+@shared_task()
+def poll_shop_feeds():
+    """
+    Проверяет прайсы активных магазинов по Shop.url и загружает изменившиеся.
+
+    Одновременно скачивается не больше SHOP_FEED_CONCURRENCY прайсов, разбор
+    и запись в базу идут по одному. Неизменившийся прайс (304 или тот же хэш)
+    не разбирается. Загрузка занимает тот же слот 'import', что и PartnerUpdate;
+    если свободного слота нет, прайс магазина проверяется при следующем опросе.
+    """
+    lock = 'poll-shop-feeds-lock'
+    if not cache.add(lock, True, settings.SHOP_FEED_POLL_INTERVAL):
+        logger.info("Предыдущий опрос прайсов ещё не завершён.")
+        return
+
+    try:
+        shops = iter(Shop.objects.filter(state=True, user__isnull=False, url__isnull=False).exclude(url='').values(
+            'id', 'user_id', 'url', 'feed_etag', 'feed_last_modified'))
+        with ThreadPoolExecutor(max_workers=settings.SHOP_FEED_CONCURRENCY) as pool:
+            running = {}
+            while True:
+                # Держим в работе не больше SHOP_FEED_CONCURRENCY скачиваний
+                for shop in islice(shops, settings.SHOP_FEED_CONCURRENCY - len(running)):
+                    future = pool.submit(fetch_price, shop['url'], shop['feed_etag'], shop['feed_last_modified'])
+                    running[future] = shop
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    refresh_shop_feed(running.pop(future), future)
+    finally:
+        cache.delete(lock)
+
+
+def refresh_shop_feed(shop, future):
+    """Загружает скачанный прайс магазина, если он изменился."""
+    from requests import RequestException, Timeout
+
+    checked = {'feed_checked_at': timezone.now()}
+    try:
+        response = future.result()
+    except Timeout:
+        logger.warning(f"Прайс магазина {shop['id']} не скачан за {settings.SHOP_FEED_TIMEOUT} с")
+        Shop.objects.filter(id=shop['id']).update(**checked)
+        return
+    except RequestException as excp:
+        logger.warning(f"Не удалось скачать прайс магазина {shop['id']}: {excp}")
+        Shop.objects.filter(id=shop['id']).update(**checked)
+        return
+
+    if response is None:
+        Shop.objects.filter(id=shop['id']).update(**checked)
+        return
+
+    checked.update(feed_etag=response.headers.get('ETag', ''),
+                   feed_last_modified=response.headers.get('Last-Modified', ''))
+    try:
+        with concurrency_slot('import', settings.IMPORT_CONCURRENCY, settings.IMPORT_SLOT_TIMEOUT) as acquired:
+            if not acquired:
+                # ETag не сохраняем, иначе при следующем опросе поставщик ответит 304
+                logger.info(f"Нет свободного слота загрузки, прайс магазина {shop['id']} отложен")
+                return
+            stats = load_price(response.content, shop['user_id'])
+    except Exception as excp:
+        logger.error(f"Ошибка загрузки прайса магазина {shop['id']}: {excp}")
+        Shop.objects.filter(id=shop['id']).update(feed_checked_at=checked['feed_checked_at'])
+        return
+    if not stats['unchanged']:
+        logger.info(f"Прайс магазина {shop['id']} обновлён: {stats}")
+    Shop.objects.filter(id=shop['id']).update(**checked)
+
+# Первичная загрузка каталога поставщика
+@shared_task(bind=True, max_retries=None)
+def load_shop_catalog(self, shop_id, source=None):
+    """Загружает каталог магазина через COPY из файла или по ссылке (по умолчанию Shop.url)."""
+    shop = Shop.objects.get(id=shop_id)
+    # Занимаем общий с PartnerUpdate слот загрузки, иначе повторяем позже
+    with concurrency_slot('import', settings.IMPORT_CONCURRENCY, settings.IMPORT_SLOT_TIMEOUT) as acquired:
+        if not acquired:
+            raise self.retry(countdown=60)
+        stats = load_catalog(read_price_source(source or shop.url), shop.user_id)
+    logger.info(f"Каталог магазина {shop_id} загружен: {stats}")
+    return stats
+
+# Пересчёт аналитики цен после загрузки прайса
+@shared_task()
+def refresh_price_analytics(shop_id):
+    """Сбрасывает и заново строит отчёты аналитики цен по категориям магазина."""
+    rebuild_price_analytics(shop_id)
+
+# Выгрузка каталога в файл
+@shared_task()
+def export_shop_catalog(shop_id, file_format, category_id=None):
+    """Выгружает каталог магазина в сжатый файл в EXPORT_ROOT и возвращает путь к нему."""
+    shop = Shop.objects.get(id=shop_id)
+    export_root = Path(settings.EXPORT_ROOT)
+    export_root.mkdir(parents=True, exist_ok=True)
+    path = export_root / export_filename(shop, file_format, category_id)
+    with open(path, 'wb') as export_file:
+        for chunk in export_catalog(shop, file_format, category_id):
+            export_file.write(chunk)
+    logger.info(f"Каталог магазина {shop_id} выгружен в {path}.")
+    return str(path)
+
+# Массовые действия админки
+@shared_task()
+def run_admin_job(job_id):
+    """Выполняет массовое действие админки пачками с записью прогресса в AdminJob."""
+    execute_admin_job(AdminJob.objects.get(id=job_id))
+
 # Тестовая функция для демонстрации задержки
 def slow_function(limit=10):
     """Демонстрирует задержку с интервалом."""
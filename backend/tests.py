@@ -1,3 +1,1464 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from hashlib import sha256
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+import requests
+import yaml
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
+
+from backend.basket import get_basket_summary, summary_cache_key
+from backend.admin import ProductInfoAdmin
+from backend.admin_jobs import create_admin_job, execute_admin_job, job_queryset
+from backend.lookup import lookup_offers
+from backend.management.commands.benchmark_startup import parse_importtime
+from backend.middleware import COMPRESSORS, CompressionMiddleware, GzipStream, choose_encoding, compress_stream
+from backend import schema
+from backend.renderers import JSON_BACKENDS, FastJSONParser, FastJSONRenderer, JsonResponse, load_json_backend
+from backend.analytics import get_product_price_stats, rebuild_price_analytics
+from backend.authentication import CachedTokenAuthentication, load_full_user, token_cache
+from backend.importer import load_catalog, load_price, normalize_goods, normalize_price
+from backend.models import AdminJob, AuthToken, Category, ConfirmEmailToken, Contact, Order, OrderItem, Parameter, \
+    PriceHistory, ProductInfo, ProductParameter, Shop, User
+from backend.optimizer import optimize_basket
+from backend.serializers import ProductInfoSerializer
+from backend.tasks import compact_price_history, load_shop_catalog, poll_shop_feeds, purge_expired_auth_tokens
+from backend.throttling import ScopedCostThrottle, concurrency_slot
+
+# Тесты не трогают общий Redis: у каждого процесса свой кэш в памяти
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+CATEGORIES = [{'id': 224, 'name': 'Смартфоны'}, {'id': 15, 'name': 'Аксессуары'}]
+
+
+def make_good(external_id, price=1000, quantity=10, category=224, **fields):
+    good = {
+        'id': external_id,
+        'category': category,
+        'model': f'model/{external_id}',
+        'name': f'Товар {external_id}',
+        'price': price,
+        'price_rrc': price + 100,
+        'quantity': quantity,
+        'parameters': {'Цвет': 'черный', 'Память (Гб)': 256},
+    }
+    good.update(fields)
+    return good
+
+
+def price_content(goods, shop='Связной', categories=CATEGORIES):
+    """Прайс поставщика в формате YAML, как его загружает PartnerUpdate."""
+    return yaml.safe_dump({'shop': shop, 'categories': categories, 'goods': goods}, allow_unicode=True).encode()
+
+
+def make_user(email, user_type='buyer', **fields):
+    return User.objects.create_user(email=email, password='Secret-pass-123', username=email, type=user_type,
+                                    is_active=True, **fields)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ShopTestCase(TestCase):
+    """Общая основа: чистый кэш, поставщик и клиент API."""
+
+    def setUp(self):
+        cache.clear()
+        self.partner = make_user('partner@example.com', 'shop')
+        self.client = APIClient()
+
+    def load(self, goods, user=None, **kwargs):
+        return load_price(price_content(goods, **kwargs), (user or self.partner).id)
+
+
+class ParameterStorageTests(ShopTestCase):
+
+    def test_parameter_names_are_interned(self):
+        self.load([make_good(1), make_good(2)])
+        other = make_user('other@example.com', 'shop')
+        self.load([make_good(3, parameters={'Цвет': 'белый', 'Вес (г)': 200})], user=other, shop='Другой')
+
+        self.assertEqual(sorted(Parameter.objects.values_list('name', flat=True)), ['Вес (г)', 'Память (Гб)', 'Цвет'])
+        self.assertEqual(ProductParameter.objects.count(), 6)
+
+    def test_rows_storage_serializes_prefetched_parameters(self):
+        self.load([make_good(1), make_good(2)])
+        offers = list(ProductInfo.objects.select_related('product__category').prefetch_related(
+            'product_parameters__parameter'))
+
+        with self.assertNumQueries(0):
+            data = ProductInfoSerializer(offers, many=True).data
+        self.assertEqual(sorted((item['parameter'], item['value']) for item in data[0]['product_parameters']),
+                         [('Память (Гб)', '256'), ('Цвет', 'черный')])
+
+    @override_settings(PRODUCT_PARAMETERS_STORAGE='compact')
+    def test_compact_storage_does_not_query_parameter_rows(self):
+        self.load([make_good(1), make_good(2, parameters={})])
+        offers = list(ProductInfo.objects.select_related('product__category').order_by('external_id'))
+
+        # Предложение без параметров не должно откатываться к запросу ProductParameter
+        with self.assertNumQueries(0):
+            data = ProductInfoSerializer(offers, many=True).data
+        self.assertEqual(data[1]['product_parameters'], [])
+        self.assertIn({'parameter': 'Цвет', 'value': 'черный'}, data[0]['product_parameters'])
+        self.assertFalse(ProductParameter.objects.exists())
+
+    @override_settings(PRODUCT_PARAMETERS_STORAGE='compact')
+    def test_compact_storage_filter(self):
+        self.load([make_good(1), make_good(2, parameters={'Цвет': 'белый'})])
+
+        response = self.client.get('/api/v1/products/', {'parameter': 'Цвет', 'value': 'белый'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([offer['model'] for offer in response.json()['results']], ['model/2'])
+
+
+class MergeDuplicateParametersMigrationTests(TransactionTestCase):
+    """0004 добавляет unique к Parameter.name и перед этим сливает одноимённые параметры."""
+    before = [('backend', '0003_productinfo_updated_at_alter_confirmemailtoken_key')]
+    after = [('backend', '0004_parameter_unique_productinfo_parameters')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes())
+
+    def test_duplicates_are_merged(self):
+        apps = self.migrate(self.before)
+        Shop, Category, Product = (apps.get_model('backend', name) for name in ('Shop', 'Category', 'Product'))
+        ProductInfo, Parameter, ProductParameter = (apps.get_model('backend', name) for name in
+                                                    ('ProductInfo', 'Parameter', 'ProductParameter'))
+        shop = Shop.objects.create(name='Связной')
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Смартфоны'))
+        first, second = (ProductInfo.objects.create(product=product, shop=shop, external_id=external_id, quantity=1,
+                                                    price=1, price_rrc=1) for external_id in (1, 2))
+        color, duplicate, weight = (Parameter.objects.create(name=name) for name in ('Цвет', 'Цвет', 'Вес'))
+        ProductParameter.objects.create(product_info=first, parameter=color, value='черный')
+        ProductParameter.objects.create(product_info=first, parameter=duplicate, value='белый')
+        ProductParameter.objects.create(product_info=second, parameter=duplicate, value='красный')
+        ProductParameter.objects.create(product_info=second, parameter=weight, value='200')
+
+        apps = self.migrate(self.after)
+        Parameter, ProductParameter = (apps.get_model('backend', name) for name in ('Parameter', 'ProductParameter'))
+        self.assertEqual(sorted(Parameter.objects.values_list('name', flat=True)), ['Вес', 'Цвет'])
+        self.assertEqual(sorted(ProductParameter.objects.values_list('product_info__external_id', 'parameter_id',
+                                                                     'value')),
+                         [(1, color.id, 'черный'), (2, color.id, 'красный'), (2, weight.id, '200')])
+
+
+class PriceHistoryTests(ShopTestCase):
+
+    def history(self, external_id):
+        return list(PriceHistory.objects.filter(external_id=external_id).order_by('dt', 'id').values_list(
+            'product_info_id', 'price', 'quantity'))
+
+    def test_new_and_changed_offers_are_recorded(self):
+        self.load([make_good(1), make_good(2)])
+        self.load([make_good(1, price=900), make_good(2, model='model/2b')])
+
+        offer = ProductInfo.objects.get(external_id=1)
+        self.assertEqual(self.history(1), [(offer.id, 1000, 10), (offer.id, 900, 10)])
+        # Без изменения цены и остатка новая точка не пишется
+        self.assertEqual(len(self.history(2)), 1)
+        self.assertEqual(PriceHistory.objects.filter(shop__user=self.partner).count(), 3)
+
+    def test_history_outlives_deleted_offer(self):
+        self.load([make_good(1), make_good(2)])
+        self.load([make_good(2)])
+
+        self.assertEqual(self.history(1), [(None, 1000, 10)])
+
+        self.load([make_good(1, price=800), make_good(2)])
+        offer = ProductInfo.objects.get(external_id=1)
+        self.assertEqual(self.history(1), [(offer.id, 1000, 10), (offer.id, 800, 10)])
+
+    @override_settings(PRICE_HISTORY_RAW_DAYS=1, PRICE_HISTORY_RETENTION_DAYS=30)
+    def test_compaction_keeps_deleted_offers(self):
+        self.load([make_good(1), make_good(2)])
+        self.load([make_good(1, price=900), make_good(2, quantity=5)])
+        self.load([make_good(2, quantity=5)])
+        PriceHistory.objects.update(dt=timezone.now() - timedelta(days=3))
+
+        compact_price_history()
+
+        rows = PriceHistory.objects.order_by('external_id').values_list(
+            'period', 'external_id', 'product_info_id', 'price', 'price_min', 'price_max', 'quantity')
+        self.assertEqual(list(rows), [
+            ('day', 1, None, 900, 900, 1000, 10),
+            ('day', 2, ProductInfo.objects.get(external_id=2).id, 1000, 1000, 1000, 5),
+        ])
+
+
+def feed_response(goods, etag='"v1"', **kwargs):
+    return mock.Mock(content=price_content(goods, **kwargs), headers={'ETag': etag})
+
+
+class ShopFeedTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.partner)
+
+    def test_partner_update_subscribes_to_feed(self):
+        with mock.patch('backend.views.fetch_price', return_value=feed_response([make_good(1)])) as fetch:
+            response = self.client.post('/api/v1/partner/update', {'url': 'https://example.com/price.yaml'})
+
+        self.assertEqual(response.status_code, 200)
+        fetch.assert_called_once_with('https://example.com/price.yaml')
+        self.assertEqual(Shop.objects.values_list('url', 'feed_etag').get(),
+                         ('https://example.com/price.yaml', '"v1"'))
+
+    def test_partner_update_timeout(self):
+        with mock.patch('backend.views.fetch_price', side_effect=requests.Timeout):
+            response = self.client.post('/api/v1/partner/update', {'url': 'https://example.com/price.yaml'})
+
+        self.assertEqual(response.status_code, 504)
+        self.assertFalse(Shop.objects.exists())
+
+    def test_poll_loads_changed_feed_only(self):
+        self.load([make_good(1)])
+        Shop.objects.update(url='https://example.com/price.yaml', feed_etag='"v1"')
+
+        with mock.patch('backend.tasks.fetch_price', return_value=None) as fetch:
+            poll_shop_feeds()
+        fetch.assert_called_once_with('https://example.com/price.yaml', '"v1"', '')
+
+        with mock.patch('backend.tasks.fetch_price', return_value=feed_response([make_good(1, price=900)], '"v2"')):
+            poll_shop_feeds()
+        self.assertEqual(ProductInfo.objects.get().price, 900)
+        self.assertEqual(Shop.objects.get().feed_etag, '"v2"')
+
+    def test_poll_timeout_keeps_feed(self):
+        self.load([make_good(1)])
+        Shop.objects.update(url='https://example.com/price.yaml', feed_etag='"v1"')
+
+        with mock.patch('backend.tasks.fetch_price', side_effect=requests.Timeout), \
+                self.assertLogs('backend.tasks', 'WARNING'):
+            poll_shop_feeds()
+        shop = Shop.objects.get()
+        self.assertIsNotNone(shop.feed_checked_at)
+        self.assertEqual(shop.feed_etag, '"v1"')
+
+    @override_settings(IMPORT_CONCURRENCY=1)
+    def test_poll_waits_for_import_slot(self):
+        self.load([make_good(1)])
+        Shop.objects.update(url='https://example.com/price.yaml', feed_etag='"v1"')
+
+        with concurrency_slot('import', 1, 60), \
+                mock.patch('backend.tasks.fetch_price', return_value=feed_response([make_good(1, price=900)], '"v2"')):
+            poll_shop_feeds()
+        # Прайс не загружен, и ETag старый: следующий опрос скачает его снова
+        self.assertEqual(ProductInfo.objects.get().price, 1000)
+        self.assertEqual(Shop.objects.get().feed_etag, '"v1"')
+
+
+class PriceDigestTests(ShopTestCase):
+
+    def test_same_price_is_not_parsed(self):
+        self.load([make_good(1), make_good(2)])
+
+        with mock.patch('backend.importer.parse_price') as parse:
+            stats = self.load([make_good(1), make_good(2)])
+        parse.assert_not_called()
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'deleted': 0, 'skipped': 2, 'unchanged': True})
+
+    def test_unchanged_goods_are_skipped(self):
+        self.load([make_good(1), make_good(2)])
+
+        stats = self.load([make_good(1), make_good(2, price=900), make_good(3)])
+        self.assertEqual(stats, {'created': 1, 'updated': 1, 'deleted': 0, 'skipped': 1, 'unchanged': False})
+
+    def test_storage_switch_reloads_same_price(self):
+        goods = [make_good(1), make_good(2)]
+        self.load(goods)
+
+        with self.settings(PRODUCT_PARAMETERS_STORAGE='compact'):
+            stats = self.load(goods)
+        self.assertEqual((stats['unchanged'], stats['updated']), (False, 2))
+        self.assertFalse(ProductParameter.objects.exists())
+        self.assertEqual(ProductInfo.objects.filter(external_id=1).get().parameters,
+                         {'Цвет': 'черный', 'Память (Гб)': '256'})
+
+        stats = self.load(goods)
+        self.assertEqual((stats['unchanged'], stats['updated']), (False, 2))
+        self.assertEqual(ProductParameter.objects.count(), 4)
+        self.assertEqual(ProductInfo.objects.filter(external_id=1).get().parameters, {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMPORT_WORKERS=2, IMPORT_PARTITION_SIZE=3)
+class NormalizePriceTests(TransactionTestCase):
+    """Параллельная нормализация прайса не должна форкаться посреди транзакции."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parallel_matches_serial(self):
+        goods = [make_good(external_id) for external_id in range(1, 9)]
+        self.assertEqual(normalize_price(goods, False), normalize_goods(goods, False))
+
+    def test_no_pool_inside_transaction(self):
+        goods = [make_good(external_id) for external_id in range(1, 9)]
+        with transaction.atomic(), mock.patch('backend.importer.ProcessPoolExecutor') as pool:
+            self.assertEqual(len(normalize_price(goods, False)), 8)
+        pool.assert_not_called()
+
+    def test_load_price_normalizes_before_transaction(self):
+        in_transaction = []
+
+        def normalize(goods, compact):
+            in_transaction.append(connection.in_atomic_block)
+            return normalize_goods(goods, compact)
+
+        partner = make_user('partner@example.com', 'shop')
+        # После фиксации транзакции импорт ставит в очередь пересчёт аналитики
+        with mock.patch('backend.importer.normalize_price', side_effect=normalize), \
+                mock.patch('backend.signals.refresh_price_analytics'):
+            load_price(price_content([make_good(1), make_good(2)]), partner.id)
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(ProductInfo.objects.count(), 2)
+
+
+class CatalogLoaderTests(ShopTestCase):
+    """Вне PostgreSQL load_catalog выполняет обычный пакетный импорт."""
+
+    def test_load_catalog(self):
+        content = price_content([make_good(1), make_good(2, category=15)])
+
+        stats = load_catalog(content, self.partner.id)
+        self.assertEqual((stats['created'], stats['updated'], stats['deleted']), (2, 0, 0))
+        self.assertEqual(ProductParameter.objects.count(), 4)
+        # Последующая загрузка того же файла через PartnerUpdate не разбирает его
+        self.assertTrue(load_price(content, self.partner.id)['unchanged'])
+
+    def test_empty_text_fields(self):
+        load_catalog(price_content([make_good(1, model='', parameters={'Цвет': ''})]), self.partner.id)
+
+        self.assertEqual(ProductInfo.objects.get().model, '')
+        self.assertEqual(list(ProductParameter.objects.values_list('parameter__name', 'value')), [('Цвет', '')])
+
+    def test_task_reads_file(self):
+        self.load([make_good(1)])
+        shop = Shop.objects.get()
+        path = self.enterContext(tempfile.TemporaryDirectory()) + '/catalog.yaml'
+        with open(path, 'wb') as price_file:
+            price_file.write(price_content([make_good(1), make_good(2)]))
+
+        stats = load_shop_catalog(shop.id, path)
+        self.assertEqual((stats['created'], stats['skipped']), (1, 1))
+
+    @override_settings(IMPORT_CONCURRENCY=1)
+    def test_task_waits_for_import_slot(self):
+        self.load([make_good(1)])
+
+        with concurrency_slot('import', 1, 60), mock.patch('backend.tasks.load_catalog') as load, \
+                self.assertRaises(Retry):
+            load_shop_catalog(Shop.objects.get().id, '/nonexistent.yaml')
+        load.assert_not_called()
+
+
+class CatalogExportTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.goods = [make_good(1, parameters={'Цвет': 'черный'}), make_good(2, category=15, parameters={})]
+        self.load(self.goods)
+        self.client.force_authenticate(self.partner)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/partner/export', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_yaml_export_loads_back_unchanged(self):
+        response, content = self.export(file_format='yaml', gzip='false')
+
+        self.assertEqual(response['Content-Type'], 'application/x-yaml')
+        self.assertEqual(yaml.safe_load(content)['goods'], self.goods)
+        other = make_user('other@example.com', 'shop')
+        self.assertEqual(load_price(content, other.id)['created'], 2)
+        # Лишний перевод строки меняет хэш файла, но хэши товаров совпадают с исходным прайсом
+        stats = load_price(content + b'\n', self.partner.id)
+        self.assertEqual((stats['updated'], stats['skipped']), (0, 2))
+
+    def test_gzip_csv_export(self):
+        response, content = self.export(file_format='csv')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('shop-', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(content).decode())))
+        self.assertEqual([(row['id'], json.loads(row['parameters'])) for row in rows],
+                         [('1', {'Цвет': 'черный'}), ('2', {})])
+
+    def test_jsonl_export_by_category(self):
+        _, content = self.export(file_format='jsonl', gzip='false', category_id=15)
+        self.assertEqual([json.loads(line) for line in content.decode().splitlines()], [self.goods[1]])
+
+    def test_other_shop_is_not_exported(self):
+        other = make_user('other@example.com', 'shop')
+        self.client.force_authenticate(other)
+        response = self.client.get('/api/v1/partner/export', {'shop_id': Shop.objects.get().id})
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenCacheTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.key = AuthToken.issue(self.partner)
+        self.load([make_good(1)])
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def test_snapshot_is_served_without_queries(self):
+        user, digest = self.authenticate()
+        self.assertEqual((user.id, digest), (self.partner.id, self.token.digest))
+
+        shop_id = Shop.objects.get().id
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+            self.assertEqual((user.shop.id, user.shop.user), (shop_id, user))
+        self.assertEqual((user.email, user.type, user.is_active), ('partner@example.com', 'shop', True))
+
+    def test_partner_state_loads_shop(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        response = self.client.get('/api/v1/partner/state')
+        self.assertEqual((response.json()['name'], response.json()['state']), ('Связной', True))
+
+    def test_user_without_shop(self):
+        _, key = AuthToken.issue(make_user('buyer@example.com'))
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+
+        with self.assertNumQueries(0), self.assertRaises(Shop.DoesNotExist):
+            user.shop
+
+    def test_shared_cache_survives_local_expiry(self):
+        self.authenticate()
+        token_cache._local.clear()
+
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_user_change_invalidates_snapshot(self):
+        self.authenticate()
+        self.partner.is_active = False
+        self.partner.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deferred_fields_are_loaded_on_access(self):
+        user, _ = self.authenticate()
+        self.assertIn('first_name', user.get_deferred_fields())
+        self.assertEqual(load_full_user(user).username, 'partner@example.com')
+        self.assertFalse(user.get_deferred_fields())
+
+
+class ExpiringTokenTests(ShopTestCase):
+
+    def login(self, device=''):
+        response = self.client.post('/api/v1/user/login', {'email': 'partner@example.com',
+                                                           'password': 'Secret-pass-123', 'device': device})
+        self.assertTrue(response.json()['Status'])
+        return response.json()['Token']
+
+    def logout(self, key, **data):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return self.client.post('/api/v1/user/logout', data)
+
+    def test_token_per_device_is_stored_hashed(self):
+        phone, laptop = self.login('phone'), self.login('laptop')
+
+        self.assertNotEqual(phone, laptop)
+        self.assertEqual(sorted(AuthToken.objects.values_list('device', flat=True)), ['laptop', 'phone'])
+        self.assertFalse(AuthToken.objects.filter(digest__in=[phone, laptop]).exists())
+
+    def test_expired_token_is_rejected(self):
+        key = self.login()
+        AuthToken.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        token_cache.invalidate(AuthToken.hash_key(key))
+
+        with self.assertRaisesMessage(AuthenticationFailed, 'Срок действия токена истёк.'):
+            CachedTokenAuthentication().authenticate_credentials(key)
+
+    def test_sliding_renewal_is_throttled(self):
+        key = self.login()
+        token = AuthToken.objects.get()
+
+        CachedTokenAuthentication().authenticate_credentials(key)
+        self.assertEqual(AuthToken.objects.get().expires_at, token.expires_at)
+
+        AuthToken.objects.update(expires_at=token.expires_at - timedelta(hours=2))
+        token_cache.invalidate(token.digest)
+        CachedTokenAuthentication().authenticate_credentials(key)
+        self.assertGreater(AuthToken.objects.get().expires_at, token.expires_at - timedelta(hours=2))
+
+    def test_logout_revokes_current_or_all_tokens(self):
+        phone, laptop, tablet = self.login('phone'), self.login('laptop'), self.login('tablet')
+
+        self.assertEqual(self.logout(phone).json()['Отозвано токенов'], 1)
+        self.assertEqual(self.logout(phone).status_code, 401)
+        self.assertEqual(self.logout(laptop, all='true').json()['Отозвано токенов'], 2)
+        self.assertEqual(self.logout(tablet).status_code, 401)
+
+    def test_purge_expired_tokens(self):
+        self.login('phone')
+        self.login('laptop')
+        AuthToken.objects.filter(device='phone').update(expires_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(purge_expired_auth_tokens(batch_size=1), 1)
+        self.assertEqual(list(AuthToken.objects.values_list('device', flat=True)), ['laptop'])
+
+
+def buyer_row(email, **fields):
+    row = {'first_name': 'Иван', 'last_name': 'Иванов', 'email': email, 'company': 'ООО Ромашка',
+           'position': 'закупщик', 'password': 'Secret-pass-123'}
+    row.update(fields)
+    return row
+
+
+class RegistrationTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(make_user('admin@example.com', is_staff=True))
+
+    def onboard(self, rows):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/v1/user/onboard', {'users': rows}, format='json')
+        return response, callbacks
+
+    def test_register_writes_user_once(self):
+        self.client.force_authenticate(None)
+        with mock.patch('backend.views.send_email') as send_email:
+            response = self.client.post('/api/v1/user/register', buyer_row('buyer@example.com'))
+
+        self.assertTrue(response.json()['Status'])
+        user = User.objects.get(email='buyer@example.com')
+        self.assertTrue(user.check_password('Secret-pass-123'))
+        self.assertEqual(ConfirmEmailToken.objects.get(user=user).key, response.json()['confirm_token'])
+        send_email.delay.assert_called_once()
+
+    def test_onboard_buyers(self):
+        response, callbacks = self.onboard([buyer_row('first@example.com'),
+                                            buyer_row('second@example.com', password='')])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(callbacks), 1)
+        first, second = User.objects.filter(email__in=['first@example.com', 'second@example.com']).order_by('email')
+        self.assertFalse(first.is_active)
+        self.assertTrue(first.check_password('Secret-pass-123'))
+        # Без пароля покупатель задаёт его через сброс пароля
+        self.assertFalse(second.has_usable_password())
+        self.assertEqual(ConfirmEmailToken.objects.count(), 2)
+
+    def test_onboarding_is_all_or_nothing(self):
+        make_user('taken@example.com')
+        response, callbacks = self.onboard([buyer_row('new@example.com'), buyer_row('taken@example.com'),
+                                            buyer_row('new@example.com'), buyer_row('weak@example.com', password='1')])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.json()['Errors']), ['1', '2', '3'])
+        self.assertFalse(callbacks)
+        self.assertFalse(User.objects.filter(email__in=['new@example.com', 'weak@example.com']).exists())
+
+    def test_onboard_from_csv(self):
+        content = 'first_name,last_name,email,company,position,password\n' \
+                  'Иван,Иванов,csv@example.com,ООО Ромашка,закупщик,\n'
+        upload = SimpleUploadedFile('buyers.csv', content.encode('utf-8-sig'), content_type='text/csv')
+        response = self.client.post('/api/v1/user/onboard', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(email='csv@example.com', is_active=False).exists())
+
+    @override_settings(ONBOARDING_HASH_WORKERS=2)
+    def test_passwords_hashed_in_pool(self):
+        response, _ = self.onboard([buyer_row(f'buyer{number}@example.com') for number in range(3)])
+
+        self.assertEqual(response.status_code, 201)
+        for user in User.objects.filter(email__startswith='buyer'):
+            self.assertTrue(user.check_password('Secret-pass-123'))
+
+
+class ThrottleTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1)])
+        self.client.force_authenticate(self.partner)
+
+    def export(self):
+        with mock.patch('backend.views.export_shop_catalog') as task:
+            task.delay.return_value.id = 'task-id'
+            return self.client.post('/api/v1/partner/export', {'file_format': 'csv'})
+
+    def test_scoped_limit_counts_calls(self):
+        with mock.patch.dict(ScopedCostThrottle.THROTTLE_RATES, {'partner-export': '3/hour'}):
+            responses = [self.export() for _ in range(4)]
+
+        self.assertEqual([response.status_code for response in responses], [202, 202, 202, 429])
+        self.assertEqual((responses[0]['X-RateLimit-Limit'], responses[0]['X-RateLimit-Remaining']), ('3', '2'))
+        self.assertIn('Retry-After', responses[3])
+
+    def test_user_limit_counts_cost(self):
+        with mock.patch.dict(ScopedCostThrottle.THROTTLE_RATES, {'user': '25/minute'}):
+            responses = [self.export() for _ in range(3)]
+
+        # PartnerExport стоит 10 единиц общего лимита пользователя
+        self.assertEqual([response.status_code for response in responses], [202, 202, 429])
+        self.assertEqual((responses[1]['X-RateLimit-Limit'], responses[1]['X-RateLimit-Remaining']), ('25', '5'))
+
+    def test_scoped_limit_is_per_shop(self):
+        with mock.patch.dict(ScopedCostThrottle.THROTTLE_RATES, {'partner-export': '1/hour'}):
+            self.assertEqual(self.export().status_code, 202)
+            self.client.force_authenticate(make_user('other@example.com', 'shop'))
+            self.load([make_good(1)], user=User.objects.get(email='other@example.com'), shop='Другой')
+            self.assertEqual(self.export().status_code, 202)
+
+    def test_concurrency_slot(self):
+        with concurrency_slot('import', 2, 60) as first, concurrency_slot('import', 2, 60) as second:
+            with concurrency_slot('import', 2, 60) as third:
+                self.assertEqual((first, second, third), (True, True, False))
+        with concurrency_slot('import', 2, 60) as acquired:
+            self.assertTrue(acquired)
+
+
+class IdempotencyTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1), make_good(2)])
+        self.buyer = make_user('buyer@example.com')
+        self.client.force_authenticate(self.buyer)
+        self.offers = dict(ProductInfo.objects.values_list('external_id', 'id'))
+
+    def add_to_basket(self, key=None, external_id=1, quantity=1):
+        items = repr([{'product_info': self.offers[external_id], 'quantity': quantity}])
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.client.post('/api/v1/basket', {'items': items}, headers=headers)
+
+    def test_retry_is_replayed(self):
+        first = self.add_to_basket('key-1')
+        second = self.add_to_basket('key-1')
+
+        self.assertEqual(first.json(), {'Status': True, 'Создано объектов': 1})
+        self.assertEqual((second.status_code, second.content), (first.status_code, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_key_reused_with_other_data(self):
+        self.add_to_basket('key-1')
+        response = self.add_to_basket('key-1', external_id=2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.add_to_basket('key-1')
+        self.client.force_authenticate(make_user('other@example.com'))
+        response = self.add_to_basket('key-1')
+
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_request_in_progress(self):
+        # Первый запрос с этим ключом ещё выполняется в другом процессе
+        cache.add('idempotency:{}:BasketView:{}:lock'.format(self.buyer.pk, sha256(b'key-1').hexdigest()), 1)
+        response = self.add_to_basket('key-1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class OrderTransitionTests(ShopTestCase):
+    """Заказ из двух магазинов: каждый поставщик ведёт свою часть."""
+
+    def setUp(self):
+        super().setUp()
+        self.other = make_user('other@example.com', 'shop')
+        self.load([make_good(1, quantity=10)])
+        self.load([make_good(1, quantity=5)], user=self.other, shop='Другой')
+        self.offer, self.other_offer = ProductInfo.objects.order_by('id')
+        self.buyer = make_user('buyer@example.com')
+        self.order = Order.objects.create(user=self.buyer, state='basket')
+        OrderItem.objects.create(order=self.order, product_info=self.offer, quantity=3)
+        OrderItem.objects.create(order=self.order, product_info=self.other_offer, quantity=2)
+
+    def checkout(self):
+        contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+79990000000')
+        self.client.force_authenticate(self.buyer)
+        with mock.patch('backend.views.notify_order_state'), self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/order', {'id': str(self.order.id), 'contact': contact.id})
+
+    def partner_transition(self, user, state):
+        self.client.force_authenticate(user)
+        with mock.patch('backend.views.notify_order_state') as notify, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/partner/orders', {'orders': str(self.order.id), 'state': state})
+        return response.json(), notify
+
+    def stock(self):
+        return list(ProductInfo.objects.order_by('id').values_list('quantity', flat=True))
+
+    def item_states(self):
+        return list(self.order.ordered_items.order_by('product_info_id').values_list('state', flat=True))
+
+    def test_checkout_deducts_stock(self):
+        self.assertTrue(self.checkout().json()['Status'])
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, 'new')
+        self.assertEqual(self.stock(), [7, 3])
+        self.assertEqual(self.item_states(), ['new', 'new'])
+        self.assertTrue(all(self.order.ordered_items.values_list('stock_deducted', flat=True)))
+
+    def test_insufficient_stock(self):
+        OrderItem.objects.filter(product_info=self.other_offer).update(quantity=6)
+
+        self.assertEqual(self.checkout().json()['Errors'], 'Недостаточно товара на складе')
+        self.assertEqual(self.stock(), [10, 5])
+        self.assertEqual(Order.objects.get().state, 'basket')
+
+    def test_suppliers_move_their_parts(self):
+        self.checkout()
+
+        result, notify = self.partner_transition(self.partner, 'confirmed')
+        self.assertEqual(result['Обновлено заказов'], 1)
+        self.assertEqual(self.item_states(), ['confirmed', 'new'])
+        # Статус заказа - наименее продвинутый из статусов частей, письмо не отправляется
+        self.assertEqual(Order.objects.get().state, 'new')
+        notify.delay.assert_not_called()
+
+        result, notify = self.partner_transition(self.other, 'confirmed')
+        self.assertEqual(Order.objects.get().state, 'confirmed')
+        notify.delay.assert_called_once_with([self.order.id])
+
+        # Недопустимый переход своей части пропускается
+        result, _ = self.partner_transition(self.partner, 'delivered')
+        self.assertEqual((result['Обновлено заказов'], result['Пропущено заказов']), (0, 1))
+
+    def test_cancel_returns_own_stock(self):
+        self.checkout()
+
+        self.partner_transition(self.partner, 'canceled')
+        self.assertEqual(self.stock(), [10, 3])
+        self.assertEqual(self.item_states(), ['canceled', 'new'])
+        self.assertEqual(Order.objects.get().state, 'new')
+
+        _, notify = self.partner_transition(self.other, 'canceled')
+        self.assertEqual(self.stock(), [10, 5])
+        self.assertEqual(Order.objects.get().state, 'canceled')
+        notify.delay.assert_called_once_with([self.order.id])
+
+    def test_cancel_does_not_return_stock_never_deducted(self):
+        # Заказ оформлен до списания при оформлении
+        Order.objects.update(state='confirmed')
+        OrderItem.objects.update(state='confirmed')
+
+        self.partner_transition(self.partner, 'canceled')
+        self.assertEqual(self.stock(), [10, 5])
+
+    def test_stock_change_forgets_caches(self):
+        shopper = make_user('shopper@example.com')
+        basket = Order.objects.create(user=shopper, state='basket')
+        OrderItem.objects.create(order=basket, product_info=self.offer, quantity=9)
+        self.assertEqual(get_basket_summary(shopper.id)['warnings'], [])
+        lookup_version, index_version = cache.get('offer-lookup-version'), cache.get('offer-index-version')
+
+        self.checkout()
+
+        self.assertIsNone(cache.get(summary_cache_key(shopper.id)))
+        self.assertEqual(get_basket_summary(shopper.id)['warnings'][0]['available'], 7)
+        self.assertNotEqual(cache.get('offer-lookup-version'), lookup_version)
+        self.assertNotEqual(cache.get('offer-index-version'), index_version)
+
+
+class BasketSummaryTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1, price=1000, quantity=10), make_good(2, price=500, quantity=1)])
+        self.other = make_user('other@example.com', 'shop')
+        self.load([make_good(1, price=900)], user=self.other, shop='Другой')
+        self.buyer = make_user('buyer@example.com')
+        self.client.force_authenticate(self.buyer)
+        self.offers = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+
+    def add(self, *lines):
+        items = repr([{'product_info': self.offers[index], 'quantity': quantity} for index, quantity in lines])
+        self.assertTrue(self.client.post('/api/v1/basket', {'items': items}).json()['Status'])
+
+    def summary(self):
+        response = self.client.get('/api/v1/basket/summary')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_summary(self):
+        self.add((0, 2), (1, 3), (2, 1))
+
+        with self.assertNumQueries(0):
+            summary = self.summary()
+        self.assertEqual((summary['lines'], summary['quantity'], summary['total']), (3, 6, 4400))
+        self.assertEqual([(shop['name'], shop['lines'], shop['total']) for shop in summary['shops']],
+                         [('Связной', 2, 3500), ('Другой', 1, 900)])
+        self.assertEqual(summary['warnings'], [{'item': OrderItem.objects.get(product_info=self.offers[1]).id,
+                                                'product_info': self.offers[1], 'reason': 'stock',
+                                                'requested': 3, 'available': 1}])
+
+    def test_basket_changes_refresh_summary(self):
+        self.add((0, 1), (2, 1))
+        self.assertEqual(self.summary()['lines'], 2)
+
+        item = OrderItem.objects.get(product_info=self.offers[2])
+        self.client.delete('/api/v1/basket', {'items': str(item.id)})
+        self.assertEqual(self.summary()['total'], 1000)
+
+    def test_price_import_forgets_summary(self):
+        self.add((0, 1))
+        self.summary()
+
+        with mock.patch('backend.signals.refresh_price_analytics'), self.captureOnCommitCallbacks(execute=True):
+            self.load([make_good(1, price=1200), make_good(2, price=500, quantity=1)])
+        self.assertEqual(self.summary()['total'], 1200)
+
+    def test_deleted_offers_forget_summary(self):
+        self.add((0, 1), (1, 1), (2, 1))
+        self.assertEqual(self.summary()['lines'], 3)
+
+        # Предложения 2 нет в новом прайсе: позиция корзины удаляется вместе с ним
+        with mock.patch('backend.signals.refresh_price_analytics'), self.captureOnCommitCallbacks(execute=True):
+            self.load([make_good(1, price=1000, quantity=10)])
+        self.assertEqual((self.summary()['lines'], self.summary()['total']), (2, 1900))
+
+        job = create_admin_job(self.buyer, 'delete_offers', 'Удаление предложений', {'pks': [self.offers[2]]})
+        with mock.patch('backend.signals.refresh_price_analytics'), self.captureOnCommitCallbacks(execute=True):
+            execute_admin_job(job)
+        self.assertEqual((self.summary()['lines'], self.summary()['total']), (1, 1000))
+
+    def test_closed_shop_warning(self):
+        self.add((2, 1))
+        with mock.patch('backend.signals.refresh_price_analytics'), self.captureOnCommitCallbacks(execute=True):
+            Shop.objects.filter(user=self.other).set_state(False)
+
+        self.assertEqual([warning['reason'] for warning in self.summary()['warnings']], ['shop_closed'])
+
+
+class PriceAnalyticsTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1, price=1000, price_rrc=1250), make_good(2, price=300, quantity=0)])
+        for email, shop, price in (('second@example.com', 'Второй', 900), ('third@example.com', 'Третий', 1200)):
+            self.load([make_good(1, price=price, price_rrc=1250)], user=make_user(email, 'shop'), shop=shop)
+        self.client.force_authenticate(make_user('admin@example.com', is_staff=True))
+
+    def test_product_prices(self):
+        response = self.client.get('/api/v1/analytics/prices', {'category_id': 224})
+
+        self.assertEqual(response.status_code, 200)
+        # Товара 2 нет в наличии - он не попадает в отчёт
+        [stats] = response.json()
+        self.assertEqual((stats['name'], stats['offers'], stats['price_min'], stats['price_median'],
+                          stats['price_max']), ('Товар 1', 3, 900, 1000.0, 1200))
+        self.assertEqual(stats['margin_avg'], round((350 + 250 + 50) / 1250 * 100 / 3, 2))
+        self.assertEqual(stats['cheapest_shop']['name'], 'Второй')
+        self.assertEqual(stats['cheapest_shop']['margin'], 350)
+
+    def test_shop_summary(self):
+        response = self.client.get('/api/v1/analytics/shops')
+
+        self.assertEqual([(shop['name'], shop['offers'], shop['cheapest_offers']) for shop in response.json()],
+                         [('Второй', 1, 1), ('Связной', 1, 0), ('Третий', 1, 0)])
+
+    def test_reports_are_cached_until_import(self):
+        get_product_price_stats(224)
+        with self.assertNumQueries(0):
+            get_product_price_stats(224)
+
+        ProductInfo.objects.filter(price=900).update(price=800)
+        self.assertEqual(get_product_price_stats(224)[0]['price_min'], 900)
+        rebuild_price_analytics(Shop.objects.get(name='Второй').id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_product_price_stats(224)[0]['price_min'], 800)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.partner)
+        self.assertEqual(self.client.get('/api/v1/analytics/shops').status_code, 403)
+
+
+class BasketOptimizerTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1, price=1000, quantity=2), make_good(2, price=500)])
+        self.load([make_good(1, price=900, quantity=1)], user=make_user('other@example.com', 'shop'), shop='Другой')
+        self.shop, self.other_shop = Shop.objects.order_by('id').values_list('id', flat=True)
+        self.first, self.second = ProductInfo.objects.filter(shop_id=self.shop).order_by(
+            'external_id').values_list('product_id', flat=True)
+
+    def test_cheapest_offers_across_shops(self):
+        result = optimize_basket([(self.first, 3), (self.second, 1)])
+
+        self.assertEqual((result['total'], result['shops'], result['missing']),
+                         (900 + 2 * 1000 + 500, [self.shop, self.other_shop], []))
+        self.assertEqual([(offer['shop_id'], offer['quantity']) for offer in result['items'][0]['offers']],
+                         [(self.other_shop, 1), (self.shop, 2)])
+
+    def test_shop_limit_prefers_fewer_missing(self):
+        result = optimize_basket([(self.first, 3), (self.second, 1)], max_shops=1)
+
+        self.assertEqual((result['total'], result['shops']), (2 * 1000 + 500, [self.shop]))
+        self.assertEqual(result['missing'], [{'product_id': self.first, 'quantity': 1}])
+
+    def test_offer_index_is_cached(self):
+        optimize_basket([(self.first, 1)])
+        with self.assertNumQueries(0):
+            self.assertEqual(optimize_basket([(self.first, 1)])['total'], 900)
+
+    def test_api(self):
+        self.client.force_authenticate(make_user('buyer@example.com'))
+        items = [{'product': self.first, 'quantity': 1}, {'product': self.first, 'quantity': 1}]
+
+        response = self.client.post('/api/v1/basket/optimize', {'items': items, 'max_shops': 2}, format='json')
+        self.assertEqual(response.json()['total'], 900 + 1000)
+        response = self.client.post('/api/v1/basket/optimize', {'items': [{'product': 'x'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+TREE_CATEGORIES = [{'id': 1, 'name': 'Электроника'}, {'id': 224, 'name': 'Смартфоны', 'parent': 1},
+                   {'id': 15, 'name': 'Аксессуары', 'parent': 1}]
+
+
+@mock.patch('backend.signals.refresh_price_analytics', mock.Mock())
+class CategoryTreeTests(ShopTestCase):
+
+    def load(self, goods, user=None, **kwargs):
+        # Счётчики пересчитываются по сигналу после фиксации транзакции импорта
+        with self.captureOnCommitCallbacks(execute=True):
+            return super().load(goods, user, categories=TREE_CATEGORIES, **kwargs)
+
+    def tree(self):
+        def flatten(nodes, depth=0):
+            for node in nodes:
+                yield depth, node['name'], node['offers'], node['shops']
+                yield from flatten(node['children'], depth + 1)
+        return list(flatten(self.client.get('/api/v1/categories/tree').json()))
+
+    def test_counts_by_subtree(self):
+        self.load([make_good(1), make_good(2, category=15), make_good(3, category=15, quantity=0)])
+        self.load([make_good(1)], user=make_user('other@example.com', 'shop'), shop='Другой')
+
+        self.assertEqual(Category.objects.get(id=15).path, '/1/15/')
+        self.assertEqual(self.tree(), [(0, 'Электроника', 3, 2), (1, 'Аксессуары', 1, 1), (1, 'Смартфоны', 2, 2)])
+
+    def test_closed_shop_is_not_counted(self):
+        self.load([make_good(1), make_good(2, category=15)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Shop.objects.set_state(False)
+
+        self.assertEqual(self.tree(), [(0, 'Электроника', 0, 0), (1, 'Аксессуары', 0, 0), (1, 'Смартфоны', 0, 0)])
+
+    def test_moving_category_updates_old_ancestors(self):
+        self.load([make_good(1), make_good(2, category=15)])
+        category = Category.objects.get(id=15)
+        category.parent = None
+        category.save()
+
+        self.assertEqual(self.tree(), [(0, 'Аксессуары', 1, 1), (0, 'Электроника', 1, 1), (1, 'Смартфоны', 1, 1)])
+
+
+@mock.patch('backend.signals.refresh_price_analytics', mock.Mock())
+class OfferVisibilityTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1)])
+        self.load([make_good(2)], user=make_user('other@example.com', 'shop'), shop='Другой')
+        self.client.force_authenticate(self.partner)
+
+    def set_state(self, state):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/partner/state', {'state': state})
+
+    def listed(self):
+        return [offer['model'] for offer in self.client.get('/api/v1/products/').json()['results']]
+
+    def test_closing_shop_hides_offers(self):
+        self.assertEqual(self.listed(), ['model/1', 'model/2'])
+
+        self.assertTrue(self.set_state('false').json()['Status'])
+        self.assertEqual(list(ProductInfo.objects.order_by('id').values_list('is_visible', flat=True)), [False, True])
+        self.assertEqual(self.listed(), ['model/2'])
+
+        self.set_state('true')
+        self.assertEqual(self.listed(), ['model/1', 'model/2'])
+
+    def test_new_offers_of_closed_shop_are_hidden(self):
+        self.set_state('false')
+        self.load([make_good(1), make_good(3)])
+
+        self.assertFalse(ProductInfo.objects.filter(external_id=3).get().is_visible)
+
+    def test_unchanged_state_is_not_updated(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(Shop.objects.filter(user=self.partner).set_state(True), [])
+        self.assertFalse(callbacks)
+
+
+class LargeTableAdminTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(external_id) for external_id in range(1, 6)])
+        self.load([make_good(1), make_good(7)], user=make_user('other@example.com', 'shop'), shop='Другой')
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin@example.com', 'Secret-pass-123',
+                                                              username='admin@example.com', is_active=True))
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/backend/productinfo/', params)
+        self.assertEqual(response.status_code, 200, response.get('Location'))
+        return response.context['cl']
+
+    def test_search_by_external_id_keeps_filters(self):
+        shop = Shop.objects.get(name='Связной')
+
+        cl = self.changelist(q='1', shop__id__exact=shop.id)
+        self.assertEqual([(offer.shop_id, offer.external_id) for offer in cl.result_list], [(shop.id, 1)])
+        cl = self.changelist(q='7', shop__id__exact=shop.id)
+        self.assertFalse(cl.result_list)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_keyset_pagination(self):
+        with mock.patch.object(ProductInfoAdmin, 'list_per_page', 3):
+            cl = self.changelist()
+            first_page = [offer.id for offer in cl.result_list]
+            after = parse_qs(cl.next_page_url.lstrip('?'))['after'][0]
+            cl = self.changelist(after=after)
+
+        ids = sorted(ProductInfo.objects.values_list('id', flat=True), reverse=True)
+        self.assertEqual(first_page, ids[:3])
+        self.assertEqual([offer.id for offer in cl.result_list], ids[3:6])
+        self.assertIsNotNone(cl.next_page_url)
+        self.assertIsNotNone(cl.first_page_url)
+
+    def test_bad_keyset_value(self):
+        response = self.client.get('/admin/backend/productinfo/', {'after': 'x'})
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(ADMIN_JOB_CHUNK_SIZE=2)
+@mock.patch('backend.signals.refresh_price_analytics', mock.Mock())
+class AdminJobTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(external_id) for external_id in range(1, 6)])
+        self.load([make_good(1)], user=make_user('other@example.com', 'shop'), shop='Другой')
+        self.admin = User.objects.create_superuser('admin@example.com', 'Secret-pass-123',
+                                                   username='admin@example.com', is_active=True)
+
+    def queue(self, query='', **data):
+        client = Client()
+        client.force_login(self.admin)
+        with mock.patch('backend.admin.run_admin_job') as task, self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/admin/backend/productinfo/{query}', {'action': 'delete_in_background', **data})
+        self.assertEqual(response.status_code, 302)
+        job = AdminJob.objects.get()
+        task.delay.assert_called_once_with(job.id)
+        return job
+
+    def test_action_queues_job(self):
+        offers = list(ProductInfo.objects.filter(shop__name='Связной', external_id__lte=3).values_list('id', flat=True))
+        job = self.queue(_selected_action=offers)
+
+        self.assertEqual(sorted(job.selection['pks']), offers)
+        # До выполнения задачи предложения не удаляются
+        self.assertEqual(ProductInfo.objects.count(), 6)
+
+    def test_select_across_stores_filters(self):
+        shop = Shop.objects.get(name='Связной')
+        job = self.queue(f'?shop__id__exact={shop.id}', select_across='1', _selected_action=[1])
+
+        self.assertEqual(job.selection, {'filters': {'shop__id__exact': [str(shop.id)]}})
+        self.assertEqual(set(job_queryset(job)), set(ProductInfo.objects.filter(shop=shop)))
+
+    def test_select_across_with_search_stores_ids(self):
+        job = self.queue('?q=2', select_across='1', _selected_action=[1])
+
+        self.assertEqual(job.selection, {'pks': [ProductInfo.objects.get(shop__name='Связной', external_id=2).id]})
+
+    def test_job_without_selection_fails(self):
+        # Задача, поставленная в очередь до перехода на AdminJob.selection
+        job = AdminJob.objects.create(user=self.admin, action='delete_offers', description='Удаление предложений')
+        with self.assertRaises(ValueError):
+            execute_admin_job(job)
+
+        self.assertEqual(AdminJob.objects.get().state, 'failed')
+        self.assertEqual(ProductInfo.objects.count(), 6)
+
+    def test_delete_offers_in_chunks(self):
+        job = create_admin_job(self.admin, 'delete_offers', 'Удаление предложений',
+                               {'filters': {'shop__name': ['Связной'], 'external_id__gte': ['2']}})
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('backend.signals.forget_shop_basket_summaries') as forget:
+            execute_admin_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.total, job.processed), ('done', 4, 4))
+        self.assertEqual(sorted(ProductInfo.objects.values_list('shop__name', 'external_id')),
+                         [('Другой', 1), ('Связной', 1)])
+        forget.assert_called_once_with(Shop.objects.get(name='Связной').id)
+        # История цен удалённых предложений остаётся
+        self.assertEqual(PriceHistory.objects.filter(product_info__isnull=True).count(), 4)
+
+    def test_deleted_offers_return_with_same_price(self):
+        job = create_admin_job(self.admin, 'delete_offers', 'Удаление предложений',
+                               {'filters': {'shop__name': ['Связной'], 'external_id__in': [['4', '5']]}})
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_admin_job(job)
+        self.assertEqual(ProductInfo.objects.filter(shop__name='Связной').count(), 3)
+
+        stats = self.load([make_good(external_id) for external_id in range(1, 6)])
+        self.assertEqual((stats['unchanged'], stats['created']), (False, 2))
+        self.assertEqual(ProductInfo.objects.filter(shop__name='Связной').count(), 5)
+
+    def test_transition_orders(self):
+        buyer = make_user('buyer@example.com')
+        orders = [Order.objects.create(user=buyer, state='basket') for _ in range(3)]
+        for order in orders:
+            OrderItem.objects.create(order=order, product_info=ProductInfo.objects.first(), quantity=1)
+        Order.objects.filter(id__in=[order.id for order in orders[:2]]).transition('new')
+
+        job = create_admin_job(self.admin, 'transition_orders', 'Перевод заказов', {'filters': {}}, state='confirmed')
+        with mock.patch('backend.tasks.notify_order_state') as notify, self.captureOnCommitCallbacks(execute=True):
+            execute_admin_job(job)
+
+        self.assertEqual(sorted(Order.objects.values_list('state', flat=True)), ['basket', 'confirmed', 'confirmed'])
+        notify.delay.assert_called_once_with([orders[0].id, orders[1].id])
+        self.assertEqual(AdminJob.objects.get().state, 'done')
+
+    def test_failed_job(self):
+        job = create_admin_job(self.admin, 'delete_offers', 'Удаление предложений', {'filters': {}})
+        with mock.patch.dict('backend.admin_jobs.ADMIN_JOB_ACTIONS',
+                             {'delete_offers': (ProductInfo, mock.Mock(side_effect=ValueError('сбой')))}), \
+                self.assertRaises(ValueError):
+            execute_admin_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), ('failed', 'сбой'))
+        self.assertEqual(ProductInfo.objects.count(), 6)
+
+
+@mock.patch('backend.signals.refresh_price_analytics', mock.Mock())
+class OfferLookupTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(1), make_good(2), make_good(3)])
+        self.shop = Shop.objects.get(name='Связной')
+        self.offers = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        # Анонимного лимита хватает на два поиска: каждый стоит 5 единиц
+        self.client.force_authenticate(make_user('buyer@example.com'))
+
+    def lookup(self, **data):
+        return self.client.post('/api/v1/products/lookup/', data, format='json')
+
+    def test_request_order_and_missing(self):
+        response = self.lookup(ids=[self.offers[3], 0, self.offers[1], self.offers[3]],
+                               offers=[{'shop': self.shop.id, 'external_id': 2},
+                                       {'shop': self.shop.id, 'external_id': 9}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([offer['model'] for offer in response.json()['offers']], ['model/3', 'model/1', 'model/2'])
+        self.assertEqual(response.json()['missing'], {'ids': [0], 'offers': [{'shop': self.shop.id, 'external_id': 9}]})
+
+    def test_cached_offers(self):
+        ids = list(self.offers.values())
+        # Предложения, их параметры и названия параметров
+        with self.assertNumQueries(3):
+            lookup_offers(ids)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(lookup_offers(ids)['offers']), 3)
+
+    def test_price_import_refreshes_cache(self):
+        lookup_offers([self.offers[1]])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.load([make_good(1, price=500)])
+
+        self.assertEqual(lookup_offers([self.offers[1]])['offers'][0]['price'], 500)
+
+    def test_hidden_offers_are_missing(self):
+        lookup_offers([self.offers[1]])
+        with self.captureOnCommitCallbacks(execute=True):
+            Shop.objects.filter(id=self.shop.id).set_state(False)
+
+        self.assertEqual(lookup_offers([self.offers[1]]),
+                         {'offers': [], 'missing': {'ids': [self.offers[1]], 'offers': []}})
+
+    @override_settings(PRODUCT_LOOKUP_MAX_IDS=2)
+    def test_bad_requests(self):
+        self.assertEqual(self.lookup(ids=[1, 2], offers=[{'shop': 1, 'external_id': 1}]).status_code, 400)
+        self.assertEqual(self.lookup(ids=['x']).status_code, 400)
+        self.assertEqual(self.lookup(offers=[{'shop': 1}]).status_code, 400)
+        self.assertEqual(self.lookup().status_code, 400)
+
+
+class JSONBackendTests(ShopTestCase):
+    data = {'name': 'Смартфон "A/B"', 'price': Decimal('10.50'), 'dt': timezone.now(), 'items': [1, None, True]}
+
+    def test_backends_match_stdlib(self):
+        expected = json.loads(json.dumps(self.data, cls=JSONEncoder))
+        for name in JSON_BACKENDS:
+            with self.subTest(name):
+                try:
+                    dumps, backend_loads = load_json_backend(name)
+                except ImproperlyConfigured:
+                    continue
+                content = dumps(self.data)
+                self.assertIsInstance(content, bytes)
+                self.assertEqual(json.loads(content), expected)
+                self.assertEqual(backend_loads(content), expected)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            load_json_backend('simplejson')
+
+    def test_renderer(self):
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(None), b'')
+        self.assertEqual(json.loads(renderer.render({'model': 'model/1'})), {'model': 'model/1'})
+        # Ответ с отступами отрисовывается стандартным рендерером DRF
+        self.assertEqual(renderer.render({'a': 1}, 'application/json; indent=2'), b'{\n  "a": 1\n}')
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"name": "Товар"}'.encode())), {'name': 'Товар'})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"name":'))
+
+    def test_malformed_request_body(self):
+        self.client.force_authenticate(self.partner)
+        response = self.client.post('/api/v1/products/lookup/', '{"ids": [1', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_json_response(self):
+        response = JsonResponse({'Status': False, 'Error': 'Неправильно указан товар'}, status=400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), {'Status': False, 'Error': 'Неправильно указан товар'})
+        with self.assertRaises(TypeError):
+            JsonResponse([1, 2])
+        self.assertEqual(JsonResponse([1, 2], safe=False).content, b'[1,2]')
+
+
+@mock.patch('backend.signals.refresh_price_analytics', mock.Mock())
+class CompressionTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.load([make_good(external_id) for external_id in range(1, 11)])
+
+    def get(self, path, encoding='gzip', **params):
+        return self.client.get(path, params, HTTP_ACCEPT_ENCODING=encoding)
+
+    def test_choose_encoding(self):
+        with mock.patch.dict(COMPRESSORS, {'br': mock.Mock(), 'zstd': mock.Mock()}):
+            self.assertEqual(choose_encoding('gzip, br, zstd', ('zstd', 'br', 'gzip')), 'zstd')
+            self.assertEqual(choose_encoding('gzip, br;q=0.5', ('zstd', 'br', 'gzip')), 'gzip')
+            self.assertEqual(choose_encoding('*', ('br', 'gzip')), 'br')
+            self.assertIsNone(choose_encoding('gzip;q=0, identity', ('zstd', 'br', 'gzip')))
+        # Кодировка без установленной библиотеки не выбирается
+        with mock.patch.dict(COMPRESSORS, clear=True, values={'gzip': GzipStream}):
+            self.assertEqual(choose_encoding('br, gzip;q=0.1', ('zstd', 'br', 'gzip')), 'gzip')
+
+    def test_compressed_response(self):
+        plain = self.get('/api/v1/products/', encoding='identity')
+        response = self.get('/api/v1/products/')
+
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_small_response(self):
+        response = self.get('/api/v1/categories')
+        self.assertNotIn('Content-Encoding', response)
+
+        with override_settings(COMPRESSION_MIN_SIZE=10):
+            self.assertEqual(self.get('/api/v1/categories')['Content-Encoding'], 'gzip')
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_view_without_compression(self):
+        response = self.client.post('/api/v1/user/login', {'email': 'partner@example.com', 'password': 'x' * 2000},
+                                    HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_html_is_not_compressed(self):
+        # Страница входа в админку содержит токен CSRF
+        response = Client().get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_view_content_types(self):
+        middleware = CompressionMiddleware(lambda request: HttpResponse('<p>страница</p>' * 200))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', middleware(request))
+
+        request.compression = {'content_types': ('text/html',)}
+        self.assertEqual(middleware(request)['Content-Encoding'], 'gzip')
+
+    @override_settings(COMPRESSION_FLUSH_SIZE=1000, COMPRESSION_FLUSH_INTERVAL=60)
+    def test_stream_flushes_by_size(self):
+        chunks = [json.dumps({'id': number, 'model': f'model/{number}'}).encode().ljust(100) for number in range(100)]
+        parts = list(compress_stream(chunks, GzipStream(6)))
+
+        self.assertEqual(gzip.decompress(b''.join(parts)), b''.join(chunks))
+        # Заголовок gzip, сброс после каждых 10 частей и завершение потока, а не сброс после каждой части
+        self.assertEqual(len(parts), 12)
+
+    @override_settings(COMPRESSION_FLUSH_SIZE=10 ** 6, COMPRESSION_FLUSH_INTERVAL=1)
+    def test_stream_flushes_by_time(self):
+        with mock.patch('backend.middleware.time.monotonic', side_effect=[0, 0.5, 1.5, 1.7]):
+            parts = list(compress_stream([b'first', b'second', b'third'], GzipStream(6)))
+
+        # Заголовок gzip, сброс второй части (1.5 с после начала потока) вместе с первой и завершение
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(gzip.decompress(b''.join(parts)), b'firstsecondthird')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RoleSettingsTests(TestCase):
+    # Настройки читаются при запуске процесса, поэтому роль проверяется в отдельном интерпретаторе
+    probe = ('import django, json; django.setup(); from django.conf import settings; from django.urls import resolve; '
+             'from django.urls.exceptions import Resolver404\n'
+             'def routed(path):\n'
+             '    try:\n'
+             '        return bool(resolve(path))\n'
+             '    except Resolver404:\n'
+             '        return False\n'
+             'print(json.dumps({"apps": settings.INSTALLED_APPS, "api": routed("/api/v1/products/"), '
+             '"admin": routed("/admin/")}))')
+
+    def run_role(self, role):
+        return subprocess.run([sys.executable, '-c', self.probe], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                              env={**os.environ, 'DJANGO_ROLE': role})
+
+    def test_role_profiles(self):
+        for role, excluded in settings.ROLE_EXCLUDED_APPS.items():
+            with self.subTest(role):
+                result = self.run_role(role)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                profile = json.loads(result.stdout)
+                self.assertIn('backend.apps.BackendConfig', profile['apps'])
+                self.assertFalse(excluded & set(profile['apps']))
+                self.assertEqual(profile['api'], role in ('api', 'all'))
+                self.assertEqual(profile['admin'], role in ('admin', 'all'))
+
+    def test_unknown_role(self):
+        result = self.run_role('web')
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured', result.stderr)
+
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |   _io',
+            'import time:       200 |        300 | io',
+            'import time:      1500 |       1500 | django',
+            'not an import line',
+        ])
+        self.assertEqual(parse_importtime(output), (1.8, 3, [(1.5, 'django'), (0.3, 'io')]))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchemaTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.content = schema.generate_schema()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'schema.yml')
+        schema_file = override_settings(API_SCHEMA_FILE=self.path)
+        schema_file.enable()
+        self.addCleanup(schema_file.disable)
+        # Схема генерируется один раз на класс, кэш документов не переживает тест
+        for patcher in (mock.patch.object(schema, 'generate_schema', return_value=self.content),
+                        mock.patch.dict(schema.documents, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def check(self):
+        out = io.StringIO()
+        call_command('api_schema', check=True, stdout=out)
+        return out.getvalue()
+
+    def test_check_drift(self):
+        with self.assertRaisesMessage(CommandError, 'не найден'):
+            self.check()
+
+        call_command('api_schema', stdout=io.StringIO())
+        self.assertIn('Схема актуальна', self.check())
+
+        # Переводы строк CRLF после checkout не считаются расхождением
+        with open(self.path, 'wb') as schema_file:
+            schema_file.write(self.content.replace(b'\n', b'\r\n'))
+        self.check()
+
+        with open(self.path, 'ab') as schema_file:
+            schema_file.write(b'x-stale: true\n')
+        with self.assertRaisesMessage(CommandError, 'устарела'):
+            self.check()
+
+    def test_etag(self):
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response['ETag'], f'"{sha256(self.content).hexdigest()}"')
+
+        response = self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+        json_response = self.client.get('/api/schema/', {'format': 'json'})
+        self.assertEqual(json.loads(json_response.content), yaml.safe_load(self.content))
+        self.assertNotEqual(json_response['ETag'], response['ETag'])
+
+    def test_stale_file_is_regenerated(self):
+        with open(self.path, 'wb') as schema_file:
+            schema_file.write(b'openapi: 3.0.3\n')
+        os.utime(self.path, ns=(0, 0))
+
+        self.assertEqual(schema.schema_document('yaml')[0], self.content)
+        with open(self.path, 'rb') as schema_file:
+            self.assertEqual(schema_file.read(), self.content)
@@ -0,0 +1,176 @@
+import math
+import time
+from contextlib import contextmanager
+from secrets import token_hex
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import SimpleRateThrottle
+
+# Скользящее окно из двух фиксированных: предыдущее окно учитывается с весом
+# оставшейся доли, стоимость запроса списывается, только если укладывается в лимит.
+# KEYS: текущее окно, предыдущее окно; ARGV: лимит, длина окна, стоимость, вес предыдущего окна
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local limit = tonumber(ARGV[1])
+local cost = tonumber(ARGV[3])
+local used = math.ceil(previous * tonumber(ARGV[4]) + current)
+if used + cost > limit then
+    return {0, used}
+end
+redis.call('INCRBY', KEYS[1], cost)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]) * 2)
+return {1, used + cost}
+"""
+
+_script = None
+
+
+def redis_client():
+    """Клиент Redis кэша по умолчанию или None, если кэш не в Redis (разработка, тесты)."""
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        return backend._cache.get_client(write=True)
+    return None
+
+
+def sliding_window_hit(key, limit, duration, cost):
+    """
+    Списывает cost из лимита limit за duration секунд для ключа key.
+
+    Возвращает (разрешено, израсходовано, время сброса текущего окна).
+    """
+    global _script
+    now = time.time()
+    window_start = int(now // duration) * duration
+    weight = 1 - (now - window_start) / duration
+    current_key, previous_key = f'{key}:{window_start}', f'{key}:{window_start - duration}'
+
+    client = redis_client()
+    if client is not None:
+        if _script is None:
+            _script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        allowed, used = _script(keys=[cache.make_key(current_key), cache.make_key(previous_key)],
+                                args=[limit, duration, cost, weight], client=client)
+    else:
+        # Без Redis счётчики не атомарны - этого достаточно для разработки
+        current = cache.get(current_key, 0)
+        used = math.ceil(cache.get(previous_key, 0) * weight + current)
+        allowed = used + cost <= limit
+        if allowed:
+            used += cost
+            cache.set(current_key, current + cost, duration * 2)
+    return bool(allowed), used, window_start + duration
+
+
+class CostRateThrottle(SimpleRateThrottle):
+    """
+    Ограничение частоты запросов с общим для всех процессов счётчиком в Redis.
+
+    Лимит задаётся в единицах стоимости: представление объявляет throttle_cost -
+    число или словарь {действие или метод: стоимость}, по умолчанию запрос стоит 1.
+    Оставшийся лимит сохраняется в запросе, заголовки X-RateLimit-* выставляет
+    RateLimitHeadersMiddleware.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_cost(self, request, view):
+        cost = getattr(view, 'throttle_cost', 1)
+        if isinstance(cost, dict):
+            cost = cost.get(getattr(view, 'action', None), cost.get(request.method.lower(), 1))
+        return cost
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        allowed, used, reset = sliding_window_hit(self.key, self.num_requests, self.duration,
+                                                  self.get_cost(request, view))
+        self.reset = reset
+        request._request.rate_limits = getattr(request._request, 'rate_limits', []) + [
+            (self.num_requests, max(self.num_requests - used, 0), int(reset))]
+        return allowed
+
+    def wait(self):
+        return max(self.reset - time.time(), 0)
+
+
+class AnonCostThrottle(CostRateThrottle):
+    """Лимит анонимных запросов по IP"""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserCostThrottle(CostRateThrottle):
+    """Общий лимит пользователя"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class ScopedCostThrottle(CostRateThrottle):
+    """
+    Отдельный лимит для представлений с throttle_scope. Для поставщиков
+    лимит считается на магазин, для остальных - на пользователя или IP.
+
+    Лимит задаётся в вызовах: throttle_cost учитывают только общие лимиты anon и user.
+    """
+
+    def __init__(self):
+        # Лимит зависит от представления и определяется в allow_request
+        pass
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, 'throttle_scope', None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cost(self, request, view):
+        return 1
+
+    def get_cache_key(self, request, view):
+        user = request.user
+        if user and user.is_authenticated:
+            shop_id = getattr(user, 'shop_id', None)
+            ident = f'shop-{shop_id}' if shop_id else user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+@contextmanager
+def concurrency_slot(name, limit, timeout):
+    """
+    Занимает один из limit слотов name на время блока; отдаёт True, если слот получен.
+
+    Слот - ключ кэша с timeout, поэтому слот упавшего процесса освободится сам.
+    """
+    token = token_hex(8)
+    slot = None
+    for number in range(limit):
+        if cache.add(f'slot:{name}:{number}', token, timeout):
+            slot = f'slot:{name}:{number}'
+            break
+    try:
+        yield slot is not None
+    finally:
+        # Не освобождаем слот, который после истечения timeout уже занял кто-то другой
+        if slot is not None and cache.get(slot) == token:
+            cache.delete(slot)
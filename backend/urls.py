@@ -3,7 +3,8 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 
 from backend.views import PartnerUpdate, OrderView, RegisterAccount, LoginAccount, CategoryView, ShopView, \
     BasketView,\
-    AccountDetails, ContactView, ProductInfoView, PartnerState, PartnerOrders, ConfirmAccount
+    AccountDetails, ContactView, ProductInfoView, PartnerState, PartnerOrders, ConfirmAccount, \
+    PartnerExport, LogoutAccount, BuyerOnboarding, BasketSummary, BasketOptimize, CategoryTree, PriceAnalytics, ShopAnalytics
 
 
 from rest_framework.routers import DefaultRouter
@@ -19,16 +20,24 @@ urlpatterns += [
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
+    path('partner/export', PartnerExport.as_view(), name='partner-export'),
     path('user/register', RegisterAccount.as_view(), name='user-register'),
+    path('user/onboard', BuyerOnboarding.as_view(), name='user-onboard'),
     path('user/register/confirm', ConfirmAccount.as_view(), name='user-register-confirm'),
     path('user/details', AccountDetails.as_view(), name='user-details'),
     path('user/contact', ContactView.as_view(), name='user-contact'),
     path('user/login', LoginAccount.as_view(), name='user-login'),
+    path('user/logout', LogoutAccount.as_view(), name='user-logout'),
     path('user/password_reset', reset_password_request_token, name='password-reset'),
     path('user/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('categories', CategoryView.as_view(), name='categories'),
+    path('categories/tree', CategoryTree.as_view(), name='categories-tree'),
     path('shops', ShopView.as_view(), name='shops'),
     path('basket', BasketView.as_view(), name='basket'),
+    path('basket/summary', BasketSummary.as_view(), name='basket-summary'),
+    path('basket/optimize', BasketOptimize.as_view(), name='basket-optimize'),
     path('order', OrderView.as_view(), name='order'),
+    path('analytics/prices', PriceAnalytics.as_view(), name='analytics-prices'),
+    path('analytics/shops', ShopAnalytics.as_view(), name='analytics-shops'),
 
 ]
@@ -1,4 +1,21 @@
 import uuid
 
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+
 def generate_token():
     return str(uuid.uuid4())
+
+
+def parameter_filter(name, value):
+    """
+    Условие отбора предложений по значению параметра с учётом режима хранения параметров.
+    """
+    if settings.PRODUCT_PARAMETERS_STORAGE == 'compact':
+        if connection.vendor == 'postgresql':
+            # @> обслуживается GIN-индексом product_info_parameters_gin
+            return Q(parameters__contains={name: value})
+        return Q(**{f'parameters__{name}': value})
+    return Q(product_parameters__parameter__name=name, product_parameters__value=value)
@@ -1,30 +1,48 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import Q, Sum, F
-from django.http import JsonResponse
+from django.forms import DateTimeField
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.core.mail import EmailMessage
+from backend.analytics import get_product_price_stats, get_shop_price_stats
+from backend.authentication import load_full_user, revoke_tokens
+from backend.categories import get_category_tree
+from backend.basket import forget_basket_summary, get_basket_summary, refresh_basket_summary
+from backend.exporter import EXPORT_FORMATS, export_catalog, export_filename
+from backend.idempotency import idempotent
+from backend.importer import fetch_price, load_price
+from backend.lookup import lookup_offers
+from backend.optimizer import optimize_basket
+from backend.renderers import JsonResponse
+from backend.schema import schema_document
+from backend.onboarding import onboard_buyers, read_onboarding_csv
 from backend.models import User, ConfirmEmailToken
-from backend.utils import generate_token
+from backend.utils import generate_token, parameter_filter
 from drf_spectacular.utils import extend_schema
-from requests import get
-from rest_framework.authtoken.models import Token
+from drf_spectacular.views import SpectacularAPIView
+from rest_framework.decorators import action
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import viewsets
-from yaml import load as load_yaml, Loader
 
-from backend.models import Shop, Category, Product, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken, ProductInfo
+from backend.models import Shop, Category, Order, OrderItem, Contact, ConfirmEmailToken, ProductInfo, \
+    PriceHistory, AuthToken, PARTNER_ORDER_STATES
+from backend.throttling import concurrency_slot
 from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, \
     OrderItemSerializer, OrderSerializer, ContactSerializer, ProductInfoSerializer
 
 from django.dispatch import receiver
 from django_rest_passwordreset.signals import reset_password_token_created
-from backend.tasks import send_email
+from backend.tasks import send_email, export_shop_catalog, notify_order_state
 
 
 # Сигнал для отправки токена сброса пароля
@@ -44,6 +62,8 @@ class RegisterAccount(APIView):
     """
     Для регистрации покупателей
     """
+    # В ответе токен: без сжатия, чтобы его нельзя было подобрать по размеру ответа (BREACH)
+    compression = False
 
     @extend_schema(request=UserSerializer, responses=UserSerializer)
     def post(self, request, *args, **kwargs):
@@ -59,10 +79,12 @@ class RegisterAccount(APIView):
             # Проверяем данные на уникальность
             user_serializer = UserSerializer(data=request.data)
             if user_serializer.is_valid():
-                user = user_serializer.save()
-                user.set_password(request.data['password'])
-                user.save()
-                token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user.id)
+                # Хэш пароля передаём в save(), чтобы пользователь записался одним INSERT;
+                # хэшируем до транзакции, чтобы не держать её открытой
+                password = make_password(request.data['password'])
+                with transaction.atomic():
+                    user = user_serializer.save(password=password)
+                    token = ConfirmEmailToken.objects.create(user=user)
                 send_email.delay("Регистрация успешна", f"Токен подтверждения: {token.key}", user.email)
                 return JsonResponse({'Status': True, 'confirm_token': token.key})
             else:
@@ -71,6 +93,37 @@ class RegisterAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+class BuyerOnboarding(APIView):
+    """
+    Для массовой регистрации покупателей администратором
+    """
+    throttle_cost = 20
+
+    @extend_schema(request=None, responses=None)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+
+        if 'file' in request.FILES:
+            rows = read_onboarding_csv(request.FILES['file'])
+        else:
+            rows = request.data.get('users')
+        if not isinstance(rows, list) or not rows:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, status=400)
+
+        try:
+            users, errors = onboard_buyers(rows)
+        except IntegrityError:
+            # email заняли параллельной регистрацией между проверкой и вставкой
+            return JsonResponse({'Status': False, 'Errors': 'Пользователь с таким email уже существует'}, status=409)
+        if errors:
+            return JsonResponse({'Status': False, 'Errors': errors}, status=400)
+        return JsonResponse({'Status': True, 'Создано пользователей': len(users)}, status=201)
+
+
 class ConfirmAccount(APIView):
     """
     Класс для подтверждения почтового адреса
@@ -101,7 +154,7 @@ class AccountDetails(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
-        serializer = UserSerializer(request.user)
+        serializer = UserSerializer(load_full_user(request.user))
         return Response(serializer.data)
 
     @extend_schema(request=UserSerializer, responses=UserSerializer)
@@ -109,6 +162,8 @@ class AccountDetails(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
 
+        # Сохранение пользователя сбрасывает его токены в кэше (см. backend.signals)
+        load_full_user(request.user)
         if 'password' in request.data:
             try:
                 validate_password(request.data['password'])
@@ -129,6 +184,8 @@ class LoginAccount(APIView):
     """
     Класс для авторизации пользователей
     """
+    # В ответе токен: без сжатия, чтобы его нельзя было подобрать по размеру ответа (BREACH)
+    compression = False
 
     @extend_schema(request=None, responses=None)
     def post(self, request, *args, **kwargs):
@@ -136,8 +193,9 @@ class LoginAccount(APIView):
             user = authenticate(username=request.data['email'], password=request.data['password'])
             if user is not None:
                 if user.is_active:
-                    token, _ = Token.objects.get_or_create(user=user)
-                    return JsonResponse({'Status': True, 'Token': token.key})
+                    # Отдельный токен на каждое устройство, срок продлевается при использовании
+                    token, key = AuthToken.issue(user, request.data.get('device', ''))
+                    return JsonResponse({'Status': True, 'Token': key, 'Expires': token.expires_at})
                 else:
                     return JsonResponse({'Status': False, 'Errors': 'Аккаунт неактивен'})
             else:
@@ -146,6 +204,23 @@ class LoginAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+class LogoutAccount(APIView):
+    """
+    Класс для выхода пользователя: отзывает текущий токен или, с all=true, все токены пользователя
+    """
+
+    @extend_schema(request=None, responses=None)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if str(request.data.get('all', '')).lower() == 'true':
+            revoked = revoke_tokens(request.user.id)
+        else:
+            revoked = revoke_tokens(request.user.id, [request.auth])
+        return JsonResponse({'Status': True, 'Отозвано токенов': revoked})
+
+
 class CategoryView(ListAPIView):
     """
     Класс для просмотра категорий
@@ -154,6 +229,16 @@ class CategoryView(ListAPIView):
     serializer_class = CategorySerializer
 
 
+class CategoryTree(APIView):
+    """
+    Класс для получения дерева категорий с числом предложений и магазинов
+    """
+
+    @extend_schema(request=None, responses=None)
+    def get(self, request, *args, **kwargs):
+        return Response(get_category_tree())
+
+
 class ShopView(ListAPIView):
     """
     Класс для просмотра списка магазинов
@@ -171,13 +256,16 @@ class BasketView(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
-        basket = Order.objects.filter(user_id=request.user.id, state='basket').annotate(
+        basket = Order.objects.filter(user_id=request.user.id, state='basket').prefetch_related(
+            'ordered_items__product_info__product__category',
+            'ordered_items__product_info__product_parameters__parameter').annotate(
             total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
         ).distinct()
         serializer = OrderSerializer(basket, many=True)
         return Response(serializer.data)
 
     @extend_schema(request=OrderItemSerializer, responses=OrderItemSerializer)
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
@@ -189,6 +277,8 @@ class BasketView(APIView):
                 return JsonResponse({'Status': False, 'Errors': 'Некорректный формат данных'})
             else:
                 basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+                # Сводка устарела даже при ошибке: часть позиций могла успеть записаться
+                forget_basket_summary(request.user.id)
                 objects_created = 0
                 for order_item in items_dict:
                     order_item.update({'order': basket.id})
@@ -202,6 +292,7 @@ class BasketView(APIView):
                     else:
                         return JsonResponse({'Status': False, 'Errors': serializer.errors})
 
+                refresh_basket_summary(request.user.id)
                 return JsonResponse({'Status': True, 'Создано объектов': objects_created})
         return JsonResponse({'Status': False, 'Errors': 'Нет необходимых аргументов'})
 
@@ -222,6 +313,7 @@ class BasketView(APIView):
 
             if objects_deleted:
                 deleted_count = OrderItem.objects.filter(query).delete()[0]
+                refresh_basket_summary(request.user.id)
                 return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
         return JsonResponse({'Status': False, 'Errors': 'Нет необходимых аргументов'})
 
@@ -244,14 +336,100 @@ class BasketView(APIView):
                             quantity=order_item['quantity']
                         )
 
+                refresh_basket_summary(request.user.id)
                 return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated})
         return JsonResponse({'Status': False, 'Errors': 'Нет необходимых аргументов'})
 
 
+class BasketSummary(APIView):
+    """
+    Класс для краткой сводки корзины (число позиций, сумма, итоги по магазинам)
+    """
+
+    @extend_schema(request=None, responses=None)
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+        return Response(get_basket_summary(request.user.id))
+
+
+class BasketOptimize(APIView):
+    """
+    Класс для подбора самых дешёвых предложений под список товаров
+    """
+    throttle_cost = 2
+
+    @extend_schema(request=None, responses=None)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        items = request.data.get('items')
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except ValueError:
+                return JsonResponse({'Status': False, 'Errors': 'Некорректный формат данных'}, status=400)
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'Status': False, 'Errors': 'Нет необходимых аргументов'}, status=400)
+
+        # Одинаковые товары складываем в одну позицию
+        lines = {}
+        for item in items:
+            try:
+                product_id, quantity = int(item['product']), int(item['quantity'])
+            except (KeyError, TypeError, ValueError):
+                return JsonResponse({'Status': False, 'Errors': 'Некорректный формат данных'}, status=400)
+            if quantity > 0:
+                lines[product_id] = lines.get(product_id, 0) + quantity
+
+        max_shops = str(request.data.get('max_shops', ''))
+        if max_shops and not max_shops.isdigit():
+            return JsonResponse({'Status': False, 'Errors': 'Неправильно указано число магазинов'}, status=400)
+        return Response(optimize_basket(list(lines.items()), int(max_shops) if max_shops else None))
+
+
+class PriceAnalytics(APIView):
+    """
+    Класс для аналитики цен товаров категории по магазинам
+    """
+    throttle_cost = 5
+
+    @extend_schema(request=None, responses=None)
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+
+        category_id = request.query_params.get('category_id', '')
+        if not category_id.isdigit():
+            return JsonResponse({'Status': False, 'Error': 'Не указана категория'}, status=400)
+        return Response(get_product_price_stats(int(category_id)))
+
+
+class ShopAnalytics(APIView):
+    """
+    Класс для сводки цен и наценок по магазинам
+    """
+
+    @extend_schema(request=None, responses=None)
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+        return Response(get_shop_price_stats())
+
+
 class PartnerUpdate(APIView):
     """
     Класс для обновления прайса от поставщика
     """
+    throttle_scope = 'partner-import'
+    throttle_cost = 10
 
     @extend_schema(request=None, responses=None)
     def post(self, request, *args, **kwargs):
@@ -269,42 +447,103 @@ class PartnerUpdate(APIView):
             except ValidationError as err:
                 return JsonResponse({'Status': False, 'Error': str(err)}, status=400)
             else:
-                response = get(url)
-                data = load_yaml(response.content, Loader=Loader)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-                for category_data in data['categories']:
-                    category, _ = Category.objects.get_or_create(id=category_data['id'], name=category_data['name'])
-                    category.shops.add(shop.id)
-                    category.save()
-
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for good in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=good['name'], category_id=good['category'])
-
-                    product_info = ProductInfo.objects.create(
-                        product_id=product.id,
-                        external_id=good['id'],
-                        model=good['model'],
-                        price=good['price'],
-                        price_rrc=good['price_rrc'],
-                        quantity=good['quantity'],
-                        shop_id=shop.id
-                    )
-
-                    for param_name, param_value in good['parameters'].items():
-                        parameter, _ = Parameter.objects.get_or_create(name=param_name)
-                        ProductParameter.objects.create(
-                            product_info_id=product_info.id,
-                            parameter_id=parameter.id,
-                            value=param_value
-                        )
-
-                return JsonResponse({'Status': True}, status=200)
+                with concurrency_slot('import', settings.IMPORT_CONCURRENCY, settings.IMPORT_SLOT_TIMEOUT) as acquired:
+                    if not acquired:
+                        return JsonResponse({'Status': False, 'Error': 'Слишком много одновременных загрузок прайсов'},
+                                            status=429, headers={'Retry-After': '60'})
+                    import requests
+
+                    try:
+                        response = fetch_price(url)
+                    except requests.Timeout:
+                        return JsonResponse({'Status': False, 'Error': 'Сервер поставщика не ответил вовремя'},
+                                            status=504)
+                    except requests.RequestException as err:
+                        return JsonResponse({'Status': False, 'Error': f'Не удалось скачать прайс: {err}'},
+                                            status=502)
+                    stats = load_price(response.content, request.user.id)
+                # Дальше прайс будет опрашиваться по этой ссылке задачей poll_shop_feeds
+                Shop.objects.filter(user_id=request.user.id).update(
+                    url=url,
+                    feed_etag=response.headers.get('ETag', ''),
+                    feed_last_modified=response.headers.get('Last-Modified', ''))
+
+                return JsonResponse({'Status': True,
+                                     'Прайс не изменился': stats['unchanged'],
+                                     'Создано объектов': stats['created'],
+                                     'Обновлено объектов': stats['updated'],
+                                     'Удалено объектов': stats['deleted'],
+                                     'Пропущено объектов': stats['skipped']}, status=200)
 
         return JsonResponse({'Status': False, 'Error': 'Не указаны все необходимые аргументы'}, status=400)
 
 
+class PartnerExport(APIView):
+    """
+    Класс для выгрузки каталога поставщика (yaml, csv, jsonl)
+    """
+    throttle_scope = 'partner-export'
+    throttle_cost = 10
+
+    def get_shop(self, request):
+        # Администратор может выгрузить любой магазин, поставщик - только свой
+        if request.user.is_staff and request.query_params.get('shop_id'):
+            return Shop.objects.filter(id=request.query_params['shop_id']).first()
+        return Shop.objects.filter(user_id=request.user.id).first()
+
+    @extend_schema(request=None, responses=None)
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if request.user.type != 'shop' and not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+
+        file_format = request.query_params.get('file_format', 'yaml')
+        if file_format not in EXPORT_FORMATS:
+            return JsonResponse({'Status': False, 'Error': 'Неизвестный формат выгрузки'}, status=400)
+
+        shop = self.get_shop(request)
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404)
+
+        category_id = request.query_params.get('category_id')
+        if category_id and not category_id.isdigit():
+            return JsonResponse({'Status': False, 'Error': 'Неправильно указана категория'}, status=400)
+
+        compress = request.query_params.get('gzip', 'true').lower() == 'true'
+        response = StreamingHttpResponse(
+            export_catalog(shop, file_format, category_id, compress),
+            content_type='application/gzip' if compress else EXPORT_FORMATS[file_format][1],
+        )
+        filename = export_filename(shop, file_format, category_id, compress)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @extend_schema(request=None, responses=None)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if request.user.type != 'shop' and not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+
+        file_format = request.data.get('file_format', 'yaml')
+        if file_format not in EXPORT_FORMATS:
+            return JsonResponse({'Status': False, 'Error': 'Неизвестный формат выгрузки'}, status=400)
+
+        shop = self.get_shop(request)
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404)
+
+        category_id = str(request.data.get('category_id', ''))
+        if category_id and not category_id.isdigit():
+            return JsonResponse({'Status': False, 'Error': 'Неправильно указана категория'}, status=400)
+
+        task = export_shop_catalog.delay(shop.id, file_format, int(category_id) if category_id else None)
+        return JsonResponse({'Status': True, 'Task': task.id}, status=202)
+
+
 class PartnerState(APIView):
     """
     Класс для работы со статусом поставщика
@@ -318,7 +557,8 @@ class PartnerState(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
 
-        shop = request.user.shop
+        # У пользователя из снимка токена магазин загружен только с id
+        shop = Shop.objects.get(id=request.user.shop.id)
         serializer = ShopSerializer(shop)
         return Response(serializer.data)
 
@@ -332,7 +572,8 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=(state.lower() == 'true'))
+                # Предложения магазина скрываются тем же UPDATE, кэши сбрасываются по сигналу shop_state_changed
+                Shop.objects.filter(user_id=request.user.id).set_state(state.lower() == 'true')
                 return JsonResponse({'Status': True}, status=200)
             except ValueError as err:
                 return JsonResponse({'Status': False, 'Error': str(err)}, status=400)
@@ -342,7 +583,7 @@ class PartnerState(APIView):
 
 class PartnerOrders(APIView):
     """
-    Класс для получения заказов поставщиками
+    Класс для получения заказов поставщиками и смены их статуса
     """
 
     @extend_schema(request=None, responses=OrderSerializer)
@@ -365,6 +606,42 @@ class PartnerOrders(APIView):
         serializer = OrderSerializer(orders, many=True)
         return Response(serializer.data)
 
+    # перевести заказы в новый статус
+    @extend_schema(request=None, responses=None)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+        if request.user.type != 'shop' and not request.user.is_staff:
+            return JsonResponse({'Status': False, 'Error': 'Доступ ограничен'}, status=403)
+
+        state = request.data.get('state')
+        orders = request.data.get('orders')
+        if not state or not orders:
+            return JsonResponse({'Status': False, 'Error': 'Не указаны все необходимые аргументы'}, status=400)
+
+        if state not in PARTNER_ORDER_STATES:
+            return JsonResponse({'Status': False, 'Error': 'Недопустимый статус заказа'}, status=400)
+
+        if isinstance(orders, str):
+            orders = orders.split(',')
+        order_ids = [int(order_id) for order_id in orders if str(order_id).strip().isdigit()]
+        if not order_ids:
+            return JsonResponse({'Status': False, 'Error': 'Неправильно указаны заказы'}, status=400)
+
+        items = OrderItem.objects.filter(order_id__in=order_ids)
+        if not request.user.is_staff:
+            # Поставщик переводит только свои позиции, статус заказа из нескольких магазинов
+            # пересчитывается по позициям всех поставщиков
+            items = items.filter(product_info__shop__user_id=request.user.id)
+
+        moved, changed = items.transition(state)
+        if changed:
+            transaction.on_commit(lambda: notify_order_state.delay(changed))
+        return JsonResponse({'Status': True,
+                             'Обновлено заказов': len(moved),
+                             'Пропущено заказов': len(set(order_ids)) - len(moved)})
+
 
 class ContactView(APIView):
     """
@@ -457,6 +734,7 @@ class OrderView(APIView):
 
     # разместить заказ из корзины
     @extend_schema(request=None, responses=None)
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -464,38 +742,41 @@ class OrderView(APIView):
         if {'id', 'contact'}.issubset(request.data):
             if request.data['id'].isdigit():
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        state='new')
+                    # Оформление корзины списывает товар со склада в той же транзакции
+                    order_ids = Order.objects.filter(user_id=request.user.id, id=request.data['id']).transition(
+                        'new', contact_id=request.data['contact'])
+                except ValueError as error:
+                    return JsonResponse({'Status': False, 'Errors': str(error)})
                 except IntegrityError as error:
                     print(error)
                     return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'})
                 else:
-                    if is_updated:
-                        # new_order_task(sender=self.__class__, user_id=request.user.id)
-                        user = request.user
-                        send_email.delay("Обновление статуса заказа",
-                                         "Заказ сформирован",
-                                         user.email)
+                    if order_ids:
+                        transaction.on_commit(lambda: notify_order_state.delay(order_ids))
+                        forget_basket_summary(request.user.id)
                         return JsonResponse({'Status': True})
 
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
-class ProductInfoView(viewsets.ModelViewSet):
+class ProductInfoView(viewsets.ReadOnlyModelViewSet):
     """
     Класс для поиска товаров
     """
     queryset = ProductInfo.objects.get_queryset().order_by('id')
     serializer_class = ProductInfoSerializer
-    http_method_names = ['get', ]
-
-    def get(self, request, *args, **kwargs):
-
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
+    # POST - только пакетный поиск lookup, создания предложений через API нет
+    http_method_names = ['get', 'post']
+    # Полный список предложений - самый дорогой запрос каталога
+    throttle_cost = {'list': 5, 'prices': 2, 'lookup': 5}
+
+    def get_queryset(self):
+        # Видимость предложения хранится в нём самом - без соединения с магазином
+        query = Q(is_visible=True)
+        shop_id = self.request.query_params.get('shop_id')
+        category_id = self.request.query_params.get('category_id')
+        parameter = self.request.query_params.get('parameter')
+        value = self.request.query_params.get('value')
 
         if shop_id:
             query = query & Q(shop_id=shop_id)
@@ -503,12 +784,86 @@ class ProductInfoView(viewsets.ModelViewSet):
         if category_id:
             query = query & Q(product__category_id=category_id)
 
-        # фильтруем и отбрасываем дуликаты
+        if parameter and value is not None:
+            query = query & parameter_filter(parameter, value)
+
         queryset = ProductInfo.objects.filter(
             query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+            'shop', 'product__category').order_by('id')
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        if settings.PRODUCT_PARAMETERS_STORAGE == 'compact':
+            return queryset
 
-        return Response(serializer.data)
+        # Параметр встречается у предложения не больше одного раза (unique_product_parameter),
+        # поэтому отбор по нему не размножает строки и distinct() не нужен
+        return queryset.prefetch_related('product_parameters__parameter')
+
+    @extend_schema(request=None, responses=None)
+    @action(detail=True, url_path='prices')
+    def prices(self, request, pk=None):
+        """
+        История цен и остатков предложения, ?since= и ?until= ограничивают период
+        """
+        if not pk.isdigit():
+            return JsonResponse({'Status': False, 'Error': 'Неправильно указан товар'}, status=400)
+
+        history = PriceHistory.objects.filter(product_info_id=pk)
+        period_field = DateTimeField(required=False)
+        for param, lookup in (('since', 'dt__gte'), ('until', 'dt__lt')):
+            try:
+                border = period_field.clean(request.query_params.get(param))
+            except ValidationError as err:
+                return JsonResponse({'Status': False, 'Error': {param: list(err.messages)}}, status=400)
+            if border:
+                history = history.filter(**{lookup: border})
+
+        points = history.order_by('dt').values('dt', 'period', 'price', 'price_min', 'price_max', 'quantity')
+        return Response({'id': int(pk), 'prices': list(points)})
+
+    @extend_schema(request=None, responses=None)
+    @action(detail=False, methods=['post'], url_path='lookup')
+    def lookup(self, request):
+        """
+        Предложения по списку id (ids) и/или пар магазин - внешний ID (offers) одним запросом
+        """
+        ids = request.data.get('ids', [])
+        if isinstance(ids, str):
+            ids = ids.split(',') if ids else []
+        offers = request.data.get('offers', [])
+        if isinstance(offers, str):
+            try:
+                offers = json.loads(offers)
+            except ValueError:
+                return JsonResponse({'Status': False, 'Errors': 'Некорректный формат данных'}, status=400)
+        if not isinstance(ids, list) or not isinstance(offers, list) or not (ids or offers):
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, status=400)
+        if len(ids) + len(offers) > settings.PRODUCT_LOOKUP_MAX_IDS:
+            return JsonResponse({'Status': False, 'Errors': f'Не больше {settings.PRODUCT_LOOKUP_MAX_IDS} предложений '
+                                                            f'за запрос'}, status=400)
+
+        try:
+            offer_ids = [int(offer_id) for offer_id in ids]
+            pairs = [(int(offer['shop']), int(offer['external_id'])) for offer in offers]
+        except (KeyError, TypeError, ValueError):
+            return JsonResponse({'Status': False, 'Errors': 'Некорректный формат данных'}, status=400)
+        return Response(lookup_offers(offer_ids, pairs))
+
+
+class SchemaView(SpectacularAPIView):
+    """
+    Схема OpenAPI из заранее сгенерированного файла вместо разбора всех представлений
+    на каждый запрос. Клиент с актуальной схемой (If-None-Match) получает 304.
+    """
+
+    def _get_schema_response(self, request):
+        renderer, _ = self.perform_content_negotiation(request, force=True)
+        content, etag = schema_document(renderer.format)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content_type = f'{renderer.media_type}; charset={renderer.charset}' if renderer.charset \
+                else renderer.media_type
+            response = HttpResponse(content, content_type=content_type, headers={
+                'Content-Disposition': f'inline; filename="{self._get_filename(request, None)}"'})
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
@@ -3,6 +3,8 @@ from celery import Celery
 
 # Установка DJANGO_SETTINGS_MODULE для использования настроек Django
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shop.settings")
+# Воркер Celery загружает только приложения, нужные задачам (см. DJANGO_ROLE в settings.py)
+os.environ.setdefault("DJANGO_ROLE", "worker")
 
 # Инициализация объекта Celery
 app = Celery("shop")
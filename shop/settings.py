@@ -1,6 +1,8 @@
 import os
+from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -40,12 +42,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Сжатие ответов - раньше остальных, чтобы сжимать уже готовый ответ
+    'backend.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.middleware.RateLimitHeadersMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
 ]
 
@@ -70,6 +75,24 @@ TEMPLATES = [
     },
 ]
 
+# Профиль процесса: api, admin, worker или all (всё в одном процессе, как при разработке).
+# Процесс загружает только нужные своей роли приложения - меньше импортов при старте
+DJANGO_ROLE = os.getenv("DJANGO_ROLE", "all")
+ROLE_EXCLUDED_APPS = {
+    'all': set(),
+    'api': {'baton', 'django.contrib.admin'},
+    'admin': {'drf_spectacular', 'drf_spectacular_sidecar', 'social_django'},
+    'worker': {'baton', 'django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages',
+               'django.contrib.staticfiles', 'drf_spectacular', 'drf_spectacular_sidecar', 'social_django'},
+}
+if DJANGO_ROLE not in ROLE_EXCLUDED_APPS:
+    raise ImproperlyConfigured(f'Неизвестная роль DJANGO_ROLE={DJANGO_ROLE!r}, допустимы: {", ".join(ROLE_EXCLUDED_APPS)}')
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ROLE_EXCLUDED_APPS[DJANGO_ROLE]]
+if 'social_django' not in INSTALLED_APPS:
+    MIDDLEWARE = [name for name in MIDDLEWARE if not name.startswith('social_django.')]
+    TEMPLATES[0]['OPTIONS']['context_processors'] = [
+        name for name in TEMPLATES[0]['OPTIONS']['context_processors'] if not name.startswith('social_django.')]
+
 WSGI_APPLICATION = 'shop.wsgi.application'
 
 # Базовые настройки баз данных
@@ -137,31 +160,158 @@ EMAIL_PORT = 465  # порт для SSL
 EMAIL_USE_SSL = True
 SERVER_EMAIL = EMAIL_HOST_USER
 
+# Библиотека JSON для ответов и разбора запросов API: ujson, orjson или json (стандартная)
+API_JSON_LIBRARY = os.getenv("API_JSON_LIBRARY", "ujson")
+
 # Настройки Rest Framework
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'backend.renderers.FastJSONRenderer',
+        # HTML-интерфейс API нужен только при разработке
+        *(('rest_framework.renderers.BrowsableAPIRenderer',) if DEBUG else ()),
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'backend.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Лимиты в единицах стоимости запроса (throttle_cost представления, по умолчанию 1),
+    # счётчики в Redis общие для всех процессов
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'backend.throttling.AnonCostThrottle',
+        'backend.throttling.UserCostThrottle',
+        'backend.throttling.ScopedCostThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/minute',
-        'user': '100/minute'
+        'user': '100/minute',
+        # Отдельные лимиты тяжёлых операций, на магазин; считаются в вызовах, а не в единицах стоимости
+        'partner-import': '20/hour',
+        'partner-export': '30/hour',
     }
 }
 
+# Импорт прайсов
+# 'rows' - параметр товара хранится отдельной строкой ProductParameter,
+# 'compact' - все параметры предложения лежат в JSON-поле ProductInfo.parameters (GIN-индекс).
+# При смене режима прайсы нужно загрузить заново.
+PRODUCT_PARAMETERS_STORAGE = os.getenv("PRODUCT_PARAMETERS_STORAGE", "rows")
+PARAMETER_CACHE_TIMEOUT = 60 * 60 * 24
+# Параллельная нормализация больших прайсов: число процессов и размер части прайса
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 1))
+IMPORT_PARTITION_SIZE = int(os.getenv("IMPORT_PARTITION_SIZE", 20000))
+
+# История цен: сколько дней хранить отдельные изменения и сколько - суточные агрегаты
+PRICE_HISTORY_RAW_DAYS = int(os.getenv("PRICE_HISTORY_RAW_DAYS", 7))
+PRICE_HISTORY_RETENTION_DAYS = int(os.getenv("PRICE_HISTORY_RETENTION_DAYS", 365))
+
+# Сколько загрузок прайсов по API и задачам может идти одновременно, и через сколько секунд
+# слот упавшей загрузки освобождается сам
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", 4))
+IMPORT_SLOT_TIMEOUT = 60 * 30
+
+# Опрос прайсов поставщиков по Shop.url
+SHOP_FEED_POLL_INTERVAL = int(os.getenv("SHOP_FEED_POLL_INTERVAL", 60 * 60))  # секунды
+SHOP_FEED_CONCURRENCY = int(os.getenv("SHOP_FEED_CONCURRENCY", 8))  # одновременных скачиваний
+SHOP_FEED_TIMEOUT = int(os.getenv("SHOP_FEED_TIMEOUT", 60))
+
+# Каталог для файлов выгрузки каталогов магазинов
+EXPORT_ROOT = os.getenv("EXPORT_ROOT", BASE_DIR / "exports")
+
+# Кэш
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL", "redis://localhost:6379/1"),
+    }
+}
+
+# Ключи идемпотентности (заголовок Idempotency-Key для корзины и заказа): сколько хранить ответ,
+# на сколько блокировать ключ на время выполнения и сколько дубликат ждёт ответа (секунды)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_WAIT = 5
+
+# Сколько хранится сводка корзины (секунды); она пересчитывается при изменении корзины
+# и сбрасывается при загрузке прайса
+BASKET_SUMMARY_TIMEOUT = 60 * 60 * 24
+
+# Сколько хранятся отчёты аналитики цен (секунды); после загрузки прайса они строятся заново
+ANALYTICS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Сколько хранится индекс предложений товара для подбора корзины (секунды);
+# сбрасывается при загрузке прайса и смене статуса магазина
+OFFER_INDEX_TIMEOUT = 60 * 60 * 24
+
+# Сколько хранится дерево категорий (секунды); сбрасывается при изменении категорий и счётчиков
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+# Пакетный поиск предложений: не больше стольких id за запрос; сколько хранится предложение
+# в кэше (секунды) - остатки меняются при оформлении заказов, поэтому недолго
+PRODUCT_LOOKUP_MAX_IDS = 500
+OFFER_LOOKUP_TIMEOUT = 60 * 5
+
+# Админка больших таблиц: начиная с этой оценки PostgreSQL число строк не считается через COUNT(*)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Массовые действия админки выполняются задачей Celery пачками по столько объектов
+ADMIN_JOB_CHUNK_SIZE = 1000
+
+# Сжатие ответов: кодировки в порядке предпочтения (br и zstd - если установлены brotli и zstandard),
+# минимальный размер несжатого ответа (байт) и уровни сжатия. Представление может переопределить
+# их атрибутом compression
+COMPRESSION_ENCODINGS = ('zstd', 'br', 'gzip')
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+# Сжимаются только ответы API (начало типа содержимого). HTML админки и browsable API с токеном CSRF
+# не сжимается (защита от BREACH): страница может включить сжатие сама через compression['content_types']
+COMPRESSION_CONTENT_TYPES = ('application/json', 'application/x-ndjson', 'application/x-yaml', 'application/yaml',
+                             'application/vnd.oai.openapi', 'text/csv')
+# Потоковый ответ сбрасывается клиенту, когда накопилось столько несжатых байт или прошло столько секунд
+# с прошлого сброса: сброс после каждой части раздувает поток служебными блоками
+COMPRESSION_FLUSH_SIZE = 64 * 1024
+COMPRESSION_FLUSH_INTERVAL = 1
+
+# Заранее сгенерированная схема OpenAPI (manage.py api_schema) и модули, от которых она зависит:
+# если какой-то из них изменён позже файла, схема генерируется заново при следующем запросе
+API_SCHEMA_FILE = BASE_DIR / 'schema.yml'
+API_SCHEMA_SOURCES = ('backend.views', 'backend.serializers', 'backend.urls', 'backend.models', 'shop.urls', 'shop.settings')
+
+# Массовая регистрация покупателей: число процессов для хэширования паролей
+ONBOARDING_HASH_WORKERS = int(os.getenv("ONBOARDING_HASH_WORKERS", os.cpu_count() or 1))
+
+# Токены авторизации: срок жизни (продлевается при использовании) и как часто его продлевать
+AUTH_TOKEN_TTL = timedelta(days=int(os.getenv("AUTH_TOKEN_TTL_DAYS", 14)))
+AUTH_TOKEN_RENEW_INTERVAL = timedelta(hours=1)
+
+# Кэш снимков пользователей по токену: время жизни в Redis и в памяти процесса (секунды), размер LRU
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 60))
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv("TOKEN_CACHE_LOCAL_TTL", 5))
+TOKEN_CACHE_LOCAL_SIZE = int(os.getenv("TOKEN_CACHE_LOCAL_SIZE", 10000))
+
 # Celery
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
+CELERY_BEAT_SCHEDULE = {
+    'compact-price-history': {
+        'task': 'backend.tasks.compact_price_history',
+        'schedule': 60 * 60 * 24,
+    },
+    'purge-expired-auth-tokens': {
+        'task': 'backend.tasks.purge_expired_auth_tokens',
+        'schedule': 60 * 60 * 24,
+    },
+    'poll-shop-feeds': {
+        'task': 'backend.tasks.poll_shop_feeds',
+        'schedule': SHOP_FEED_POLL_INTERVAL,
+    },
+}
 
 # Документация OpenAPI
 SPECTACULAR_SETTINGS = {
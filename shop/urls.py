@@ -14,18 +14,34 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
+from django.conf import settings
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
-urlpatterns = [
-    path('admin/', include('baton.urls')),
-    path('admin/', admin.site.urls),
-    path('api/v1/', include('backend.urls', namespace='backend')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+# Маршруты подключаются по приложениям, установленным для роли процесса (DJANGO_ROLE):
+# процесс API не импортирует админку, процессы админки и воркера - представления API
+urlpatterns = []
 
-    path('', include('social_django.urls', namespace='social')),
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
 
-]
+    if apps.is_installed('baton'):
+        urlpatterns.append(path('admin/', include('baton.urls')))
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+if settings.DJANGO_ROLE in ('api', 'all'):
+    urlpatterns.append(path('api/v1/', include('backend.urls', namespace='backend')))
+
+if apps.is_installed('drf_spectacular'):
+    from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
+
+    from backend.views import SchemaView
+
+    urlpatterns += [
+        path('api/schema/', SchemaView.as_view(), name='schema'),
+        path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+        path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    ]
+
+if apps.is_installed('social_django'):
+    urlpatterns.append(path('', include('social_django.urls', namespace='social')))